@@ -1,12 +1,43 @@
-from app.agents.profile_extractor import extract_patient_profile
-from app.agents.trial_searcher import search_trials_for_patient
-from app.agents.eligibility_matcher import check_eligibility
-from app.agents.diversity import calculate_diversity_score
-from app.agents.explainer import generate_explanation
-__all__ = [
-    "extract_patient_profile",
-    "search_trials_for_patient",
-    "check_eligibility", 
-    "calculate_diversity_score",
-    "generate_explanation"
-]
\ No newline at end of file
+"""
+Agent registry
+
+Agents are imported on first access (PEP 562 module __getattr__), so
+importing app.agents stays cheap and loads nothing until an agent is
+used. warm_up() loads them all ahead of the first request.
+"""
+import importlib
+_AGENTS = {
+    "extract_patient_profile": "app.agents.profile_extractor",
+    "forget_document": "app.agents.profile_extractor",
+    "search_trials_for_patient": "app.agents.trial_searcher",
+    "check_eligibility": "app.agents.eligibility_matcher",
+    "check_eligibility_batch": "app.agents.eligibility_matcher",
+    "calculate_diversity_score": "app.agents.diversity",
+    "generate_explanation": "app.agents.explainer"
+}
+__all__ = list(_AGENTS) + ["warm_up"]
+def __getattr__(name: str):
+    module_name = _AGENTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    agent = getattr(importlib.import_module(module_name), name)
+    globals()[name] = agent
+    return agent
+def __dir__():
+    return sorted(list(globals()) + list(_AGENTS))
+def warm_up() -> bool:
+    """
+    Import every agent, start the document parsing workers and
+    initialize the Gemini model (no API call); also loads the gazetteer
+    
+    Returns:
+        True if the LLM is available
+    """
+    from app.utils import llm_client, document_parser, gazetteer
+    
+    for name in _AGENTS:
+        __getattr__(name)
+    # Document parsers are otherwise loaded by the first upload
+    document_parser.warm_up()
+    gazetteer.get_gazetteer()
+    return llm_client.warm_up()
@@ -1,5 +1,7 @@
 from typing import Dict, Any, List
 
+from app.utils import gazetteer
+
 
 # Some medical conditions where one gender is usually less represented
 GENDER_UNDERREP_CONDITIONS = {
@@ -29,12 +31,9 @@ def calculate_diversity_score(patient: Dict, trial: Dict, base_score: float) ->
     if isinstance(trial_locations, str):
         trial_locations = [trial_locations]
 
-    location_text = ""
-    for l in trial_locations:
-        location_text += str(l).lower() + " "
-
-    if "india" in location_text:
-        patient_tier = patient.get("location_tier", "Tier 1")
+    # Sites naming India or an Indian city ("Indiana" is not India)
+    if any(gazetteer.is_in_india(str(l)) for l in trial_locations):
+        patient_tier = patient.get("location_tier") or gazetteer.city_tier(patient.get("location") or "")
 
         if patient_tier == "Tier 2" or patient_tier == "Tier 3":
             diversity_points += 20
@@ -113,7 +112,9 @@ def calculate_diversity_score(patient: Dict, trial: Dict, base_score: float) ->
         "final_score": final_score,
         "diversity_reasons": reasons,
         "priority_level": level,
-        "priority_label": label
+        "priority_label": label,
+        # Informational: None when the patient's city or every site is unknown
+        "nearest_site_km": gazetteer.nearest_distance_km(patient.get("location") or "", trial_locations)
     }
 
 
@@ -165,6 +166,8 @@ def get_diversity_summary(patient: Dict) -> Dict[str, Any]:
     summary = []
 
     tier = patient.get("location_tier")
+    if not tier and patient.get("location"):
+        tier = gazetteer.city_tier(patient["location"])
     if tier in ["Tier 2", "Tier 3"]:
         summary.append({
             "factor": "Geographic",
@@ -1,52 +1,44 @@
 # Eligibility Matcher
 
 import json
+import os
 import re
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
 from datetime import datetime
-from dotenv import load_dotenv 
-import os
 
-load_dotenv()
-
-# Configure Gemini
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-
-# Debug: Check if API key is loaded
-if GEMINI_API_KEY:
-    print(f"✅ GEMINI_API_KEY loaded for Agent 3")
-else:
-    print("❌ WARNING: GEMINI_API_KEY is empty or not found in .env file")
-
-# Import Google Generative AI SDK (same as Agent 1)
-try:
-    import google.generativeai as genai
-    print("✅ Google Generative AI SDK imported successfully (Agent 3)")
-except ImportError as e:
-    print(f"❌ Failed to import google.generativeai: {e}")
-    genai = None
-except Exception as e:
-    print(f"❌ Unexpected error importing genai: {e}")
-    genai = None
-
-model = None
-MODEL_NAME = "gemini-flash-latest"
-
-# Initialize Gemini model (same pattern as Agent 1)
-if genai and GEMINI_API_KEY:
-    try:
-        print(f"🔄 Attempting to initialize Gemini model: {MODEL_NAME}...")
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel(MODEL_NAME)
-        print(" Gemini model initialized successfully (Agent 3)!")
-    except Exception as e:
-        print(f" Failed to initialize Gemini model: {type(e).__name__}: {e}")
-        model = None
-elif not genai:
-    print(" Gemini SDK not available - using fallback eligibility logic")
-elif not GEMINI_API_KEY:
-    print(" GEMINI_API_KEY not configured - using fallback eligibility logic")
+from app.utils import llm_client
+from app.utils.cache import TieredCache, make_cache_key
+from app.utils.database import get_trial_rules, parse_age_limit
+from app.utils.prompt_builder import (
+    estimate_tokens,
+    compact_patient,
+    compact_criteria,
+    record_savings
+)
+if TYPE_CHECKING:
+    # Imports numpy; loaded on first batch screen
+    from app.utils.trial_block import TrialBlock
+from app.utils.criteria_compiler import (
+    COMPILER_VERSION,
+    INCLUSION,
+    criteria_hash,
+    condition_tokens,
+    term_relation,
+    canonical_lab_name,
+    convert_lab_value
+)
+
+# Bump whenever ELIGIBILITY_PROMPT_TEMPLATE or its inputs change, so
+# cached verdicts from the old prompt are no longer used
+ELIGIBILITY_PROMPT_VERSION = "2"
+
+# LLM verdicts keyed by trial, criteria text, patient facts and prompt version
+eligibility_cache = TieredCache(
+    "eligibility",
+    max_entries=int(os.getenv("ELIGIBILITY_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.getenv("ELIGIBILITY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+)
 
 ELIGIBILITY_PROMPT_TEMPLATE = """
 You are an expert clinical trial eligibility checker.
@@ -84,13 +76,121 @@ PATIENT DATA:
 Return ONLY JSON.
 """
 
+# Tiered mode: cheap rule checks first, the LLM only for trials they
+# can't settle. Every result records the tier that decided it in
+# "decided_by": prescreen | compiled_rules | cache | llm | fallback
+TIERED_ELIGIBILITY = os.getenv("ELIGIBILITY_TIERED", "1") == "1"
+
+# Token budget for one trial's prompt (template + patient + criteria);
+# criteria beyond it are trimmed, least relevant first
+ELIGIBILITY_PROMPT_TOKEN_BUDGET = int(os.getenv("ELIGIBILITY_PROMPT_TOKENS", "3000"))
+
+# Batched mode: one patient against several trials in a single call.
+# Sizes are estimated at ~4 characters per token.
+BATCH_INPUT_TOKEN_BUDGET = int(os.getenv("ELIGIBILITY_BATCH_INPUT_TOKENS", "24000"))
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("ELIGIBILITY_BATCH_OUTPUT_TOKENS", "8192"))
+# Output tokens reserved per trial verdict
+BATCH_OUTPUT_TOKENS_PER_TRIAL = 1200
+MAX_BATCH_TRIALS = int(os.getenv("ELIGIBILITY_MAX_BATCH_TRIALS", "8"))
+
+BATCH_ELIGIBILITY_PROMPT_TEMPLATE = """
+You are an expert clinical trial eligibility checker.
+
+Evaluate the ONE patient below against EACH of the {trial_count} trials.
+For every trial, follow these steps EXACTLY:
+
+1. Extract inclusion criteria
+2. Evaluate patient against inclusion (PASS / FAIL / MISSING)
+3. Extract exclusion criteria
+4. Evaluate patient against exclusion (MATCH / NO_MATCH)
+5. Decide overall eligibility
+6. Assign confidence score
+
+IMPORTANT:
+- Today's date: {current_date}
+- Do NOT hallucinate data
+- Assume standard medical units
+- Evaluate each trial independently, using only that trial's criteria
+
+OUTPUT ONLY valid JSON in this EXACT structure, with one entry per trial ID:
+{{
+  "results": {{
+    "<trial ID>": {{
+      "status": "ELIGIBLE | NOT_ELIGIBLE | POSSIBLY_ELIGIBLE",
+      "confidence": 0.0,
+      "inclusion_criteria": [],
+      "exclusion_criteria": [],
+      "missing_data": [],
+      "Final outcome": "Simple human explanation"
+    }}
+  }}
+}}
+
+PATIENT DATA:
+{patient_data}
+
+TRIALS:
+{trials_block}
+
+Return ONLY JSON.
+"""
+
+def prompt_criteria(patient: Dict, patient_data: str, trial_criteria: str) -> str:
+    """Criteria compacted to what's left of the per-trial token budget"""
+    fixed_tokens = estimate_tokens(ELIGIBILITY_PROMPT_TEMPLATE) + estimate_tokens(patient_data)
+    budget = max(500, ELIGIBILITY_PROMPT_TOKEN_BUDGET - fixed_tokens)
+    return compact_criteria(trial_criteria, patient, budget)[0]
+
+def canonical_patient_projection(patient: Dict) -> Dict[str, Any]:
+    """
+    Clinically relevant patient facts in a canonical form
+    Identity, location and extraction metadata don't affect eligibility,
+    so two patients with the same facts share cached verdicts.
+    """
+    medications = []
+    for med in patient.get("medications") or []:
+        if isinstance(med, dict):
+            medications.append([str(med.get("name", "")).strip().lower(), med.get("dose"), med.get("duration_months")])
+        else:
+            medications.append([str(med).strip().lower(), None, None])
+
+    lab_values = {}
+    for name, lab in (patient.get("lab_values") or {}).items():
+        if isinstance(lab, dict):
+            lab_values[name.lower()] = [lab.get("value"), lab.get("unit")]
+        else:
+            lab_values[name.lower()] = [lab, None]
+
+    return {
+        "age": patient.get("age"),
+        "gender": str(patient.get("gender") or "").lower() or None,
+        "conditions": sorted({str(c).strip().lower() for c in patient.get("conditions") or []}),
+        "medications": sorted(medications, key=lambda m: (m[0], str(m[1]), str(m[2]))),
+        "lab_values": lab_values,
+        "allergies": sorted({str(a).strip().lower() for a in patient.get("allergies") or []})
+    }
+
+def eligibility_cache_key(patient: Dict, trial: Dict, trial_criteria: str) -> str:
+    return make_cache_key(
+        trial.get("nct_id"),
+        trial_criteria,
+        canonical_patient_projection(patient),
+        ELIGIBILITY_PROMPT_VERSION
+    )
+
 async def check_eligibility(patient: Dict, trial: Dict) -> Dict[str, Any]:
 
-    if not model:
+    if TIERED_ELIGIBILITY:
+        rules = await load_compiled_rules([trial])
+        result = rule_based_verdict(patient, trial, rules.get(trial.get("nct_id")))
+        if result is not None:
+            return result
+
+    if not llm_client.is_available():
         result = fallback_eligibility_check(patient, trial)
         result["missing_data"].insert(0, {
             "field": "llm_status",
-            "reason": "LLM not configured or unavailable",
+            "reason": llm_client.unavailable_reason(),
             "impact": "SYSTEM"
         })
         return result
@@ -108,25 +208,38 @@ async def check_eligibility(patient: Dict, trial: Dict) -> Dict[str, Any]:
                 "reason": "Trial eligibility criteria missing",
                 "impact": "CRITICAL"
             }],
-            "Final outcome": "Trial eligibility criteria were not provided."
+            "Final outcome": "Trial eligibility criteria were not provided.",
+            "decided_by": "fallback"
         }
 
+    # Repeat trial + patient facts: reuse the earlier verdict
+    cache_key = eligibility_cache_key(patient, trial, trial_criteria)
+    cached = await eligibility_cache.get(cache_key)
+    if cached is not None:
+        cached["decided_by"] = "cache"
+        return cached
+
+    patient_data = compact_patient(patient)
     prompt = ELIGIBILITY_PROMPT_TEMPLATE.format(
-        trial_criteria=trial_criteria,
-        patient_data=json.dumps(patient, indent=2, default=str),
+        trial_criteria=prompt_criteria(patient, patient_data, trial_criteria),
+        patient_data=patient_data,
         current_date=datetime.now().strftime("%Y-%m-%d")
     )
+    record_savings(
+        estimate_tokens(ELIGIBILITY_PROMPT_TEMPLATE + json.dumps(patient, indent=2, default=str) + trial_criteria),
+        estimate_tokens(prompt)
+    )
 
     try:
-        response = model.generate_content(
+        # Runs off the event loop, bounded by the client's timeout
+        response_text = await llm_client.generate_content(
             prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=2048
-            )
+            temperature=0.1,
+            max_output_tokens=2048,
+            operation="eligibility"
         )
-        response_text = response.candidates[0].content.parts[0].text
-        return parse_eligibility_response(response_text)
+        result = parse_eligibility_response(response_text)
+        result["decided_by"] = "llm"
 
     except Exception as e:
         print(f"[LLM ERROR] {e}")
@@ -142,15 +255,209 @@ async def check_eligibility(patient: Dict, trial: Dict) -> Dict[str, Any]:
         )
         return result
 
-def parse_eligibility_response(response_text: str) -> Dict[str, Any]:
+    # Only cache verdicts the LLM actually produced
+    if not any(m.get("field") == "llm_response" for m in result["missing_data"] if isinstance(m, dict)):
+        await eligibility_cache.set(cache_key, result)
+    return result
+
+def plan_eligibility_batches(
+    trial_criteria: List[str],
+    patient_tokens: int
+) -> List[List[int]]:
+    """
+    Group trials into batches that fit the model's token budget
+
+    Args:
+        trial_criteria: Criteria text per trial
+        patient_tokens: Estimated tokens of the (shared) patient block
+
+    Returns:
+        Lists of indexes into trial_criteria, in order
+    """
+    max_by_output = max(1, BATCH_MAX_OUTPUT_TOKENS // BATCH_OUTPUT_TOKENS_PER_TRIAL)
+    max_trials = max(1, min(MAX_BATCH_TRIALS, max_by_output))
+    fixed_tokens = estimate_tokens(BATCH_ELIGIBILITY_PROMPT_TEMPLATE) + patient_tokens
+
+    batches = []
+    current = []
+    current_tokens = fixed_tokens
+    for i, criteria in enumerate(trial_criteria):
+        tokens = estimate_tokens(criteria) + 10
+        if current and (len(current) >= max_trials or current_tokens + tokens > BATCH_INPUT_TOKEN_BUDGET):
+            batches.append(current)
+            current = []
+            current_tokens = fixed_tokens
+        # A trial that alone exceeds the budget still gets a batch of its own
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+async def check_eligibility_batch(
+    patient: Dict,
+    trials: List[Dict],
+    concurrency: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Check one patient against many trials with batched LLM calls
+
+    The patient block is sent once per batch instead of once per trial.
+    Cached verdicts are reused; trials without criteria, single-trial
+    batches and any trial missing or malformed in the batch response go
+    through check_eligibility individually.
+
+    Args:
+        patient: Patient profile dict
+        trials: Trial dicts
+        concurrency: Batches in flight at once for this call
+
+    Returns:
+        Eligibility results in the same order as trials
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(trials)
+
+    if not llm_client.is_available():
+        return [await check_eligibility(patient, trial) for trial in trials]
+
+    rules = await load_compiled_rules(trials) if TIERED_ELIGIBILITY else {}
+    prescreens = fallback_eligibility_check_batch(patient, trials) if TIERED_ELIGIBILITY else []
+    pending = []
+    for i, trial in enumerate(trials):
+        trial_criteria = str(trial.get("eligibility_criteria", "")).strip()
+        if not trial_criteria:
+            continue
+        if TIERED_ELIGIBILITY:
+            results[i] = rule_based_verdict(patient, trial, rules.get(trial.get("nct_id")), prescreens[i])
+            if results[i] is not None:
+                continue
+        cached = await eligibility_cache.get(eligibility_cache_key(patient, trial, trial_criteria))
+        if cached is not None:
+            cached["decided_by"] = "cache"
+            results[i] = cached
+        else:
+            pending.append((i, trial_criteria))
+
+    patient_data = compact_patient(patient)
+    compacted = {i: prompt_criteria(patient, patient_data, criteria) for i, criteria in pending}
+    batches = plan_eligibility_batches(
+        [compacted[i] for i, _ in pending],
+        estimate_tokens(patient_data)
+    )
+    original_patient_tokens = estimate_tokens(json.dumps(patient, indent=2, default=str))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_batch(batch: List[int]):
+        items = [pending[b] for b in batch]
+        record_savings(
+            sum(
+                estimate_tokens(ELIGIBILITY_PROMPT_TEMPLATE + criteria) + original_patient_tokens
+                for _, criteria in items
+            ),
+            estimate_tokens(BATCH_ELIGIBILITY_PROMPT_TEMPLATE + patient_data)
+            + sum(estimate_tokens(compacted[i]) + 10 for i, _ in items)
+        )
+        async with semaphore:
+            verdicts = await evaluate_batch(patient_data, [(trials[i], compacted[i]) for i, _ in items])
+        for (i, trial_criteria), verdict in zip(items, verdicts):
+            if verdict is not None:
+                await eligibility_cache.set(eligibility_cache_key(patient, trials[i], trial_criteria), verdict)
+                results[i] = verdict
+
+    async def run_single(i: int):
+        async with semaphore:
+            results[i] = await check_eligibility(patient, trials[i])
+
+    await asyncio.gather(*[run_batch(batch) for batch in batches if len(batch) > 1])
+    # Per-trial path for anything a batch didn't settle
+    await asyncio.gather(*[run_single(i) for i, r in enumerate(results) if r is None])
+    return results
+
+async def evaluate_batch(
+    patient_data: str,
+    items: List[tuple]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    One LLM call for several (trial, criteria) pairs
+
+    Returns:
+        A result per item, or None for items the response didn't cover
+    """
+    trial_ids = [str(trial.get("nct_id") or f"TRIAL_{n + 1}") for n, (trial, _) in enumerate(items)]
+    if len(set(trial_ids)) != len(trial_ids):
+        trial_ids = [f"TRIAL_{n + 1}" for n in range(len(items))]
+
+    trials_block = "\n\n".join(
+        f"=== TRIAL ID: {trial_id} ===\n{criteria}"
+        for trial_id, (_, criteria) in zip(trial_ids, items)
+    )
+    prompt = BATCH_ELIGIBILITY_PROMPT_TEMPLATE.format(
+        trial_count=len(items),
+        patient_data=patient_data,
+        trials_block=trials_block,
+        current_date=datetime.now().strftime("%Y-%m-%d")
+    )
 
+    try:
+        response_text = await llm_client.generate_content(
+            prompt,
+            temperature=0.1,
+            max_output_tokens=min(BATCH_MAX_OUTPUT_TOKENS, BATCH_OUTPUT_TOKENS_PER_TRIAL * len(items)),
+            operation="eligibility_batch"
+        )
+    except Exception as e:
+        print(f"[LLM ERROR] batch of {len(items)} trials: {e}")
+        return [None] * len(items)
+
+    parsed = parse_batch_eligibility_response(response_text, trial_ids)
+    if any(v is None for v in parsed):
+        print(f"[LLM WARNING] batch response incomplete, {sum(v is None for v in parsed)} trial(s) retried individually")
+    return parsed
+
+def parse_batch_eligibility_response(
+    response_text: str,
+    trial_ids: List[str]
+) -> List[Optional[Dict[str, Any]]]:
+    """Per-trial results from a batch response, None where missing or malformed"""
+    raw = _load_json_response(response_text)
+    if not isinstance(raw, dict):
+        return [None] * len(trial_ids)
+
+    by_id = raw.get("results", raw)
+    if isinstance(by_id, list):
+        by_id = {
+            str(item.get("trial_id") or item.get("nct_id")): item
+            for item in by_id if isinstance(item, dict)
+        }
+    if not isinstance(by_id, dict):
+        return [None] * len(trial_ids)
+
+    parsed = []
+    for trial_id in trial_ids:
+        result = by_id.get(trial_id)
+        if not isinstance(result, dict) or result.get("status") not in {"ELIGIBLE", "NOT_ELIGIBLE", "POSSIBLY_ELIGIBLE"}:
+            parsed.append(None)
+            continue
+        result.pop("trial_id", None)
+        result.pop("nct_id", None)
+        result = normalize_eligibility_result(result)
+        result["decided_by"] = "llm"
+        parsed.append(result)
+    return parsed
+
+def _load_json_response(response_text: str) -> Any:
     clean = response_text.strip()
     clean = clean.removeprefix("```json").removeprefix("```")
     clean = clean.removesuffix("```").strip()
-
     try:
-        result = json.loads(clean)
+        return json.loads(clean)
     except Exception:
+        return None
+
+def parse_eligibility_response(response_text: str) -> Dict[str, Any]:
+
+    result = _load_json_response(response_text)
+    if not isinstance(result, dict):
         return {
             "status": "POSSIBLY_ELIGIBLE",
             "confidence": 0.5,
@@ -164,6 +471,10 @@ def parse_eligibility_response(response_text: str) -> Dict[str, Any]:
             "Final outcome": "LLM response could not be parsed reliably."
         }
 
+    return normalize_eligibility_result(result)
+
+def normalize_eligibility_result(result: Dict[str, Any]) -> Dict[str, Any]:
+
     result.setdefault("status", "POSSIBLY_ELIGIBLE")
     result.setdefault("confidence", 0.7)
     result.setdefault("inclusion_criteria", [])
@@ -176,35 +487,261 @@ def parse_eligibility_response(response_text: str) -> Dict[str, Any]:
 
     return result
 
+def rule_based_verdict(
+    patient: Dict,
+    trial: Dict,
+    rules: Optional[List[Dict]],
+    prescreen: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Tiers 1-2 of the cascade; None means the trial needs the LLM
+
+    1. prescreen: the trial's structured age / sex / condition fields.
+       Only a definite FAIL short-circuits (NOT_ELIGIBLE): age, sex, or
+       related conditions with conflicting numbers (type 1 vs type 2).
+       Condition names sharing no words are left to the later tiers.
+    2. compiled_rules: the trial's compiled criteria, when decisive.
+
+    prescreen may be passed in when it was computed for a whole batch.
+    """
+    if prescreen is None:
+        prescreen = fallback_eligibility_check(patient, trial)
+    if any(i["status"] == "FAIL" for i in prescreen["inclusion_criteria"]):
+        failed = [i["criterion"] for i in prescreen["inclusion_criteria"] if i["status"] == "FAIL"]
+        prescreen["Final outcome"] = f"Patient does not meet: {'; '.join(failed)}"
+        prescreen["decided_by"] = "prescreen"
+        return prescreen
+
+    if rules is not None:
+        result, decisive = evaluate_compiled_rules(patient, rules)
+        if decisive:
+            result["decided_by"] = "compiled_rules"
+            return result
+
+    return None
+
+async def load_compiled_rules(trials: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Compiled rules for trials, by nct_id
+
+    Rules compiled from different criteria text (the trial changed since
+    scripts/compile_criteria.py ran) or by another compiler version are
+    skipped.
+    """
+    by_id = {trial["nct_id"]: trial for trial in trials if trial.get("nct_id")}
+    try:
+        stored = await get_trial_rules(list(by_id))
+    except Exception as e:
+        print(f"[RULES WARNING] compiled rules unavailable: {e}")
+        return {}
+
+    rules = {}
+    for nct_id, entry in stored.items():
+        criteria = str(by_id[nct_id].get("eligibility_criteria", ""))
+        if entry["compiler_version"] == COMPILER_VERSION and entry["criteria_hash"] == criteria_hash(criteria):
+            rules[nct_id] = entry["rules"]
+    return rules
+
+def _lab_value(patient: Dict, lab: str) -> Tuple[Any, Optional[str]]:
+    for name, entry in (patient.get("lab_values") or {}).items():
+        if canonical_lab_name(name) == lab:
+            if isinstance(entry, dict):
+                return entry.get("value"), entry.get("unit")
+            return entry, None
+    return None, None
+
+def _term_holds(terms: List[str], names: List[str]) -> Optional[bool]:
+    """True if a name matches a term, False if none is related, else None"""
+    if not names:
+        return None
+    relations = {
+        term_relation(condition_tokens(term), condition_tokens(name))
+        for term in terms for name in names
+    }
+    if "match" in relations:
+        return True
+    return False if relations == {"none"} else None
+
+def evaluate_rule(patient: Dict, rule: Dict) -> Tuple[Optional[bool], str]:
+    """
+    Does a compiled rule's condition hold for the patient?
+
+    Returns:
+        (True / False / None if the patient data can't tell, patient value)
+    """
+    rule_type = rule["type"]
+
+    if rule_type == "age":
+        age = patient.get("age")
+        if age is None:
+            return None, "unknown"
+        holds = (rule["min"] is None or age >= rule["min"]) and (rule["max"] is None or age <= rule["max"])
+        return holds, str(age)
+
+    if rule_type == "sex":
+        gender = str(patient.get("gender") or "").lower()
+        if gender not in ("male", "female"):
+            return None, gender or "unknown"
+        return gender == rule["value"], gender
+
+    if rule_type == "pregnancy":
+        gender = str(patient.get("gender") or "").lower()
+        if gender == "male":
+            return False, gender
+        if any(re.search(r"pregnan|lactat|breast-?feeding", str(c), re.I) for c in patient.get("conditions") or []):
+            return True, "pregnant / lactating"
+        return None, "unknown"
+
+    if rule_type == "lab":
+        raw_value, unit = _lab_value(patient, rule["lab"])
+        try:
+            value = float(raw_value)
+        except (TypeError, ValueError):
+            return None, "unknown"
+        value = convert_lab_value(rule["lab"], value, unit, rule.get("unit"))
+        if value is None:
+            return None, f"{raw_value} {unit or ''}".strip()
+        low, high = rule["min"], rule["max"]
+        above = low is None or (value > low if rule.get("min_exclusive") else value >= low)
+        below = high is None or (value < high if rule.get("max_exclusive") else value <= high)
+        return above and below, f"{raw_value} {unit or ''}".strip()
+
+    if rule_type == "condition":
+        conditions = [str(c) for c in patient.get("conditions") or []]
+        holds = _term_holds(rule["terms"], conditions)
+        # Names sharing no words may still be one condition ("T2DM" vs
+        # "type 2 diabetes"); only a conflict like type 1 vs type 2 fails
+        if holds is False and not any(
+            condition_tokens(term) & condition_tokens(name)
+            for term in rule["terms"] for name in conditions
+        ):
+            holds = None
+        return holds, ", ".join(conditions) or "none listed"
+
+    if rule_type == "medication":
+        names = [
+            str(m.get("name", "")) if isinstance(m, dict) else str(m)
+            for m in patient.get("medications") or []
+        ]
+        holds = _term_holds(rule["terms"], names)
+        # Not on a named drug now says nothing about past use within a
+        # window, or about drugs of a class the names don't reveal
+        if holds is False and (rule.get("window") or rule.get("drug_class")):
+            holds = None
+        return holds, ", ".join(names) or "none listed"
+
+    return None, ""
+
+def evaluate_compiled_rules(patient: Dict, rules: List[Dict]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Apply a trial's compiled rules to a patient
+
+    Args:
+        patient: Patient profile dict
+        rules: Output of criteria_compiler.compile_criteria
+
+    Returns:
+        (eligibility result, decisive). Decisive when an inclusion rule
+        fails or an exclusion rule matches, or when every criterion was
+        structured and satisfied - otherwise the LLM should decide.
+    """
+    inclusion_results = []
+    exclusion_results = []
+    missing_data = []
+    unparsed = 0
+
+    for rule in rules:
+        if rule["type"] == "text":
+            unparsed += 1
+            continue
+        holds, patient_value = evaluate_rule(patient, rule)
+        if holds is None:
+            missing_data.append({
+                "field": rule.get("lab") or rule["type"],
+                "reason": f"Needed for: {rule['text']}",
+                "impact": "HIGH"
+            })
+        if rule["section"] == INCLUSION:
+            inclusion_results.append({
+                "criterion": rule["text"],
+                "patient_value": patient_value,
+                "status": {True: "PASS", False: "FAIL", None: "MISSING"}[holds],
+                "reasoning": f"Compiled {rule['type']} rule"
+            })
+        else:
+            exclusion_results.append({
+                "criterion": rule["text"],
+                "patient_value": patient_value,
+                "status": {True: "MATCH", False: "NO_MATCH", None: "UNKNOWN"}[holds],
+                "reasoning": f"Compiled {rule['type']} rule"
+            })
+
+    failed = any(i["status"] == "FAIL" for i in inclusion_results)
+    excluded = any(e["status"] == "MATCH" for e in exclusion_results)
+    structured = inclusion_results or exclusion_results
+
+    if failed or excluded:
+        status, confidence, decisive = "NOT_ELIGIBLE", 0.9, True
+        reason = (
+            [i for i in inclusion_results if i["status"] == "FAIL"]
+            + [e for e in exclusion_results if e["status"] == "MATCH"]
+        )[0]
+        outcome = f"Patient does not meet: {reason['criterion']}"
+    elif structured and not unparsed and not missing_data:
+        status, confidence, decisive = "ELIGIBLE", 0.85, True
+        outcome = "Patient meets every eligibility criterion."
+    else:
+        status, confidence, decisive = "POSSIBLY_ELIGIBLE", 0.5, False
+        outcome = "Some criteria need review beyond the structured rules."
+
+    return {
+        "status": status,
+        "confidence": confidence,
+        "inclusion_criteria": inclusion_results,
+        "exclusion_criteria": exclusion_results,
+        "missing_data": missing_data,
+        "unparsed_criteria": unparsed,
+        "Final outcome": outcome
+    }, decisive
+
 def fallback_eligibility_check(patient: Dict, trial: Dict) -> Dict[str, Any]:
 
     inclusion_results = []
     exclusion_results = []
     missing_data = []
 
+    # Limits compared in months: "28 Days" and "6 Months" are not 28 / 6 years
     patient_age = patient.get("age")
-    min_age = parse_age_value(trial.get("minimum_age"))
-    max_age = parse_age_value(trial.get("maximum_age"))
+    min_label, max_label = trial.get("minimum_age"), trial.get("maximum_age")
+    min_months, min_readable = parse_age_limit(min_label)
+    max_months, max_readable = parse_age_limit(max_label)
 
-    if min_age or max_age:
+    if min_months is not None or max_months is not None or not (min_readable and max_readable):
         if patient_age is not None:
-            if min_age and patient_age < min_age:
+            patient_months = patient_age * 12
+            if min_months is not None and patient_months < min_months:
                 inclusion_results.append({
-                    "criterion": f"Minimum age {min_age}",
+                    "criterion": f"Minimum age {min_label}",
                     "patient_value": str(patient_age),
                     "status": "FAIL",
                     "reasoning": "Below minimum age"
                 })
-            elif max_age and patient_age > max_age:
+            elif max_months is not None and patient_months > max_months:
                 inclusion_results.append({
-                    "criterion": f"Maximum age {max_age}",
+                    "criterion": f"Maximum age {max_label}",
                     "patient_value": str(patient_age),
                     "status": "FAIL",
                     "reasoning": "Above maximum age"
                 })
+            elif not (min_readable and max_readable):
+                missing_data.append({
+                    "field": "age",
+                    "reason": f"Age limit not understood: {min_label if not min_readable else max_label}",
+                    "impact": "CRITICAL"
+                })
             else:
                 inclusion_results.append({
-                    "criterion": f"Age {min_age or 0}-{max_age or 'N/A'}",
+                    "criterion": f"Age {min_label if min_months is not None else 0} - {max_label if max_months is not None else 'N/A'}",
                     "patient_value": str(patient_age),
                     "status": "PASS",
                     "reasoning": "Age within allowed range"
@@ -243,16 +780,30 @@ def fallback_eligibility_check(patient: Dict, trial: Dict) -> Dict[str, Any]:
 
     if trial_conditions:
         if patient_conditions:
-            match = any(
-                pc.lower() in " ".join(trial_conditions).lower()
+            # Word-level, so "Type 2 Diabetes" matches "Diabetes Mellitus, Type 2".
+            # Only a number conflict between related names (type 1 vs type 2)
+            # fails; names sharing no words ("T2DM", "High blood pressure")
+            # may be synonyms, so the LLM decides
+            pairs = [
+                (condition_tokens(pc), condition_tokens(tc))
                 for pc in patient_conditions
-            )
-            inclusion_results.append({
-                "criterion": f"Condition: {', '.join(trial_conditions)}",
-                "patient_value": ", ".join(patient_conditions),
-                "status": "PASS" if match else "FAIL",
-                "reasoning": "Condition match check"
-            })
+                for tc in trial_conditions
+            ]
+            match = any(term_relation(p, t) != "none" for p, t in pairs)
+            related = any(p & t for p, t in pairs)
+            if match or related:
+                inclusion_results.append({
+                    "criterion": f"Condition: {', '.join(trial_conditions)}",
+                    "patient_value": ", ".join(patient_conditions),
+                    "status": "PASS" if match else "FAIL",
+                    "reasoning": "Condition match check"
+                })
+            else:
+                missing_data.append({
+                    "field": "conditions",
+                    "reason": f"No shared words with trial conditions: {', '.join(trial_conditions)}",
+                    "impact": "CRITICAL"
+                })
         else:
             missing_data.append({
                 "field": "conditions",
@@ -282,31 +833,27 @@ def fallback_eligibility_check(patient: Dict, trial: Dict) -> Dict[str, Any]:
         "inclusion_criteria": inclusion_results,
         "exclusion_criteria": exclusion_results,
         "missing_data": missing_data,
-        "Final outcome": "Eligibility determined using fallback rule-based logic."
+        "Final outcome": "Eligibility determined using fallback rule-based logic.",
+        "decided_by": "fallback"
     }
 
-def parse_age_value(age_str: Any) -> int | None:
-    if not age_str:
-        return None
-    try:
-        match = re.search(r"\d+", str(age_str))
-        return int(match.group()) if match else None
-    except Exception:
-        return None
+def fallback_eligibility_check_batch(
+    patient: Dict,
+    trials: "List[Dict] | TrialBlock"
+) -> List[Dict[str, Any]]:
+    """
+    fallback_eligibility_check for many trials in one vectorized pass
+
+    Args:
+        patient: Patient profile dict
+        trials: Trial dicts, or a TrialBlock built from them (reuse the
+                block when screening several patients against the same trials)
+
+    Returns:
+        Results in trial order, identical to calling
+        fallback_eligibility_check per trial
+    """
+    from app.utils.trial_block import TrialBlock
     
-test_patient = {
-    "age": 45,
-    "gender": "Male",
-    "conditions": ["Type 2 Diabetes"]
-}
-
-test_trial = {
-    "eligibility_criteria": "Age 18-65, Type 2 Diabetes",
-    "minimum_age": "18",
-    "maximum_age": "65",
-    "conditions": ["Type 2 Diabetes"]
-}
-
-
-result = asyncio.run(check_eligibility(test_patient, test_trial))
-print(json.dumps(result, indent=2))
\ No newline at end of file
+    block = trials if isinstance(trials, TrialBlock) else TrialBlock(trials)
+    return block.result_dicts(patient)
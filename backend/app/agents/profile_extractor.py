@@ -11,26 +11,42 @@ import os
 import json
 import re
 import time
-from typing import Optional
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 
-import google.generativeai as genai
-from PIL import Image
-import PyPDF2
-from dotenv import load_dotenv 
-
 from app.models.patient import PatientProfile, PatientExtractionResult, Medication, LabValue
+from app.utils import llm_client, document_parser, gazetteer
+from app.utils.cache import TieredCache
+from app.utils.lab_report_parser import parse_lab_report
+from app.utils.prompt_builder import estimate_tokens, select_passages, record_savings
+
+# Tokens of document text sent with the extraction prompt (about the
+# size of the old 8000-character cut, but filled with the most relevant lines)
+EXTRACTION_DOCUMENT_TOKEN_BUDGET = int(os.getenv("EXTRACTION_DOCUMENT_TOKENS", "2000"))
 
+# Scanned PDFs: page images per Vision request, and requests in flight per document
+SCANNED_PAGES_PER_REQUEST = int(os.getenv("SCANNED_PAGES_PER_REQUEST", "4"))
+SCANNED_REQUEST_CONCURRENCY = int(os.getenv("SCANNED_REQUEST_CONCURRENCY", "3"))
 
-load_dotenv()
+# Machine-generated lab reports are read with patterns first; the LLM is
+# skipped when that profile has the required fields and this confidence
+EXTRACTION_FAST_PATH = os.getenv("EXTRACTION_FAST_PATH", "1") == "1"
+EXTRACTION_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("EXTRACTION_FAST_PATH_MIN_CONFIDENCE", "0.5"))
 
-# Configure Gemini
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# Bump whenever EXTRACTION_PROMPT or the parsing of its response changes,
+# so results cached from the old prompt are no longer used
+EXTRACTION_PROMPT_VERSION = "1"
 
-# Gemini model
-model = genai.GenerativeModel('gemini-flash-latest') if GEMINI_API_KEY else None
+# Successful extractions keyed by document SHA-256 and prompt version.
+# Holds patient data: EXTRACTION_CACHE_PERSISTENT=0 keeps it in memory only,
+# and forget_document() evicts a document on request
+extraction_cache = TieredCache(
+    "extraction",
+    max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    persistent=os.getenv("EXTRACTION_CACHE_PERSISTENT", "1") == "1"
+)
 
 
 EXTRACTION_PROMPT = """
@@ -77,24 +93,57 @@ Document content:
 """
 
 
-async def extract_patient_profile(file_path: str, file_ext: str) -> PatientExtractionResult:
+def extraction_cache_key(digest: str) -> str:
+    # Digest first, so every version of a document's entry shares a prefix
+    return f"{digest}:{EXTRACTION_PROMPT_VERSION}"
+
+
+async def forget_document(digest: str) -> int:
+    """Evict a document's cached extractions (all prompt versions), returns the count removed"""
+    return await extraction_cache.delete_prefix(f"{digest}:")
+
+
+async def extract_patient_profile(
+    file_path: str,
+    file_ext: str,
+    digest: Optional[str] = None
+) -> PatientExtractionResult:
     """
     Extract patient profile from upload ed document
     
     Args:
         file_path: Path to uploaded file
         file_ext: File extension (.pdf, .jpg, .png)
+        digest: SHA-256 of the file; when given, a previous successful
+                extraction of the same document is returned from cache
     
     Returns:
         PatientExtractionResult with extracted profile or error
     """
+    if digest is None:
+        return await _extract_patient_profile(file_path, file_ext)
+    
+    cached = await extraction_cache.get(extraction_cache_key(digest))
+    if cached is not None:
+        print("[CACHE] extraction hit - skipping document parsing and LLM")
+        return PatientExtractionResult(**{**cached, "extraction_time_seconds": 0.0})
+    
+    result = await _extract_patient_profile(file_path, file_ext)
+    result.document_digest = digest
+    if result.success:
+        await extraction_cache.set(extraction_cache_key(digest), result.dict())
+    return result
+
+
+async def _extract_patient_profile(file_path: str, file_ext: str) -> PatientExtractionResult:
+    """Parse the document and run the extraction LLM call"""
     try:
         # Extract text/image content
         if file_ext == ".pdf":
-            content = extract_text_from_pdf(file_path) 
+            content = await document_parser.parse_pdf_text(file_path)
             if not content.strip():
-                # PDF might be scanned - try as image
-                return await extract_from_image(file_path)
+                # No text layer - the PDF is scanned
+                return await extract_from_scanned_pdf(file_path)
             return await extract_from_text(content)
         else:
             # Image file - use Vision
@@ -107,42 +156,41 @@ async def extract_patient_profile(file_path: str, file_ext: str) -> PatientExtra
         )
 
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text content from PDF file"""
-    try:
-        text = ""
-        with open(file_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        print(f"Error extracting PDF text: {e}")
-        return ""
-
-
 async def extract_from_text(text: str) -> PatientExtractionResult:
-    """Extract patient info from text using Gemini"""
-    if not model:
+    """Extract patient info from text, with patterns when they suffice, else Gemini"""
+    if EXTRACTION_FAST_PATH:
+        start_time = time.time()
+        result = build_extraction_result(parse_lab_report(text))
+        if not result.missing_fields and result.confidence >= EXTRACTION_FAST_PATH_MIN_CONFIDENCE:
+            result.extraction_time_seconds = time.time() - start_time
+            print(f"⚡ Read lab report without Gemini (confidence {result.confidence:.2f})")
+            return result
+    
+    if not llm_client.is_available():
         return PatientExtractionResult(
             success=False,
-            error="Gemini API not configured. Please set GEMINI_API_KEY."
+            error=llm_client.unavailable_reason()
         )
     
     try:
-        prompt = EXTRACTION_PROMPT + text[:8000]  # Limit text length
+        prompt = EXTRACTION_PROMPT + select_passages(text, EXTRACTION_DOCUMENT_TOKEN_BUDGET)
+        record_savings(estimate_tokens(EXTRACTION_PROMPT + text), estimate_tokens(prompt))
         start_time = time.time()
-        response = model.generate_content(
+        response_text = await llm_client.generate_content(
             prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=2048
-            )
+            temperature=0.1,
+            max_output_tokens=2048,
+            operation="extraction_text"
         )
         
         extraction_time = time.time() - start_time
-        return parse_extraction_response(response.text, extraction_time)
+        return parse_extraction_response(response_text, extraction_time)
         
+    except asyncio.TimeoutError:
+        return PatientExtractionResult(
+            success=False,
+            error="Gemini API call timed out"
+        )
     except Exception as e:
         return PatientExtractionResult(
             success=False,
@@ -152,25 +200,30 @@ async def extract_from_text(text: str) -> PatientExtractionResult:
 
 async def extract_from_image(file_path: str) -> PatientExtractionResult:
     """Extract patient info from image using Gemini Vision"""
-    if not model:
+    if not llm_client.is_available():
         return PatientExtractionResult(
             success=False,
-            error="Gemini API not configured. Please set GEMINI_API_KEY."
+            error=llm_client.unavailable_reason()
         )
     
     try:
-        img = Image.open(file_path)
+        # Decoded in the document worker pool, off the event loop
+        img = await document_parser.load_image(file_path)
         start_time = time.time()
-        response = model.generate_content(
+        response_text = await llm_client.generate_content(
             [EXTRACTION_PROMPT, img],
-            generation_config=genai.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=2048
-            )
+            temperature=0.1,
+            max_output_tokens=2048,
+            operation="extraction_image"
         )
         extraction_time = time.time() - start_time
-        return parse_extraction_response(response.text, extraction_time)
+        return parse_extraction_response(response_text, extraction_time)
         
+    except asyncio.TimeoutError:
+        return PatientExtractionResult(
+            success=False,
+            error="Gemini Vision call timed out"
+        )
     except Exception as e:
         return PatientExtractionResult(
             success=False,
@@ -178,9 +231,136 @@ async def extract_from_image(file_path: str) -> PatientExtractionResult:
         )
 
 
-def parse_extraction_response(response_text: str, extraction_time: float = 0.0) -> PatientExtractionResult:
-    """Parse Gemini response into PatientProfile"""
+async def extract_from_scanned_pdf(file_path: str) -> PatientExtractionResult:
+    """
+    Extract patient info from a scanned (image-only) PDF using Gemini Vision
+    
+    Page images are sent SCANNED_PAGES_PER_REQUEST at a time, up to
+    SCANNED_REQUEST_CONCURRENCY requests at once, and the partial
+    profiles are merged. Pages whose request fails are reported in
+    warnings; the extraction fails only if every request does.
+    """
+    if not llm_client.is_available():
+        return PatientExtractionResult(
+            success=False,
+            error=llm_client.unavailable_reason()
+        )
     
+    pages = await document_parser.parse_pdf_images(file_path)
+    if not pages:
+        return PatientExtractionResult(
+            success=False,
+            error="PDF has no text and no readable page images"
+        )
+    
+    groups = [
+        pages[i:i + SCANNED_PAGES_PER_REQUEST]
+        for i in range(0, len(pages), SCANNED_PAGES_PER_REQUEST)
+    ]
+    semaphore = asyncio.Semaphore(SCANNED_REQUEST_CONCURRENCY)
+    
+    async def extract_group(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        async with semaphore:
+            response_text = await llm_client.generate_content(
+                [EXTRACTION_PROMPT, *group],
+                temperature=0.1,
+                max_output_tokens=2048,
+                operation="extraction_scanned"
+            )
+        return load_extraction_json(response_text)
+    
+    start_time = time.time()
+    outcomes = await asyncio.gather(*[extract_group(group) for group in groups], return_exceptions=True)
+    extraction_time = time.time() - start_time
+    
+    partials = []
+    warnings = []
+    for index, outcome in enumerate(outcomes):
+        first_page = index * SCANNED_PAGES_PER_REQUEST + 1
+        last_page = first_page + len(groups[index]) - 1
+        if isinstance(outcome, BaseException):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            warnings.append(f"Scanned pages {first_page}-{last_page} not extracted: {type(outcome).__name__}: {outcome}")
+        else:
+            partials.append(outcome)
+    if not partials:
+        return PatientExtractionResult(
+            success=False,
+            error=f"Error processing scanned PDF: {warnings[0]}",
+            warnings=warnings
+        )
+    
+    data, conflicts = merge_extractions(partials)
+    result = build_extraction_result(data, extraction_time)
+    result.warnings.extend(warnings + conflicts)
+    return result
+
+
+def merge_extractions(partials: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Merge per-page extraction JSON into one, in page order
+    
+    Single values (age, gender, location) and lab values: the first page
+    that has one wins, and a different value on a later page is reported.
+    Lists are combined without duplicates; a medication seen again fills
+    in the dose / frequency it was missing.
+    
+    Returns:
+        (merged extraction JSON, warnings about conflicting values)
+    """
+    merged: Dict[str, Any] = {
+        "age": None,
+        "gender": None,
+        "location": None,
+        "conditions": [],
+        "medications": [],
+        "lab_values": {},
+        "allergies": []
+    }
+    conflicts = []
+    medications: Dict[str, Dict[str, Any]] = {}
+    
+    for data in partials:
+        for field in ("age", "gender", "location"):
+            value = data.get(field)
+            if value in (None, ""):
+                continue
+            if merged[field] in (None, ""):
+                merged[field] = value
+            elif str(value).strip().lower() != str(merged[field]).strip().lower():
+                conflicts.append(f"Conflicting {field} across pages: {merged[field]} / {value} (kept {merged[field]})")
+        
+        for field in ("conditions", "allergies"):
+            seen = {str(item).strip().lower() for item in merged[field]}
+            for item in data.get(field) or []:
+                if item and str(item).strip().lower() not in seen:
+                    seen.add(str(item).strip().lower())
+                    merged[field].append(item)
+        
+        for med in data.get("medications") or []:
+            if not isinstance(med, dict) or not med.get("name"):
+                continue
+            key = str(med["name"]).strip().lower()
+            if key not in medications:
+                medications[key] = dict(med)
+                merged["medications"].append(medications[key])
+            else:
+                for detail in ("dose", "frequency"):
+                    if not medications[key].get(detail) and med.get(detail):
+                        medications[key][detail] = med[detail]
+        
+        for name, lab in (data.get("lab_values") or {}).items():
+            if name not in merged["lab_values"]:
+                merged["lab_values"][name] = lab
+            elif lab != merged["lab_values"][name]:
+                conflicts.append(f"Conflicting {name} across pages: kept the first page's value")
+    
+    return merged, conflicts
+
+
+def load_extraction_json(response_text: str) -> Dict[str, Any]:
+    """Extraction JSON from a Gemini response (raises json.JSONDecodeError)"""
     # Clean response - remove markdown code fences
     clean_text = response_text.strip()
     if clean_text.startswith("```json"):
@@ -189,114 +369,104 @@ def parse_extraction_response(response_text: str, extraction_time: float = 0.0)
         clean_text = clean_text[3:]
     if clean_text.endswith("```"):
         clean_text = clean_text[:-3]
-    clean_text = clean_text.strip()
-    
+    data = json.loads(clean_text.strip())
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("Expected a JSON object", clean_text, 0)
+    return data
+
+
+def parse_extraction_response(response_text: str, extraction_time: float = 0.0) -> PatientExtractionResult:
+    """Parse Gemini response into PatientProfile"""
     try:
-        data = json.loads(clean_text)
-        
-        # Build profile
-        medications = []
-        for med in data.get("medications", []):
-            if isinstance(med, dict):
-                medications.append(Medication(
-                    name=med.get("name", "Unknown"),
-                    dose=med.get("dose"),
-                    frequency=med.get("frequency")
-                ))
-        
-        lab_values = {}
-        for key, value in data.get("lab_values", {}).items():
-            if isinstance(value, dict) and "value" in value:
-                lab_values[key] = LabValue(
-                    value=value["value"],
-                    unit=value.get("unit", "")
-                )
-        
-        # Determine location tier
-        location = data.get("location", "")
-        location_tier = determine_location_tier(location)
-        
-        profile = PatientProfile(
-            age=data.get("age"),
-            gender=data.get("gender"),
-            location=location,
-            location_tier=location_tier,
-            conditions=data.get("conditions", []),
-            medications=medications,
-            lab_values=lab_values,
-            allergies=data.get("allergies", []),
-            extracted_date=datetime.now().strftime("%Y-%m-%d")
-        )
-        
-        # Determine missing fields
-        missing_fields = []
-        if not profile.age:
-            missing_fields.append("age")
-        if not profile.gender:
-            missing_fields.append("gender")
-        if not profile.conditions:
-            missing_fields.append("conditions")
-        
-        # Calculate confidence based on completeness
-        total_fields = 7
-        filled_fields = sum([
-            1 if profile.age else 0,
-            1 if profile.gender else 0,
-            1 if profile.conditions else 0,
-            1 if profile.medications else 0,
-            1 if profile.lab_values else 0,
-            1 if profile.location else 0,
-            1 if profile.allergies else 0
-        ])
-        confidence = filled_fields / total_fields
-        
-        return PatientExtractionResult(
-            success=True,
-            profile=profile,
-            confidence=confidence,
-            missing_fields=missing_fields,
-            extraction_time_seconds=round(extraction_time, 2)
-        )
-        
+        data = load_extraction_json(response_text)
     except json.JSONDecodeError as e:
         return PatientExtractionResult(
             success=False,
             error=f"Failed to parse extraction response: {str(e)}",
             warnings=[f"Raw response: {response_text[:500]}"]
         )
+    return build_extraction_result(data, extraction_time)
 
 
-def determine_location_tier(location: str) -> str:
-    """Determine location tier based on city name"""
-    if not location:
-        return "Tier 1"
+def build_extraction_result(data: Dict[str, Any], extraction_time: float = 0.0) -> PatientExtractionResult:
+    """PatientExtractionResult for extraction JSON"""
+    # Build profile
+    medications = []
+    for med in data.get("medications", []):
+        if isinstance(med, dict):
+            medications.append(Medication(
+                name=med.get("name", "Unknown"),
+                dose=med.get("dose"),
+                frequency=med.get("frequency")
+            ))
     
-    location_lower = location.lower()
+    lab_values = {}
+    for key, value in data.get("lab_values", {}).items():
+        if isinstance(value, dict) and "value" in value:
+            lab_values[key] = LabValue(
+                value=value["value"],
+                unit=value.get("unit", "")
+            )
     
-    tier_1_cities = [
-        "mumbai", "delhi", "bangalore", "bengaluru", "chennai", "kolkata",
-        "hyderabad", "pune", "ahmedabad"
-    ]
+    # Determine location tier
+    location = data.get("location", "")
+    location_tier = determine_location_tier(location)
     
-    tier_2_cities = [
-        "jaipur", "lucknow", "kanpur", "nagpur", "indore", "thane",
-        "bhopal", "visakhapatnam", "pimpri", "patna", "vadodara",
-        "ghaziabad", "ludhiana", "agra", "nashik", "faridabad", "meerut",
-        "rajkot", "varanasi", "srinagar", "aurangabad", "dhanbad",
-        "amritsar", "allahabad", "ranchi", "howrah", "coimbatore",
-        "jabalpur", "gwalior", "vijayawada", "jodhpur", "madurai",
-        "raipur", "kota", "chandigarh", "guwahati", "solapur"
-    ]
+    profile = PatientProfile(
+        age=data.get("age"),
+        gender=data.get("gender"),
+        location=location,
+        location_tier=location_tier,
+        conditions=data.get("conditions", []),
+        medications=medications,
+        lab_values=lab_values,
+        allergies=data.get("allergies", []),
+        extracted_date=datetime.now().strftime("%Y-%m-%d")
+    )
     
-    for city in tier_1_cities:
-        if city in location_lower:
-            return "Tier 1"
+    confidence, missing_fields = profile_completeness(profile)
+    return PatientExtractionResult(
+        success=True,
+        profile=profile,
+        confidence=confidence,
+        missing_fields=missing_fields,
+        extraction_time_seconds=round(extraction_time, 2)
+    )
+
+
+def profile_completeness(profile: PatientProfile) -> Tuple[float, List[str]]:
+    """
+    Confidence of an extraction from how complete its profile is
     
-    for city in tier_2_cities:
-        if city in location_lower:
-            return "Tier 2"
+    Returns:
+        (filled fields / 7, missing required fields)
+    """
+    # Determine missing fields
+    missing_fields = []
+    if not profile.age:
+        missing_fields.append("age")
+    if not profile.gender:
+        missing_fields.append("gender")
+    if not profile.conditions:
+        missing_fields.append("conditions")
     
-    return "Tier 3"
+    # Calculate confidence based on completeness
+    total_fields = 7
+    filled_fields = sum([
+        1 if profile.age else 0,
+        1 if profile.gender else 0,
+        1 if profile.conditions else 0,
+        1 if profile.medications else 0,
+        1 if profile.lab_values else 0,
+        1 if profile.location else 0,
+        1 if profile.allergies else 0
+    ])
+    return filled_fields / total_fields, missing_fields
+
+
+def determine_location_tier(location: str) -> str:
+    """Determine location tier based on city name (see app.utils.gazetteer)"""
+    return gazetteer.city_tier(location or "")
 
 
 # Fallback: Create profile from manual data
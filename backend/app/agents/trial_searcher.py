@@ -2,12 +2,39 @@
 Agent 2: Trial Searcher
 Searches database for trials matching patient profile
 """
-from typing import List
+import itertools
+import os
+from typing import Dict, List
 from app.models import PatientProfile, Trial
-from app.utils.database import search_trials_by_condition
+from app.utils.database import normalize_condition, search_trials_by_condition
+# Trials fetched and screened per search; the max_results returned are
+# the best-ranked ones that pass the vectorized fallback screen
+CANDIDATE_POOL_SIZE = int(os.getenv("SEARCH_CANDIDATE_POOL", "500"))
+def unmatched_conditions(conditions: List[str], trials: List[Dict]) -> List[str]:
+    """Patient conditions that no trial's condition equals or starts with (whole words)"""
+    trial_conditions = {
+        normalize_condition(condition) for trial in trials for condition in trial.get("conditions") or []
+    }
+    unmatched = []
+    for condition in conditions:
+        norm = normalize_condition(condition)
+        if norm and not any(tc == norm or tc.startswith(norm + " ") for tc in trial_conditions):
+            unmatched.append(condition)
+    return unmatched
+def interleave(first: List[Dict], second: List[Dict]) -> List[Dict]:
+    """Alternate two trial lists, dropping repeats by nct_id"""
+    merged = []
+    seen = set()
+    for pair in itertools.zip_longest(first, second):
+        for trial in pair:
+            if trial is not None and trial["nct_id"] not in seen:
+                seen.add(trial["nct_id"])
+                merged.append(trial)
+    return merged
 async def search_trials_for_patient(
     patient: PatientProfile,
-    max_results: int = 50
+    max_results: int = 50,
+    candidate_pool: int = CANDIDATE_POOL_SIZE
 ) -> List[Trial]:
     """
     Search for clinical trials matching patient profile
@@ -15,79 +42,55 @@ async def search_trials_for_patient(
     Args:
         patient: PatientProfile with conditions, location, age, etc.
         max_results: Maximum number of trials to return
+        candidate_pool: Trials to fetch and screen before picking max_results
     
     Returns:
         List of Trial objects matching patient criteria
     """
     
-    # Step 1: Search by conditions
+    limit = max(max_results, candidate_pool)
+    
+    # Search by conditions - exact/prefix matches on the normalized
+    # condition index first, most matched conditions first. Age and gender
+    # are filtered in SQL before LIMIT, so the page is filled whenever
+    # enough eligible trials exist.
     matching_trials = await search_trials_by_condition(
         conditions=patient.conditions,
         location=patient.location,
-        limit=max_results
+        limit=limit,
+        ranked=True,
+        exact=True,
+        age=patient.age,
+        gender=patient.gender
     )
     
-    # Step 2: Filter by age and gender
-    filtered_trials = []
-    
-    for trial_dict in matching_trials:
-        # Create Trial object from dictionary
-        trial = Trial(**trial_dict)
-        
-        # Check age eligibility
-        if not is_age_eligible(patient.age, trial.minimum_age, trial.maximum_age):
-            continue
-        
-        # Check gender eligibility
-        if not is_gender_eligible(patient.gender, trial.gender):
-            continue
-        
-        filtered_trials.append(trial)
-    
-    return filtered_trials
-def is_age_eligible(patient_age: int, min_age: str, max_age: str) -> bool:
-    """
-    Check if patient age meets trial requirements
-    
-    Args:
-        patient_age: Patient's age in years
-        min_age: Trial minimum age (e.g., "18 Years", "N/A")
-        max_age: Trial maximum age (e.g., "65 Years", "N/A")
-    
-    Returns:
-        True if eligible, False otherwise
-    """
-    # Parse minimum age
-    if min_age and min_age != "N/A":
-        try:
-            min_val = int(min_age.split()[0])
-            if patient_age < min_val:
-                return False
-        except:
-            pass  # If parsing fails, ignore constraint
-    
-    # Parse maximum age
-    if max_age and max_age != "N/A":
-        try:
-            max_val = int(max_age.split()[0])
-            if patient_age > max_val:
-                return False
-        except:
-            pass  # If parsing fails, ignore constraint
-    
-    return True
-def is_gender_eligible(patient_gender: str, trial_gender: str) -> bool:
-    """
-    Check if patient gender meets trial requirements
-    
-    Args:
-        patient_gender: "male", "female", or "other"
-        trial_gender: "MALE", "FEMALE", or "ALL"
+    # Conditions without an exact / prefix hit (other wordings, or word
+    # order: "diabetes mellitus type 2") go to BM25, which matches their
+    # words in any order; its results are interleaved with the exact hits
+    # so neither list crowds the other out of the pool
+    unmatched = unmatched_conditions(patient.conditions, matching_trials)
+    if unmatched:
+        ranked_trials = await search_trials_by_condition(
+            conditions=unmatched,
+            location=patient.location,
+            limit=limit,
+            ranked=True,
+            age=patient.age,
+            gender=patient.gender
+        )
+        matching_trials = interleave(matching_trials, ranked_trials)[:limit]
     
-    Returns:
-        True if eligible, False otherwise
-    """
-    if not trial_gender or trial_gender == "ALL":
-        return True
+    # Screen the whole pool in one vectorized pass; trials that definitely
+    # fail the age / gender rules drop behind the rest. Condition names are
+    # not ranked on: a synonym or abbreviation shares no words with the
+    # trial's, and eligibility (the LLM) decides those
+    if len(matching_trials) > max_results:
+        # Imports numpy, so loaded on first use rather than at startup
+        from app.utils.trial_block import TrialBlock
+        screen = TrialBlock(matching_trials).screen(patient.dict())
+        failed = screen.demographics_failed
+        passing = [t for t, fail in zip(matching_trials, failed) if not fail]
+        failing = [t for t, fail in zip(matching_trials, failed) if fail]
+        matching_trials = (passing + failing)[:max_results]
     
-    return patient_gender.upper() == trial_gender.upper()
\ No newline at end of file
+    return [Trial(**trial_dict) for trial_dict in matching_trials]
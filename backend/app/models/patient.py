@@ -108,6 +108,8 @@ class PatientExtractionResult(BaseModel):
     warnings: List[str] = Field(default_factory=list)
     error: Optional[str] = None
     extraction_time_seconds: Optional[float] = None
+    # SHA-256 of the uploaded file; pass to DELETE /api/upload/cache/{digest}
+    document_digest: Optional[str] = None
 
 class UploadAndMatchResult(BaseModel):
     #Combined result of upload, extraction, and trial matching
@@ -83,6 +83,7 @@ class DiversityScore(BaseModel):
     diversity_reasons: List[DiversityReason] = Field(default_factory=list)
     priority_level: str  # HIGH, MEDIUM, STANDARD
     priority_label: str
+    nearest_site_km: Optional[float] = None
 
 
 class TrialMatch(BaseModel):
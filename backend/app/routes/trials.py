@@ -19,7 +19,8 @@ async def get_total_trials():
 async def search_trials(
     conditions: str,
     location: str = None,
-    limit: int = 50
+    limit: int = 50,
+    ranked: bool = True
 ):
     """
     Search for trials by conditions
@@ -28,6 +29,7 @@ async def search_trials(
         conditions: Comma-separated list of conditions
         location: Optional location filter
         limit: Max number of results (default 50)
+        ranked: Order results by BM25 relevance (default True)
     
     Returns:
         List of trials matching criteria
@@ -39,7 +41,8 @@ async def search_trials(
     trials = await search_trials_by_condition(
         conditions=condition_list,
         location=location,
-        limit=limit
+        limit=limit,
+        ranked=ranked
     )
     
     return {
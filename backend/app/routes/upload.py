@@ -1,18 +1,23 @@
 """
 Upload routes - Handle file uploads and patient profile extraction
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import re
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from app.models import PatientExtractionResult, ManualPatientInput, PatientProfile
-from app.agents import extract_patient_profile
-from app.utils.file_helpers import save_upload_file, delete_file
+from app.agents import extract_patient_profile, forget_document
+from app.utils.file_helpers import save_upload_file_with_digest, delete_file
+from app.utils.disconnect import run_until_disconnect
+from app.utils.rate_limiter import INTERACTIVE, llm_priority_lane
 router = APIRouter(prefix="/api", tags=["upload"])
 @router.post("/upload", response_model=PatientExtractionResult)
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request, file: UploadFile = File(...)):
     """
     Upload a medical record (PDF or image) and extract patient profile
     
     Returns:
         PatientExtractionResult with extracted patient data
+    
+    Re-uploads of the same file are answered from the extraction cache.
     """
     # Validate file type
     allowed_types = ["application/pdf", "image/jpeg", "image/png", "image/jpg"]
@@ -22,21 +27,42 @@ async def upload_file(file: UploadFile = File(...)):
             detail=f"Invalid file type. Allowed: PDF, JPG, PNG"
         )
     
-    # Save uploaded file
-    file_path = await save_upload_file(file)
+    # Save uploaded file (hashed while it streams in)
+    file_path, digest = await save_upload_file_with_digest(file)
     
     try:
         # Get file extension with dot prefix (e.g., '.pdf', '.jpg')
         file_ext = '.' + file.filename.split('.')[-1].lower()
     
-        # Extract patient profile using Agent 1
-        result = await extract_patient_profile(file_path, file_ext)
+        # Extract patient profile using Agent 1 (cancelled if the client leaves)
+        with llm_priority_lane(INTERACTIVE):
+            result = await run_until_disconnect(
+                request,
+                extract_patient_profile(file_path, file_ext, digest)
+            )
     
         return result
     
     finally:
         # Clean up uploaded file
         delete_file(file_path)
+@router.delete("/upload/cache/{digest}")
+async def delete_cached_extraction(digest: str):
+    """
+    Forget a document's cached extraction (e.g. on a patient's request)
+    
+    Args:
+        digest: SHA-256 of the file, as returned in document_digest
+    
+    Returns:
+        Number of cache entries removed
+    """
+    digest = digest.lower()
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        raise HTTPException(status_code=400, detail="digest must be a SHA-256 hex string")
+    
+    removed = await forget_document(digest)
+    return {"digest": digest, "deleted": removed}
 @router.post("/manual-input", response_model=PatientProfile)
 async def manual_patient_input(form_data: ManualPatientInput):
     """
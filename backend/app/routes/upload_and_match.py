@@ -2,13 +2,15 @@
 Upload and Match - Combined endpoint for file upload, extraction, and trial matching
 """
 import time
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from app.models.patient import UploadAndMatchResult, PatientExtractionResult
 from app.agents import extract_patient_profile, search_trials_for_patient
-from app.utils.file_helpers import save_upload_file, delete_file
+from app.utils.file_helpers import save_upload_file_with_digest, delete_file
+from app.utils.disconnect import run_until_disconnect
+from app.utils.rate_limiter import INTERACTIVE, llm_priority_lane
 router = APIRouter(prefix="/api", tags=["upload-and-match"])
 @router.post("/upload-and-match", response_model=UploadAndMatchResult)
-async def upload_and_match(file: UploadFile = File(...)):
+async def upload_and_match(request: Request, file: UploadFile = File(...)):
     """
     Upload a medical record, extract patient profile, and match to trials - all in one call
     
@@ -31,36 +33,41 @@ async def upload_and_match(file: UploadFile = File(...)):
             detail=f"Invalid file type. Allowed: PDF, JPG, PNG"
         )
     
-    # Save uploaded file
-    file_path = await save_upload_file(file)
+    # Save uploaded file (hashed while it streams in)
+    file_path, digest = await save_upload_file_with_digest(file)
     
     try:
         # Get file extension with dot prefix (e.g., '.pdf', '.jpg')
         file_ext = '.' + file.filename.split('.')[-1].lower()
     
-        # STEP 1: Extract patient profile using Agent 1
-        extraction_result = await extract_patient_profile(file_path, file_ext)
+        # A user is waiting: both agents' LLM calls go ahead of background work
+        with llm_priority_lane(INTERACTIVE):
+            # STEP 1: Extract patient profile using Agent 1 (cancelled if the client leaves)
+            extraction_result = await run_until_disconnect(
+                request,
+                extract_patient_profile(file_path, file_ext, digest)
+            )
         
-        # STEP 2: Match trials using Agent 2 (only if extraction succeeded)
-        matching_result = None
-        if extraction_result.success and extraction_result.profile:
-            try:
-                # Search for matching trials
-                trials = await search_trials_for_patient(extraction_result.profile)
+            # STEP 2: Match trials using Agent 2 (only if extraction succeeded)
+            matching_result = None
+            if extraction_result.success and extraction_result.profile:
+                try:
+                    # Search for matching trials
+                    trials = await search_trials_for_patient(extraction_result.profile)
                 
-                matching_result = {
-                    "patient_age": extraction_result.profile.age,
-                    "patient_gender": extraction_result.profile.gender,
-                    "patient_conditions": extraction_result.profile.conditions,
-                    "total_matches": len(trials),
-                    "trials": [trial.dict() for trial in trials]
-                }
-            except Exception as e:
-                matching_result = {
-                    "error": f"Trial matching failed: {str(e)}",
-                    "total_matches": 0,
-                    "trials": []
-                }
+                    matching_result = {
+                        "patient_age": extraction_result.profile.age,
+                        "patient_gender": extraction_result.profile.gender,
+                        "patient_conditions": extraction_result.profile.conditions,
+                        "total_matches": len(trials),
+                        "trials": [trial.dict() for trial in trials]
+                    }
+                except Exception as e:
+                    matching_result = {
+                        "error": f"Trial matching failed: {str(e)}",
+                        "total_matches": 0,
+                        "trials": []
+                    }
         
         # Calculate total time
         total_time = time.time() - start_time
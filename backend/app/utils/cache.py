@@ -0,0 +1,203 @@
+"""
+Two-tier cache for expensive results (LLM verdicts, extractions)
+In-process LRU with size and TTL eviction, backed by a SQLite table that
+survives restarts. Values must be JSON-serializable.
+"""
+import aiosqlite
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+# Persistent tier location - separate file so cache writes never contend
+# with the trials database
+CACHE_DB_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "../../../data/cache.db"
+)
+CACHE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    ) WITHOUT ROWID
+"""
+_db: Optional[aiosqlite.Connection] = None
+_db_lock = asyncio.Lock()
+_caches: Dict[str, "TieredCache"] = {}
+async def _get_db() -> aiosqlite.Connection:
+    """Open the shared cache database on first use"""
+    global _db
+    async with _db_lock:
+        if _db is None:
+            os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
+            db = await aiosqlite.connect(CACHE_DB_PATH)
+            await db.execute("PRAGMA journal_mode = WAL")
+            await db.execute("PRAGMA synchronous = NORMAL")
+            await db.execute(CACHE_TABLE_SQL)
+            await db.commit()
+            _db = db
+    return _db
+async def close_cache_db():
+    """Close the persistent tier - call on app shutdown"""
+    global _db
+    async with _db_lock:
+        if _db is not None:
+            await _db.close()
+            _db = None
+def make_cache_key(*parts: Any) -> str:
+    """SHA-256 over the canonical JSON of `parts`"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+class TieredCache:
+    """
+    LRU + SQLite cache for one namespace
+    
+    Args:
+        namespace: Name of the cache (also its key prefix on disk)
+        max_entries: Max entries held in memory
+        ttl_seconds: Entry lifetime in both tiers, None for no expiry
+        persistent: Also store entries in the SQLite tier
+    """
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 1024,
+        ttl_seconds: Optional[float] = None,
+        persistent: bool = True
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0
+        }
+        _caches[namespace] = self
+    
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+    
+    def _remember(self, key: str, value: Any, created_at: float):
+        # Stored and returned as copies so callers can't mutate cached values
+        self._entries[key] = (copy.deepcopy(value), created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+    
+    async def get(self, key: str) -> Optional[Any]:
+        """Cached value for `key`, or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if not self._expired(created_at):
+                self._entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return copy.deepcopy(value)
+            del self._entries[key]
+        
+        if self.persistent:
+            try:
+                db = await _get_db()
+                cursor = await db.execute(
+                    "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                )
+                row = await cursor.fetchone()
+            except Exception as e:
+                print(f"[CACHE] {self.namespace} disk read failed: {e}")
+                row = None
+            if row is not None:
+                value_json, created_at = row
+                if not self._expired(created_at):
+                    value = json.loads(value_json)
+                    self._remember(key, value, created_at)
+                    self.counters["disk_hits"] += 1
+                    return value
+                await self._delete_from_disk(key)
+        
+        self.counters["misses"] += 1
+        return None
+    
+    async def set(self, key: str, value: Any):
+        """Store `value` in both tiers"""
+        created_at = time.time()
+        self._remember(key, value, created_at)
+        self.counters["sets"] += 1
+        if self.persistent:
+            try:
+                db = await _get_db()
+                await db.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, default=str), created_at)
+                )
+                await db.commit()
+            except Exception as e:
+                print(f"[CACHE] {self.namespace} disk write failed: {e}")
+    
+    async def delete(self, key: str) -> bool:
+        """Remove `key` from both tiers, returns True if it was cached"""
+        found = self._entries.pop(key, None) is not None
+        if self.persistent:
+            found = await self._delete_from_disk(key) or found
+        return found
+    
+    async def delete_prefix(self, prefix: str) -> int:
+        """Remove every key starting with `prefix` from both tiers, returns the count removed"""
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        removed = set(keys)
+        if self.persistent:
+            try:
+                db = await _get_db()
+                cursor = await db.execute(
+                    "SELECT key FROM cache_entries WHERE namespace = ? AND substr(key, 1, ?) = ?",
+                    (self.namespace, len(prefix), prefix)
+                )
+                removed.update(row[0] for row in await cursor.fetchall())
+                await db.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND substr(key, 1, ?) = ?",
+                    (self.namespace, len(prefix), prefix)
+                )
+                await db.commit()
+            except Exception as e:
+                print(f"[CACHE] {self.namespace} disk delete failed: {e}")
+        return len(removed)
+    
+    async def _delete_from_disk(self, key: str) -> bool:
+        try:
+            db = await _get_db()
+            cursor = await db.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            print(f"[CACHE] {self.namespace} disk delete failed: {e}")
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current memory size"""
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "memory_entries": len(self._entries),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0
+        }
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every cache created in this process"""
+    return {namespace: cache.stats() for namespace, cache in _caches.items()}
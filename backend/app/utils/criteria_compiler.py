@@ -0,0 +1,386 @@
+"""
+Criteria compiler - free-text eligibility criteria to structured rules
+
+Splits a trial's `eligibility_criteria` into inclusion/exclusion items
+and parses the items it recognises into atomic rules:
+
+- age bounds              {"type": "age", "min": 18, "max": 65}
+- lab thresholds          {"type": "lab", "lab": "hba1c", "min": 7.0, "max": 10.0, "unit": "%", ...}
+- sex restriction         {"type": "sex", "value": "female"}
+- pregnancy/lactation     {"type": "pregnancy"}
+- conditions              {"type": "condition", "terms": ["type 2 diabetes"]}
+- medications             {"type": "medication", "terms": ["insulin"], "window": False}
+
+Everything else is kept as {"type": "text"} so the evaluator knows the
+trial can't be fully decided without the LLM. Every rule carries its
+"section" ("inclusion" / "exclusion") and the original "text".
+
+Compilation is pure and deterministic; scripts/compile_criteria.py runs
+it over the trials table and stores the result in trial_rules.
+"""
+import re
+import hashlib
+from typing import List, Dict, Any, Optional, Tuple, FrozenSet
+
+# Bump whenever parsing changes, so stored rules get recompiled
+COMPILER_VERSION = "2"
+
+INCLUSION = "inclusion"
+EXCLUSION = "exclusion"
+
+INCLUSION_HEADING = re.compile(r"^\s*(?:key\s+)?inclusion\s+criteria\s*:?\s*$", re.I)
+EXCLUSION_HEADING = re.compile(r"^\s*(?:key\s+)?exclusion\s+criteria\s*:?\s*$", re.I)
+BULLET = re.compile(r"^\s*(?:[*\-•·]|\d{1,2}[.)]|[a-z][.)])\s+")
+
+NUM = r"(\d+(?:\.\d+)?)"
+RANGE_SEP = r"\s*(?:-|–|—|to|and)\s*"
+UNIT = r"\s*(%|mg/dl|mmol/l|mmol/mol|kg/m2|kg/m²|ml/min(?:/1\.73\s*m2|/1\.73\s*m²)?|mmhg|g/dl|g/l|µmol/l|umol/l|/mm3|x\s?10\^?9/l)?"
+
+GE_WORDS = r"≥|>=|=>|at least|greater than or equal to|no less than|minimum of|more than or equal to"
+GT_WORDS = r">|greater than|more than|above|exceeding|over"
+LE_WORDS = r"≤|<=|=<|at most|less than or equal to|no more than|not more than|maximum of|up to"
+LT_WORDS = r"<|less than|below|under|lower than"
+
+# Canonical lab name -> aliases as they appear in criteria and lab reports
+LAB_ALIASES = {
+    "hba1c": r"hba1c|hb\s?a1c|a1c|glycated ha?emoglobin|glycosylated ha?emoglobin",
+    "fasting_glucose": r"fasting (?:plasma |blood |serum )?glucose|fpg",
+    "bmi": r"bmi|body mass index",
+    "egfr": r"egfr|estimated glomerular filtration rate",
+    "creatinine": r"serum creatinine|creatinine",
+    "ldl": r"ldl(?:-c| cholesterol)?",
+    "triglycerides": r"triglycerides?",
+    "systolic_bp": r"systolic blood pressure|systolic bp|sbp",
+    "diastolic_bp": r"diastolic blood pressure|diastolic bp|dbp",
+    "hemoglobin": r"ha?emoglobin|hgb",
+    "platelets": r"platelets?(?: count)?",
+}
+LAB_PATTERNS = {
+    name: re.compile(rf"(?<![a-z0-9])(?:{aliases})(?![a-z0-9])", re.I)
+    for name, aliases in LAB_ALIASES.items()
+}
+
+AGE_HINT = re.compile(r"\bage[ds]?\b|\bold\b|\bolder\b|\byounger\b|\badults?\b|years of age", re.I)
+# An age number is anchored by an age word before the comparison ("aged ≥ 18",
+# "age between 18 and 65") or by a years unit after it ("over 50 years")
+AGE_WORD = r"\bage[ds]?(?:\s+(?:of|is|at\s+\w+))?\s*[:=]?\s*"
+YEARS = r"\s*(?:years?|yrs?)\b"
+# ...and is not followed by another unit ("adults over 50 kg", "aged 6 months")
+NOT_OTHER_UNIT = r"(?!\.?\d|\s*(?:%|/|kg\b|g\b|mg\b|mcg\b|cm\b|mm\b|m\b|ml\b|l\b|lbs?\b|mmhg\b|iu\b|units?\b|months?\b|weeks?\b|days?\b))"
+# "diabetes for at least 2 years" is a duration, not an age bound
+DURATION_HINT = re.compile(r"\bduration\b|\bfor (?:at least|more than|over|a minimum of)\b|\bdiagnos|\bhistory\b|\bwithin\b", re.I)
+
+CONDITION_PREFIX = re.compile(
+    r"^(?:(?:patients?|subjects?|participants?|individuals?|adults?|men|women)\s+(?:with|who have|having)\s+"
+    r"|(?:a\s+)?(?:known|documented|confirmed|established|current|active|prior|previous|clinical)?\s*"
+    r"(?:history of|diagnosis of|diagnosed with|evidence of|presence of)\s+)",
+    re.I
+)
+MEDICATION_PREFIX = re.compile(
+    r"^(?:current\s+|concurrent\s+|concomitant\s+|prior\s+|ongoing\s+)?"
+    r"(?:use of|treatment with|therapy with|taking|receiving|treated with|on)\s+",
+    re.I
+)
+MEDICATION_WINDOW = re.compile(
+    r"\s*(?:with)?in\s+(?:the\s+)?(?:last\s+|past\s+|previous\s+)?\d+\s*(?:days?|weeks?|months?|years?)"
+    r"(?:\s+(?:prior to|before)\s+.*)?$",
+    re.I
+)
+# Words that mark an item as a procedural / consent requirement, not a condition
+NON_CONDITION_WORDS = {
+    "able", "willing", "willingness", "consent", "sign", "signed", "agree", "provide",
+    "understand", "comply", "participate", "participation", "study", "investigator",
+    "opinion", "must", "should", "may", "can", "cannot", "who", "which", "that",
+    "within", "unless", "except", "other", "than", "least", "more", "less", "any",
+    "not", "no", "contraception", "method", "methods", "visit", "visits", "trial",
+}
+# Drug classes: a patient drug not literally named may still belong to one
+MEDICATION_CLASS_WORDS = {
+    "inhibitor", "inhibitors", "agonist", "agonists", "antagonist", "antagonists",
+    "blocker", "blockers", "therapy", "therapies", "agent", "agents", "drug", "drugs",
+    "medication", "medications", "steroids", "corticosteroids", "anticoagulants",
+    "antidiabetic", "immunosuppressants", "immunosuppressive", "chemotherapy", "analogues",
+}
+PREGNANCY = re.compile(r"\bpregnan|\bbreast-?feeding\b|\blactating\b|\bnursing\b", re.I)
+SEX_ONLY = re.compile(r"^(?:(male|female|men|women)s?)(?:\s+only)?(?:\s+(?:subjects?|patients?|participants?))?$", re.I)
+
+# "mellitus" etc. don't distinguish conditions: "Type 2 Diabetes" should
+# satisfy "type 2 diabetes mellitus"
+TOKEN_STOPWORDS = {
+    "of", "the", "a", "an", "with", "and", "or", "in", "to", "for", "s",
+    "mellitus", "disease", "disorder"
+}
+ROMAN_NUMERALS = {"i": "1", "ii": "2", "iii": "3", "iv": "4"}
+
+MAX_TERM_WORDS = 6
+
+
+def criteria_hash(criteria: str) -> str:
+    """Identifies the criteria text the stored rules were compiled from"""
+    return hashlib.sha256((criteria or "").strip().encode("utf-8")).hexdigest()
+
+
+def condition_tokens(text: str) -> FrozenSet[str]:
+    """
+    Lowercased word tokens of a condition / drug name
+
+    Roman numerals are mapped to digits so "Type II Diabetes" and
+    "Diabetes Mellitus, Type 2" share tokens.
+    """
+    tokens = set()
+    for token in re.findall(r"[a-z0-9]+", str(text).lower()):
+        if token in TOKEN_STOPWORDS:
+            continue
+        tokens.add(ROMAN_NUMERALS.get(token, token))
+    return frozenset(tokens)
+
+
+def term_relation(term: FrozenSet[str], other: FrozenSet[str]) -> str:
+    """
+    How a rule term relates to a patient condition / drug
+
+    Returns:
+        "match" if all of the term's tokens are in other, "none" if they
+        share no tokens (or carry conflicting numbers, e.g. type 1 vs
+        type 2), otherwise "partial"
+    """
+    if not term or not other:
+        return "none"
+    if term <= other:
+        return "match"
+    if not term & other:
+        return "none"
+    term_numbers = {t for t in term if t.isdigit()}
+    other_numbers = {t for t in other if t.isdigit()}
+    if term_numbers and other_numbers and not term_numbers & other_numbers:
+        return "none"
+    return "partial"
+
+
+def canonical_lab_name(name: str) -> Optional[str]:
+    """Map a lab name from a report ("Glycated Hemoglobin") to its LAB_ALIASES key"""
+    for canonical, pattern in LAB_PATTERNS.items():
+        if pattern.search(name):
+            return canonical
+    return None
+
+
+def _normalize_unit(unit: Optional[str]) -> str:
+    return (unit or "").lower().replace(" ", "").replace("μ", "µ").replace("umol", "µmol")
+
+
+# (lab, from unit, to unit) -> conversion
+UNIT_CONVERSIONS = {
+    ("hba1c", "mmol/mol", "%"): lambda v: v / 10.929 + 2.15,
+    ("hba1c", "%", "mmol/mol"): lambda v: (v - 2.15) * 10.929,
+    ("fasting_glucose", "mmol/l", "mg/dl"): lambda v: v * 18.016,
+    ("fasting_glucose", "mg/dl", "mmol/l"): lambda v: v / 18.016,
+    ("creatinine", "µmol/l", "mg/dl"): lambda v: v / 88.42,
+    ("creatinine", "mg/dl", "µmol/l"): lambda v: v * 88.42,
+}
+
+
+def convert_lab_value(lab: str, value: float, from_unit: Optional[str], to_unit: Optional[str]) -> Optional[float]:
+    """
+    Express a lab value in the rule's unit
+
+    A missing unit on either side is assumed to match. Returns None when
+    the units differ and no conversion is known.
+    """
+    source, target = _normalize_unit(from_unit), _normalize_unit(to_unit)
+    if not source or not target or source == target:
+        return value
+    convert = UNIT_CONVERSIONS.get((lab, source, target))
+    return convert(value) if convert else None
+
+
+def split_sections(criteria: str) -> List[Tuple[str, str]]:
+    """
+    Split criteria text into (section, item) pairs
+
+    Items are bullet / numbered lines; wrapped continuation lines are
+    joined onto the previous item. Text before any heading counts as
+    inclusion.
+    """
+    items = []
+    section = INCLUSION
+    current: List[str] = []
+
+    def flush():
+        if current:
+            text = " ".join(current).strip()
+            if text:
+                items.append((section, text))
+            current.clear()
+
+    for line in (criteria or "").splitlines():
+        if not line.strip():
+            flush()
+            continue
+        if INCLUSION_HEADING.match(line):
+            flush()
+            section = INCLUSION
+            continue
+        if EXCLUSION_HEADING.match(line):
+            flush()
+            section = EXCLUSION
+            continue
+        if BULLET.match(line):
+            flush()
+            current.append(BULLET.sub("", line, count=1).strip())
+        else:
+            current.append(line.strip())
+    flush()
+    return items
+
+
+def _age_bound(words: str, lower: str, open_ended: str) -> Optional[re.Match]:
+    """An anchored "<comparison> <age>" ("aged ≥ 18", "over 50 years", "18 years or older")"""
+    return (
+        re.search(rf"{AGE_WORD}(?:{words})\s*{NUM}{NOT_OTHER_UNIT}", lower)
+        or re.search(rf"(?:{words})\s*{NUM}{YEARS}", lower)
+        or re.search(rf"(?:{AGE_WORD}{NUM}{NOT_OTHER_UNIT}|{NUM}{YEARS})(?:\s+of\s+age)?\s+(?:or|and)\s+(?:{open_ended})\b", lower)
+    )
+
+
+def parse_age_rule(text: str) -> Optional[Dict[str, Any]]:
+    if not AGE_HINT.search(text) or DURATION_HINT.search(text):
+        return None
+    lower = text.lower()
+    match = re.search(rf"{NUM}{RANGE_SEP}{NUM}{YEARS}", lower) or \
+        re.search(rf"{AGE_WORD}(?:between|from)?\s*{NUM}{NOT_OTHER_UNIT}{RANGE_SEP}{NUM}{NOT_OTHER_UNIT}", lower)
+    if match:
+        return {"type": "age", "min": float(match.group(1)), "max": float(match.group(2))}
+    match = _age_bound(GE_WORDS, lower, "older|above|over|more")
+    if match:
+        return {"type": "age", "min": float(match.group(1) or match.group(2)), "max": None}
+    match = _age_bound(GT_WORDS, lower, "$^") or re.search(rf"older than\s*{NUM}{NOT_OTHER_UNIT}", lower)
+    if match:
+        return {"type": "age", "min": float(match.group(1)) + 1, "max": None}
+    match = _age_bound(LE_WORDS, lower, "younger|below|under|less")
+    if match:
+        return {"type": "age", "min": None, "max": float(match.group(1) or match.group(2))}
+    match = _age_bound(LT_WORDS, lower, "$^") or re.search(rf"younger than\s*{NUM}{NOT_OTHER_UNIT}", lower)
+    if match:
+        return {"type": "age", "min": None, "max": float(match.group(1)) - 1}
+    return None
+
+
+def parse_lab_rule(text: str) -> Optional[Dict[str, Any]]:
+    """One lab threshold per item; items naming several labs are left to the LLM"""
+    found = [(name, m) for name, pattern in LAB_PATTERNS.items() for m in [pattern.search(text)] if m]
+    # "hemoglobin" also matches inside "glycated hemoglobin"
+    if len(found) > 1:
+        found = [(n, m) for n, m in found if not (n == "hemoglobin" and any(o == "hba1c" for o, _ in found))]
+    if len(found) != 1:
+        return None
+    name, match = found[0]
+    tail = text[match.end():match.end() + 80].lower()
+    # Thresholds relative to the upper limit of normal need the lab's reference range
+    if re.search(r"\buln\b|upper limit", tail):
+        return None
+
+    rule = {"type": "lab", "lab": name, "min": None, "max": None, "min_exclusive": False, "max_exclusive": False}
+    m = re.match(rf"\s*(?:level|levels|value|values|of|:|=|\(|between|from)*\s*{NUM}{UNIT}{RANGE_SEP}{NUM}{UNIT}", tail)
+    if m:
+        rule.update(min=float(m.group(1)), max=float(m.group(3)), unit=m.group(4) or m.group(2))
+    else:
+        # "≥ 25 kg/m2 and ≤ 40 kg/m2" sets both bounds
+        for words, bound, exclusive in (
+            (GE_WORDS, "min", False), (LE_WORDS, "max", False),
+            (GT_WORDS, "min", True), (LT_WORDS, "max", True)
+        ):
+            m = re.search(rf"(?:{words})\s*{NUM}{UNIT}", tail)
+            if m and rule[bound] is None:
+                rule[bound] = float(m.group(1))
+                rule["unit"] = rule.get("unit") or m.group(2)
+                rule[f"{bound}_exclusive"] = exclusive
+                tail = tail[:m.start()] + " " * (m.end() - m.start()) + tail[m.end():]
+        if rule["min"] is None and rule["max"] is None:
+            return None
+    rule["unit"] = (rule.get("unit") or "").replace(" ", "") or None
+    return rule
+
+
+def _split_terms(phrase: str) -> List[str]:
+    phrase = re.sub(r"\([^)]*\)", " ", phrase)
+    parts = re.split(r",|;|/|\bor\b|\band/or\b", phrase, flags=re.I)
+    return [re.sub(r"\s+", " ", p).strip(" .:-").lower() for p in parts if p.strip(" .:-")]
+
+
+def _is_term_list(terms: List[str]) -> bool:
+    if not terms:
+        return False
+    for term in terms:
+        words = term.split()
+        if not words or len(words) > MAX_TERM_WORDS:
+            return False
+        if any(w in NON_CONDITION_WORDS for w in words):
+            return False
+        if re.search(r"[<>≤≥=%]|\d+\s*(?:mg|ml|days?|weeks?|months?)", term):
+            return False
+    return True
+
+
+def parse_medication_rule(text: str) -> Optional[Dict[str, Any]]:
+    match = MEDICATION_PREFIX.match(text)
+    if not match:
+        return None
+    phrase = text[match.end():].rstrip(" .")
+    window = bool(MEDICATION_WINDOW.search(phrase))
+    phrase = MEDICATION_WINDOW.sub("", phrase)
+    terms = _split_terms(phrase)
+    if not _is_term_list(terms):
+        return None
+    drug_class = any(w in MEDICATION_CLASS_WORDS for term in terms for w in term.split())
+    return {"type": "medication", "terms": terms, "window": window, "drug_class": drug_class}
+
+
+def parse_condition_rule(text: str, section: str) -> Optional[Dict[str, Any]]:
+    match = CONDITION_PREFIX.match(text)
+    # Bare phrases ("Type 1 diabetes") are only trusted as exclusions; a
+    # required condition must be introduced explicitly ("diagnosis of ...")
+    if not match and section == INCLUSION:
+        return None
+    phrase = text[match.end():] if match else text
+    terms = _split_terms(phrase.rstrip(" ."))
+    if not _is_term_list(terms):
+        return None
+    return {"type": "condition", "terms": terms}
+
+
+def compile_item(section: str, text: str) -> Dict[str, Any]:
+    """Compile one criteria item into a rule (type "text" if unrecognised)"""
+    clean = re.sub(r"\s+", " ", text).strip()
+    rule = None
+    sex = SEX_ONLY.match(clean.rstrip(" ."))
+    if sex:
+        value = sex.group(1).lower()
+        rule = {"type": "sex", "value": "male" if value in ("male", "men") else "female"}
+    elif section == EXCLUSION and PREGNANCY.search(clean) and len(clean.split()) <= 12:
+        rule = {"type": "pregnancy"}
+    else:
+        rule = (
+            parse_lab_rule(clean)
+            or parse_age_rule(clean)
+            or parse_medication_rule(clean)
+            or parse_condition_rule(clean, section)
+        )
+    if rule is None:
+        rule = {"type": "text"}
+    rule["section"] = section
+    rule["text"] = clean[:300]
+    return rule
+
+
+def compile_criteria(criteria: str) -> List[Dict[str, Any]]:
+    """
+    Compile a trial's eligibility_criteria text into rules
+
+    Args:
+        criteria: Free-text eligibility criteria
+
+    Returns:
+        List of rule dicts, in criteria order
+    """
+    return [compile_item(section, text) for section, text in split_sections(criteria)]
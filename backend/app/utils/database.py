@@ -3,17 +3,452 @@ Database utilities for clinical trials
 Handles SQLite connection and queries
 """
 import aiosqlite
+import asyncio
 import os
+import re
 import json
-from typing import List, Dict, Optional
+import time
+import hashlib
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Iterable, Tuple
 # Database location
 DATABASE_PATH = os.path.join(
     os.path.dirname(__file__), 
     "../../../data/trials.db"
 )
+# Connection pool settings
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# Per-connection cache of prepared statements, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",  # readers don't block the writer
+    "PRAGMA synchronous = NORMAL",  # safe with WAL, fsync only on checkpoint
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",  # 256 MB
+    "PRAGMA cache_size = -32000"  # ~32 MB per connection
+]
+# Schema - shared with scripts/convert_json_to_db.py
+TRIALS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS trials (
+        nct_id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        brief_summary TEXT,
+        status TEXT,
+        phase TEXT,
+        conditions TEXT,
+        eligibility_criteria TEXT,
+        minimum_age TEXT,
+        maximum_age TEXT,
+        gender TEXT,
+        locations TEXT,
+        sponsor TEXT,
+        min_age_months INTEGER,
+        max_age_months INTEGER,
+        gender_norm TEXT,
+        content_hash TEXT,
+        last_update_date TEXT,
+        is_stale INTEGER NOT NULL DEFAULT 0
+    )
+"""
+# Columns added after the original schema - migrated by init_db
+TRIALS_ADDED_COLUMNS = {
+    "min_age_months": "INTEGER",
+    "max_age_months": "INTEGER",
+    "gender_norm": "TEXT",
+    "content_hash": "TEXT",
+    "last_update_date": "TEXT",
+    "is_stale": "INTEGER NOT NULL DEFAULT 0"
+}
+# Composite index for the demographic pre-filter in search_trials_by_condition
+TRIALS_INDEXES_SQL = [
+    """
+    CREATE INDEX IF NOT EXISTS idx_trials_eligibility
+    ON trials(status, gender_norm, min_age_months, max_age_months)
+    """
+]
+# No age limit is stored as 0 / NO_MAX_AGE_MONTHS rather than NULL so the
+# age predicates stay plain range comparisons the index can use
+NO_MAX_AGE_MONTHS = 1500
+GENDER_VALUES = {"ALL", "MALE", "FEMALE"}
+# Full-text index over conditions, title and summary.
+# External content table: rows live in `trials`, the triggers below keep
+# the index in sync on every insert/update/delete.
+TRIALS_FTS_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS trials_fts USING fts5(
+        conditions,
+        title,
+        brief_summary,
+        content='trials',
+        content_rowid='rowid'
+    )
+"""
+TRIALS_FTS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trials_fts_ai AFTER INSERT ON trials BEGIN
+        INSERT INTO trials_fts(rowid, conditions, title, brief_summary)
+        VALUES (new.rowid, new.conditions, new.title, new.brief_summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trials_fts_ad AFTER DELETE ON trials BEGIN
+        INSERT INTO trials_fts(trials_fts, rowid, conditions, title, brief_summary)
+        VALUES ('delete', old.rowid, old.conditions, old.title, old.brief_summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trials_fts_au
+    AFTER UPDATE OF conditions, title, brief_summary ON trials BEGIN
+        INSERT INTO trials_fts(trials_fts, rowid, conditions, title, brief_summary)
+        VALUES ('delete', old.rowid, old.conditions, old.title, old.brief_summary);
+        INSERT INTO trials_fts(rowid, conditions, title, brief_summary)
+        VALUES (new.rowid, new.conditions, new.title, new.brief_summary);
+    END
+    """
+]
+# Normalized conditions, one row per (trial, condition), for indexed
+# equality/prefix lookups instead of substring scans over the JSON column
+TRIAL_CONDITIONS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS trial_conditions (
+        condition_norm TEXT NOT NULL,
+        nct_id TEXT NOT NULL,
+        PRIMARY KEY (condition_norm, nct_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_trial_conditions_nct_id
+    ON trial_conditions(nct_id)
+    """
+]
+# Change log written by sync_trials, so caches and indexes built from
+# trials can be invalidated per nct_id
+TRIAL_CHANGES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS trial_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sync_id TEXT NOT NULL,
+        nct_id TEXT NOT NULL,
+        change_type TEXT NOT NULL,
+        changed_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_trial_changes_sync_id
+    ON trial_changes(sync_id)
+    """
+]
+# Structured rules compiled offline from eligibility_criteria
+# (app.utils.criteria_compiler, scripts/compile_criteria.py). criteria_hash
+# ties them to the criteria text they came from, so rules for trials whose
+# criteria changed since compilation are ignored.
+TRIAL_RULES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS trial_rules (
+        nct_id TEXT PRIMARY KEY,
+        criteria_hash TEXT NOT NULL,
+        compiler_version TEXT NOT NULL,
+        rules TEXT NOT NULL,
+        rule_count INTEGER NOT NULL,
+        unparsed_count INTEGER NOT NULL,
+        compiled_at TEXT NOT NULL
+    )
+    """
+]
+SCHEMA_STATEMENTS = (
+    [TRIALS_TABLE_SQL, TRIALS_FTS_SQL]
+    + TRIALS_FTS_TRIGGERS_SQL
+    + TRIAL_CONDITIONS_SQL
+    + TRIAL_CHANGES_SQL
+    + TRIAL_RULES_SQL
+)
+# Run after TRIALS_ADDED_COLUMNS have been migrated
+INDEX_STATEMENTS = TRIALS_INDEXES_SQL
+# Dropped during bulk loads and rebuilt once at the end. The trial_conditions
+# indexes stay: its primary key is the table, and the nct_id index backs
+# the per-trial delete on every upsert.
+DEFERRED_INDEXES = ["idx_trials_eligibility"]
+FTS_TRIGGERS = ["trials_fts_ai", "trials_fts_ad", "trials_fts_au"]
+DELETE_TRIAL_CONDITIONS_SQL = "DELETE FROM trial_conditions WHERE nct_id = ?"
+INSERT_TRIAL_CONDITION_SQL = """
+    INSERT OR IGNORE INTO trial_conditions (condition_norm, nct_id)
+    VALUES (?, ?)
+"""
+INSERT_TRIAL_CHANGE_SQL = """
+    INSERT INTO trial_changes (sync_id, nct_id, change_type, changed_at)
+    VALUES (?, ?, ?, ?)
+"""
+# Change types recorded in trial_changes
+CHANGE_ADDED = "ADDED"
+CHANGE_UPDATED = "UPDATED"
+CHANGE_STALE = "STALE"
+# Upsert instead of INSERT OR REPLACE: REPLACE deletes the old row without
+# firing delete triggers, which would leave stale entries in trials_fts
+UPSERT_TRIAL_SQL = """
+    INSERT INTO trials
+    (nct_id, title, brief_summary, status, phase, conditions,
+     eligibility_criteria, minimum_age, maximum_age, gender,
+     locations, sponsor, min_age_months, max_age_months, gender_norm,
+     content_hash, last_update_date, is_stale)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+    ON CONFLICT(nct_id) DO UPDATE SET
+        title = excluded.title,
+        brief_summary = excluded.brief_summary,
+        status = excluded.status,
+        phase = excluded.phase,
+        conditions = excluded.conditions,
+        eligibility_criteria = excluded.eligibility_criteria,
+        minimum_age = excluded.minimum_age,
+        maximum_age = excluded.maximum_age,
+        gender = excluded.gender,
+        locations = excluded.locations,
+        sponsor = excluded.sponsor,
+        min_age_months = excluded.min_age_months,
+        max_age_months = excluded.max_age_months,
+        gender_norm = excluded.gender_norm,
+        content_hash = excluded.content_hash,
+        last_update_date = excluded.last_update_date,
+        is_stale = 0
+"""
+# Trial fields covered by the content hash (everything stored from the source
+# except its last-update date, so a bumped date alone is not a change)
+HASHED_FIELDS = [
+    "nct_id", "title", "brief_summary", "status", "phase", "conditions",
+    "eligibility_criteria", "minimum_age", "maximum_age", "gender",
+    "locations", "sponsor"
+]
+# BM25 column weights: conditions, title, brief_summary
+BM25_WEIGHTS = (10.0, 3.0, 1.0)
+async def _open_connection(read_only: bool = False) -> aiosqlite.Connection:
+    """Open a tuned connection to the trials database"""
+    db = await aiosqlite.connect(DATABASE_PATH, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+    if read_only:
+        await db.execute("PRAGMA query_only = ON")
+    # Return results as dictionaries
+    db.row_factory = aiosqlite.Row
+    return db
+class ConnectionPool:
+    """
+    Long-lived SQLite connections shared by all requests
+    
+    Holds `read_size` read-only connections handed out one request at a
+    time, and a single write connection serialized by a lock (SQLite
+    allows one writer anyway). Avoids a new thread and SQLite handle per
+    query, and keeps page cache and prepared statements warm.
+    """
+    def __init__(self, read_size: int = READ_POOL_SIZE):
+        self.read_size = read_size
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+    
+    async def open(self):
+        # Open the writer first so WAL mode is set before readers attach
+        self._writer = await _open_connection()
+        for _ in range(self.read_size):
+            db = await _open_connection(read_only=True)
+            self._all_readers.append(db)
+            self._readers.put_nowait(db)
+    
+    async def close(self):
+        for db in self._all_readers:
+            await db.close()
+        self._all_readers = []
+        if self._writer:
+            await self._writer.close()
+            self._writer = None
+    
+    @asynccontextmanager
+    async def reader(self):
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+    
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except Exception:
+                await self._writer.rollback()
+                raise
+_pool: Optional[ConnectionPool] = None
+async def init_pool(read_size: int = READ_POOL_SIZE):
+    """Open the shared connection pool - call once on app startup"""
+    global _pool
+    if _pool is not None:
+        return
+    pool = ConnectionPool(read_size)
+    await pool.open()
+    _pool = pool
+    print(f"[*] Database pool opened ({read_size} readers, 1 writer)")
+async def close_pool():
+    """Close the shared connection pool - call on app shutdown"""
+    global _pool
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    await pool.close()
+    print("[*] Database pool closed")
+@asynccontextmanager
+async def read_connection():
+    """
+    Borrow a read connection from the pool
+    Outside the app (scripts, tests) there is no pool, so open a temporary one
+    """
+    if _pool is not None:
+        async with _pool.reader() as db:
+            yield db
+    else:
+        db = await _open_connection(read_only=True)
+        try:
+            yield db
+        finally:
+            await db.close()
+@asynccontextmanager
+async def write_connection():
+    """Borrow the write connection from the pool (or a temporary one)"""
+    if _pool is not None:
+        async with _pool.writer() as db:
+            yield db
+    else:
+        db = await _open_connection()
+        try:
+            yield db
+        finally:
+            await db.close()
+def parse_age_months(age_str: Optional[str]) -> Optional[int]:
+    """
+    Parse a ClinicalTrials.gov age ("18 Years", "6 Months", "N/A") to months
+    A bare number is read as years. Returns None if there is no limit.
+    """
+    if not age_str:
+        return None
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)", str(age_str))
+    if not match:
+        return None
+    value = float(match.group(1))
+    unit = match.group(2).lower()
+    if unit.startswith("month"):
+        return int(value)
+    if unit.startswith("week"):
+        return int(value * 7 / 30)
+    if unit.startswith("day"):
+        return int(value / 30)
+    if unit.startswith("hour") or unit.startswith("minute"):
+        return 0
+    return int(value * 12)
+# Age limits parse_age_months reads exactly ("18 Years", "6 Months", "18")
+AGE_LIMIT_PATTERN = re.compile(r"\s*\d+(?:\.\d+)?\s*(?:years?|yrs?|y|months?|weeks?|days?|hours?|minutes?)?\s*$", re.I)
+def parse_age_limit(age_str) -> Tuple[Optional[int], bool]:
+    """
+    An eligibility age limit in months, and whether it could be read
+    No limit ("", "N/A") is (None, True); a limit in another form
+    ("Eighteen Years", "18 Decades") is (None, False).
+    """
+    if not age_str or str(age_str).strip().upper() in ("N/A", "NA", "NONE"):
+        return None, True
+    if not AGE_LIMIT_PATTERN.match(str(age_str)):
+        return None, False
+    return parse_age_months(str(age_str)), True
+def normalize_gender(gender: Optional[str]) -> str:
+    """Normalize a trial's sex eligibility to ALL, MALE or FEMALE"""
+    gender_upper = str(gender or "").strip().upper()
+    return gender_upper if gender_upper in GENDER_VALUES else "ALL"
+def compute_content_hash(trial_data: Dict) -> str:
+    """SHA-256 of the stored trial fields, stable across key order"""
+    content = {field: trial_data.get(field) for field in HASHED_FIELDS}
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+def trial_row(trial_data: Dict) -> tuple:
+    """Parameters for UPSERT_TRIAL_SQL, including the precomputed filter columns"""
+    min_age_months = parse_age_months(trial_data.get("minimum_age"))
+    max_age_months = parse_age_months(trial_data.get("maximum_age"))
+    return (
+        trial_data.get("nct_id"),
+        trial_data.get("title"),
+        trial_data.get("brief_summary"),
+        trial_data.get("status"),
+        trial_data.get("phase"),
+        json.dumps(trial_data.get("conditions", [])),
+        trial_data.get("eligibility_criteria"),
+        trial_data.get("minimum_age"),
+        trial_data.get("maximum_age"),
+        trial_data.get("gender"),
+        json.dumps(trial_data.get("locations", [])),
+        trial_data.get("sponsor"),
+        min_age_months if min_age_months is not None else 0,
+        max_age_months if max_age_months is not None else NO_MAX_AGE_MONTHS,
+        normalize_gender(trial_data.get("gender")),
+        trial_data.get("content_hash") or compute_content_hash(trial_data),
+        trial_data.get("last_update_date")
+    )
+def normalize_condition(condition: str) -> str:
+    """
+    Normalize a condition name for exact matching
+    e.g. "Type 2 Diabetes, Mellitus" -> "type 2 diabetes mellitus"
+    """
+    return " ".join(re.findall(r"[a-z0-9]+", str(condition).lower()))
+def trial_condition_rows(nct_id: str, conditions: List[str]) -> List[tuple]:
+    """Rows for INSERT_TRIAL_CONDITION_SQL from a trial's condition list"""
+    rows = []
+    for condition in conditions or []:
+        condition_norm = normalize_condition(condition)
+        if condition_norm:
+            rows.append((condition_norm, nct_id))
+    return rows
+async def _backfill_trial_conditions(db):
+    """Fill trial_conditions from trials loaded before the table existed"""
+    cursor = await db.execute("SELECT nct_id, conditions FROM trials")
+    async for nct_id, conditions in cursor:
+        try:
+            condition_list = json.loads(conditions) if conditions else []
+        except ValueError:
+            condition_list = [conditions]
+        await db.executemany(
+            INSERT_TRIAL_CONDITION_SQL,
+            trial_condition_rows(nct_id, condition_list)
+        )
+async def _migrate_trial_columns(db):
+    """Add and backfill filter columns on databases created before they existed"""
+    cursor = await db.execute("PRAGMA table_info(trials)")
+    existing = {row[1] for row in await cursor.fetchall()}
+    missing = [name for name in TRIALS_ADDED_COLUMNS if name not in existing]
+    if not missing:
+        return
+    
+    for name in missing:
+        await db.execute(f"ALTER TABLE trials ADD COLUMN {name} {TRIALS_ADDED_COLUMNS[name]}")
+    # New hash columns stay NULL - the next sync treats those rows as changed
+    if "min_age_months" not in missing:
+        return
+    
+    cursor = await db.execute("SELECT nct_id, minimum_age, maximum_age, gender FROM trials")
+    updates = []
+    for nct_id, minimum_age, maximum_age, gender in await cursor.fetchall():
+        min_age_months = parse_age_months(minimum_age)
+        max_age_months = parse_age_months(maximum_age)
+        updates.append((
+            min_age_months if min_age_months is not None else 0,
+            max_age_months if max_age_months is not None else NO_MAX_AGE_MONTHS,
+            normalize_gender(gender),
+            nct_id
+        ))
+    await db.executemany("""
+        UPDATE trials
+        SET min_age_months = ?, max_age_months = ?, gender_norm = ?
+        WHERE nct_id = ?
+    """, updates)
+    print(f"[*] Migrated {len(updates)} trials to precomputed age/gender columns")
 async def init_db():
     """
-    Initialize the database - creates trials table if it doesn't exist
+    Initialize the database - creates trials table and search index if they don't exist
     Safe to run multiple times
     """
     # Create data folder if needed
@@ -21,36 +456,126 @@ async def init_db():
     
     # Connect to database
     async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Create trials table
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS trials (
-                nct_id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                brief_summary TEXT,
-                status TEXT,
-                phase TEXT,
-                conditions TEXT,
-                eligibility_criteria TEXT,
-                minimum_age TEXT,
-                maximum_age TEXT,
-                gender TEXT,
-                locations TEXT,
-                sponsor TEXT
-            )
-        """)
+        cursor = await db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'trials_fts'"
+        )
+        fts_exists = await cursor.fetchone() is not None
+        cursor = await db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'trial_conditions'"
+        )
+        conditions_exist = await cursor.fetchone() is not None
+        
+        # Create tables, search index and sync triggers
+        for statement in SCHEMA_STATEMENTS:
+            await db.execute(statement)
+        await _migrate_trial_columns(db)
+        for statement in INDEX_STATEMENTS:
+            await db.execute(statement)
+        
+        # Index rows that were loaded before the search index existed
+        if not fts_exists:
+            await db.execute("INSERT INTO trials_fts(trials_fts) VALUES ('rebuild')")
+        if not conditions_exist:
+            await _backfill_trial_conditions(db)
         
         await db.commit()
         print("[*] Database initialized")
+async def rebuild_search_index():
+    """
+    Rebuild the full-text index from the trials table
+    Needed after VACUUM, which may renumber the rowids the index points at
+    """
+    async with write_connection() as db:
+        await db.execute("INSERT INTO trials_fts(trials_fts) VALUES ('rebuild')")
+        await db.commit()
 async def get_trial_count() -> int:
     """Get total number of trials in database"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with read_connection() as db:
         cursor = await db.execute("SELECT COUNT(*) FROM trials")
         row = await cursor.fetchone()
         return row[0] if row else 0
+def build_fts_query(
+    conditions: List[str],
+    columns: Optional[str] = "conditions",
+    any_order: bool = False
+) -> Optional[str]:
+    """
+    Build an FTS5 MATCH expression that ORs one phrase per condition
+    
+    Args:
+        conditions: List of patient conditions
+        columns: Column to restrict phrases to, or None for all indexed columns
+        any_order: Match each condition's words in any order ("type 2
+            diabetes" finds "Diabetes Mellitus, Type 2") instead of as a phrase
+    
+    Returns:
+        MATCH expression, or None if no condition contains a searchable token
+    """
+    phrases = []
+    for condition in conditions:
+        # Quote tokens so user input can't inject FTS syntax
+        tokens = re.findall(r"\w+", str(condition).lower())
+        if not tokens:
+            continue
+        if any_order:
+            phrase = "(" + " ".join(f'"{token}"' for token in tokens) + ")"
+        else:
+            phrase = '"' + " ".join(tokens) + '"'
+        phrases.append(f"{columns} : {phrase}" if columns else phrase)
+    
+    return " OR ".join(phrases) if phrases else None
+def build_condition_lookup(conditions: List[str]) -> tuple:
+    """
+    Build an indexed WHERE clause over trial_conditions.condition_norm
+    
+    Each condition matches exactly or as a whole-word prefix, so
+    "type 2 diabetes" finds "type 2 diabetes mellitus" but "diabetes"
+    never finds "pre diabetes".
+    
+    Returns:
+        (where_sql, params), or (None, []) if nothing is searchable
+    """
+    where_clauses = []
+    params = []
+    for condition in conditions:
+        condition_norm = normalize_condition(condition)
+        if not condition_norm:
+            continue
+        # Range scan ["x ", "x!") covers every "x <more words>" on the index
+        where_clauses.append(
+            "(condition_norm = ? OR (condition_norm >= ? AND condition_norm < ?))"
+        )
+        params.extend([condition_norm, condition_norm + " ", condition_norm + "!"])
+    
+    if not where_clauses:
+        return None, []
+    return " OR ".join(where_clauses), params
+def build_demographic_filter(age: Optional[int], gender: Optional[str]) -> tuple:
+    """
+    Build "AND ..." predicates on the precomputed age/gender columns
+    
+    Returns:
+        (filter_sql, params) - empty if neither age nor gender is known
+    """
+    clauses = []
+    params = []
+    if gender:
+        # Patients of "other" gender only match trials open to all
+        gender_upper = gender.upper()
+        clauses.append("AND trials.gender_norm IN ('ALL', ?)")
+        params.append(gender_upper if gender_upper in GENDER_VALUES else "ALL")
+    if age is not None:
+        clauses.append("AND trials.min_age_months <= ? AND trials.max_age_months >= ?")
+        params.extend([age * 12, age * 12])
+    return "\n".join(clauses), params
 async def search_trials_by_condition(
     conditions: List[str], 
     location: Optional[str] = None, 
-    limit: int = 50
+    limit: int = 50,
+    ranked: bool = False,
+    exact: bool = False,
+    age: Optional[int] = None,
+    gender: Optional[str] = None
 ) -> List[Dict]:
     """
     Search for trials matching patient conditions
@@ -59,33 +584,83 @@ async def search_trials_by_condition(
         conditions: List of patient conditions
         location: Optional location filter
         limit: Max number of results
+        ranked: If True, match each condition's words (in any order) in
+            conditions, title and summary and return the top `limit` trials
+            by BM25; otherwise match phrases in the conditions column only,
+            in index order
+        exact: If True, match normalized conditions by equality or
+            whole-word prefix via trial_conditions; combined with `ranked`,
+            trials matching more patient conditions come first
+        age: Optional patient age in years - excludes trials whose age
+            range doesn't include it
+        gender: Optional patient gender ("male", "female", "other") -
+            excludes trials restricted to another sex
     
     Returns:
         List of trial dictionaries
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Return results as dictionaries
-        db.row_factory = aiosqlite.Row
-        
-        # Build WHERE clause
-        where_clauses = []
-        params = []
+    async with read_connection() as db:
+        # Demographic filters run in SQL before LIMIT, on precomputed columns
+        filter_sql, filter_params = build_demographic_filter(age, gender)
         
-        for condition in conditions:
-            where_clauses.append("LOWER(conditions) LIKE ?")
-            params.append(f"%{condition.lower()}%")
+        if exact:
+            lookup_sql, lookup_params = build_condition_lookup(conditions)
+            match_expr = None
+        else:
+            lookup_sql, lookup_params = None, []
+            match_expr = build_fts_query(conditions, columns=None if ranked else "conditions", any_order=ranked)
         
-        # Combine with OR
-        where_sql = " OR ".join(where_clauses) if where_clauses else "1=1"
-        
-        # Build query
-        query = f"""
-            SELECT * FROM trials 
-            WHERE ({where_sql}) 
-            AND status = 'RECRUITING'
-            LIMIT ?
-        """
-        params.append(limit)
+        if lookup_sql and ranked:
+            query = f"""
+                SELECT trials.* FROM trial_conditions
+                JOIN trials ON trials.nct_id = trial_conditions.nct_id
+                WHERE ({lookup_sql})
+                AND trials.status = 'RECRUITING'
+                AND trials.is_stale = 0
+                {filter_sql}
+                GROUP BY trials.nct_id
+                ORDER BY COUNT(*) DESC
+                LIMIT ?
+            """
+            params = lookup_params + filter_params + [limit]
+        elif lookup_sql:
+            query = f"""
+                SELECT * FROM trials
+                WHERE nct_id IN (
+                    SELECT nct_id FROM trial_conditions WHERE {lookup_sql}
+                )
+                AND trials.status = 'RECRUITING'
+                AND trials.is_stale = 0
+                {filter_sql}
+                LIMIT ?
+            """
+            params = lookup_params + filter_params + [limit]
+        elif match_expr:
+            order_sql = "ORDER BY bm25(trials_fts, ?, ?, ?)" if ranked else ""
+            query = f"""
+                SELECT trials.* FROM trials_fts
+                JOIN trials ON trials.rowid = trials_fts.rowid
+                WHERE trials_fts MATCH ?
+                AND trials.status = 'RECRUITING'
+                AND trials.is_stale = 0
+                {filter_sql}
+                {order_sql}
+                LIMIT ?
+            """
+            params = [match_expr] + filter_params
+            if ranked:
+                params.extend(BM25_WEIGHTS)
+            params.append(limit)
+        else:
+            # Nothing to match on - any recruiting trial
+            query = f"""
+                SELECT * FROM trials
+                WHERE trials.status = 'RECRUITING'
+                AND trials.is_stale = 0
+                {filter_sql}
+                LIMIT ?
+            """
+            params = filter_params + [limit]
         
         # Execute
         cursor = await db.execute(query, params)
@@ -113,26 +688,298 @@ async def search_trials_by_condition(
         
         return trials
 async def insert_trial(trial_data: Dict):
-    """Insert a single trial into database"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            INSERT OR REPLACE INTO trials 
-            (nct_id, title, brief_summary, status, phase, conditions,
-             eligibility_criteria, minimum_age, maximum_age, gender,
-             locations, sponsor)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            trial_data.get("nct_id"),
-            trial_data.get("title"),
-            trial_data.get("brief_summary"),
-            trial_data.get("status"),
-            trial_data.get("phase"),
-            json.dumps(trial_data.get("conditions", [])),
-            trial_data.get("eligibility_criteria"),
-            trial_data.get("minimum_age"),
-            trial_data.get("maximum_age"),
-            trial_data.get("gender"),
-            json.dumps(trial_data.get("locations", [])),
-            trial_data.get("sponsor")
-        ))
-        await db.commit()
\ No newline at end of file
+    """
+    Insert or update a single trial
+    Full-text index is kept in sync by triggers, trial_conditions here
+    """
+    async with write_connection() as db:
+        await db.execute(UPSERT_TRIAL_SQL, trial_row(trial_data))
+        await db.execute(DELETE_TRIAL_CONDITIONS_SQL, (trial_data.get("nct_id"),))
+        await db.executemany(
+            INSERT_TRIAL_CONDITION_SQL,
+            trial_condition_rows(trial_data.get("nct_id"), trial_data.get("conditions", []))
+        )
+        await db.commit()
+
+async def _upsert_trials(db, batch: List[Dict]):
+    """Upsert trials and their trial_conditions rows (caller owns the transaction)"""
+    await db.executemany(UPSERT_TRIAL_SQL, [trial_row(t) for t in batch])
+    await db.executemany(
+        DELETE_TRIAL_CONDITIONS_SQL,
+        [(t.get("nct_id"),) for t in batch]
+    )
+    await db.executemany(INSERT_TRIAL_CONDITION_SQL, [
+        row
+        for t in batch
+        for row in trial_condition_rows(t.get("nct_id"), t.get("conditions", []))
+    ])
+async def _write_trials_batch(db, batch: List[Dict]):
+    """Upsert a batch of trials in one explicit transaction"""
+    await db.execute("BEGIN")
+    try:
+        await _upsert_trials(db, batch)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+async def insert_trials_many(
+    trials: Iterable[Dict],
+    batch_size: int = 1000,
+    defer_indexes: bool = True
+) -> Dict:
+    """
+    Insert or update many trials in batched transactions
+    
+    Each batch is written with executemany inside one explicit
+    transaction. With `defer_indexes`, the composite filter index and the
+    full-text sync triggers are dropped for the load and the index and
+    search index are rebuilt once at the end - much faster for full
+    refreshes, wasteful for a handful of rows.
+    
+    Args:
+        trials: Trial dictionaries (any iterable - consumed lazily)
+        batch_size: Trials per transaction
+        defer_indexes: Rebuild secondary indexes after the load
+    
+    Returns:
+        {"inserted": count, "seconds": elapsed, "trials_per_second": rate}
+    """
+    start_time = time.time()
+    count = 0
+    
+    async with write_connection() as db:
+        if defer_indexes:
+            for name in DEFERRED_INDEXES:
+                await db.execute(f"DROP INDEX IF EXISTS {name}")
+            for name in FTS_TRIGGERS:
+                await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+            await db.commit()
+        
+        try:
+            batch = []
+            for trial in trials:
+                batch.append(trial)
+                if len(batch) >= batch_size:
+                    await _write_trials_batch(db, batch)
+                    count += len(batch)
+                    batch = []
+                    print(f"  Inserted {count} trials...")
+            if batch:
+                await _write_trials_batch(db, batch)
+                count += len(batch)
+        finally:
+            if defer_indexes:
+                # Restore indexes and triggers even if the load failed part way
+                for statement in INDEX_STATEMENTS + TRIALS_FTS_TRIGGERS_SQL:
+                    await db.execute(statement)
+                await db.execute("INSERT INTO trials_fts(trials_fts) VALUES ('rebuild')")
+                await db.commit()
+    
+    elapsed = time.time() - start_time
+    return {
+        "inserted": count,
+        "seconds": round(elapsed, 2),
+        "trials_per_second": round(count / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+async def sync_trials(
+    trials: Iterable[Dict],
+    batch_size: int = 1000,
+    mark_stale: bool = True
+) -> Dict:
+    """
+    Incrementally sync the database with a full snapshot of the source
+    
+    Each incoming trial is hashed and compared with the stored hash; only
+    new or changed trials are written. With `mark_stale`, trials missing
+    from the snapshot are flagged is_stale (kept, but excluded from
+    search). Every write is logged in trial_changes under one sync_id.
+    
+    Args:
+        trials: Trial dictionaries - the complete current source snapshot
+        batch_size: Trials compared/written per transaction
+        mark_stale: Flag stored trials absent from `trials`
+    
+    Returns:
+        Summary with sync_id, counts per change type and the changed nct_ids
+    """
+    start_time = time.time()
+    sync_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+    summary = {
+        "sync_id": sync_id,
+        "added": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "stale": 0,
+        "changes": []
+    }
+    
+    async def sync_batch(db, batch):
+        for trial in batch:
+            trial["content_hash"] = compute_content_hash(trial)
+        ids = [t.get("nct_id") for t in batch]
+        placeholders = ",".join("?" * len(ids))
+        cursor = await db.execute(
+            f"SELECT nct_id, content_hash, is_stale FROM trials WHERE nct_id IN ({placeholders})",
+            ids
+        )
+        stored = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+        
+        changed = []
+        changes = []
+        changed_at = datetime.now(timezone.utc).isoformat()
+        for trial in batch:
+            nct_id = trial.get("nct_id")
+            if nct_id not in stored:
+                change_type = CHANGE_ADDED
+            elif stored[nct_id][0] != trial["content_hash"] or stored[nct_id][1]:
+                # Content changed, or a stale trial came back
+                change_type = CHANGE_UPDATED
+            else:
+                summary["unchanged"] += 1
+                continue
+            summary["added" if change_type == CHANGE_ADDED else "updated"] += 1
+            summary["changes"].append({"nct_id": nct_id, "change_type": change_type})
+            changed.append(trial)
+            changes.append((sync_id, nct_id, change_type, changed_at))
+        
+        await db.execute("BEGIN")
+        try:
+            await db.executemany(
+                "INSERT OR IGNORE INTO temp.sync_seen (nct_id) VALUES (?)",
+                [(nct_id,) for nct_id in ids]
+            )
+            if changed:
+                await _upsert_trials(db, changed)
+                await db.executemany(INSERT_TRIAL_CHANGE_SQL, changes)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    
+    async with write_connection() as db:
+        # Snapshot membership, for finding trials that disappeared
+        await db.execute("CREATE TEMP TABLE IF NOT EXISTS sync_seen (nct_id TEXT PRIMARY KEY)")
+        await db.execute("DELETE FROM temp.sync_seen")
+        await db.commit()
+        try:
+            batch = []
+            for trial in trials:
+                batch.append(trial)
+                if len(batch) >= batch_size:
+                    await sync_batch(db, batch)
+                    batch = []
+            if batch:
+                await sync_batch(db, batch)
+            
+            if mark_stale:
+                cursor = await db.execute("""
+                    SELECT nct_id FROM trials
+                    WHERE is_stale = 0
+                    AND nct_id NOT IN (SELECT nct_id FROM temp.sync_seen)
+                """)
+                stale_ids = [row[0] for row in await cursor.fetchall()]
+                if stale_ids:
+                    changed_at = datetime.now(timezone.utc).isoformat()
+                    await db.execute("BEGIN")
+                    try:
+                        await db.executemany(
+                            "UPDATE trials SET is_stale = 1 WHERE nct_id = ?",
+                            [(nct_id,) for nct_id in stale_ids]
+                        )
+                        await db.executemany(INSERT_TRIAL_CHANGE_SQL, [
+                            (sync_id, nct_id, CHANGE_STALE, changed_at)
+                            for nct_id in stale_ids
+                        ])
+                        await db.commit()
+                    except Exception:
+                        await db.rollback()
+                        raise
+                summary["stale"] = len(stale_ids)
+                summary["changes"].extend(
+                    {"nct_id": nct_id, "change_type": CHANGE_STALE}
+                    for nct_id in stale_ids
+                )
+        finally:
+            await db.execute("DROP TABLE IF EXISTS temp.sync_seen")
+            await db.commit()
+    
+    summary["seconds"] = round(time.time() - start_time, 2)
+    return summary
+async def get_trial_changes(sync_id: str) -> List[Dict]:
+    """Change log entries (nct_id, change_type, changed_at) for one sync"""
+    async with read_connection() as db:
+        cursor = await db.execute("""
+            SELECT nct_id, change_type, changed_at FROM trial_changes
+            WHERE sync_id = ?
+            ORDER BY id
+        """, (sync_id,))
+        return [dict(row) for row in await cursor.fetchall()]
+async def get_trial_rules(nct_ids: List[str]) -> Dict[str, Dict]:
+    """
+    Compiled rules for the given trials
+
+    Returns:
+        {nct_id: {"criteria_hash", "compiler_version", "rules"}} for the
+        trials that have been compiled
+    """
+    if not nct_ids:
+        return {}
+    placeholders = ",".join("?" * len(nct_ids))
+    async with read_connection() as db:
+        cursor = await db.execute(f"""
+            SELECT nct_id, criteria_hash, compiler_version, rules FROM trial_rules
+            WHERE nct_id IN ({placeholders})
+        """, list(nct_ids))
+        return {
+            row["nct_id"]: {
+                "criteria_hash": row["criteria_hash"],
+                "compiler_version": row["compiler_version"],
+                "rules": json.loads(row["rules"])
+            }
+            for row in await cursor.fetchall()
+        }
+async def get_trials_for_compilation() -> List[Dict]:
+    """
+    Criteria text of every current trial with the state of its stored rules
+
+    Changed criteria can't be detected in SQL (criteria_hash is SHA-256),
+    so the caller decides what needs recompiling.
+
+    Returns:
+        Dicts with nct_id, eligibility_criteria, criteria_hash and
+        compiler_version (the last two None if never compiled)
+    """
+    async with read_connection() as db:
+        cursor = await db.execute("""
+            SELECT trials.nct_id, trials.eligibility_criteria,
+                   trial_rules.criteria_hash, trial_rules.compiler_version
+            FROM trials
+            LEFT JOIN trial_rules ON trial_rules.nct_id = trials.nct_id
+            WHERE trials.is_stale = 0
+        """)
+        return [dict(row) for row in await cursor.fetchall()]
+async def save_trial_rules(rows: List[tuple]):
+    """
+    Store compiled rules
+
+    Args:
+        rows: (nct_id, criteria_hash, compiler_version, rules_json,
+               rule_count, unparsed_count) tuples
+    """
+    compiled_at = datetime.now(timezone.utc).isoformat()
+    async with write_connection() as db:
+        await db.executemany("""
+            INSERT INTO trial_rules (
+                nct_id, criteria_hash, compiler_version, rules,
+                rule_count, unparsed_count, compiled_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(nct_id) DO UPDATE SET
+                criteria_hash = excluded.criteria_hash,
+                compiler_version = excluded.compiler_version,
+                rules = excluded.rules,
+                rule_count = excluded.rule_count,
+                unparsed_count = excluded.unparsed_count,
+                compiled_at = excluded.compiled_at
+        """, [row + (compiled_at,) for row in rows])
+        await db.commit()
@@ -0,0 +1,32 @@
+"""
+Cancel request work when the client goes away
+"""
+import asyncio
+from typing import Awaitable, TypeVar
+from fastapi import HTTPException, Request
+T = TypeVar("T")
+# Seconds between disconnect checks
+POLL_INTERVAL = 0.5
+async def run_until_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it if the client disconnects first
+    
+    Cancellation propagates into in-flight LLM calls, so a closed browser
+    tab stops spending API quota and worker slots.
+    
+    Raises:
+        HTTPException(499): The client disconnected (response is never sent)
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                print("⚠️ Client disconnected - cancelled request work")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
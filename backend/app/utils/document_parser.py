@@ -0,0 +1,385 @@
+"""
+Document parsing in a process pool
+
+PyPDF2 text extraction and image decoding are CPU-bound and would block
+the event loop for seconds on a large record, so they run in a bounded
+ProcessPoolExecutor:
+
+- parse_pdf_text: long PDFs are split into page ranges that are parsed
+  in parallel; page texts are joined once at the end
+- load_image: the image is decoded in a worker, auto-oriented, reduced
+  to grayscale when it has no real colour, downscaled to a pixel budget
+  that keeps text legible and recompressed, then returned as an inline
+  blob ready to send to Gemini; byte savings are reported by
+  get_image_stats()
+- parse_pdf_images: for scanned PDFs, the page images are pulled out of
+  the PDF and prepared the same way, in parallel page ranges; blank and
+  duplicate pages are dropped
+
+Documents over MAX_DOCUMENT_BYTES are refused; only the first
+MAX_PDF_PAGES pages of a PDF are read.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+# Per-document details go to debug/info; only lost content is a warning
+logger = logging.getLogger(__name__)
+
+# Worker processes shared by all requests in this worker
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages parsed per pool task; shorter PDFs are parsed in one task
+PAGES_PER_TASK = int(os.getenv("DOCUMENT_PAGES_PER_TASK", "8"))
+MAX_PDF_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "50"))
+MAX_DOCUMENT_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Pixels sent to Vision: ~ an A4 page at 200 DPI, plenty for printed text
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(4_000_000)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Convert to grayscale when the image has no real colour (auto), or never
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "auto") == "auto"
+# Mean per-pixel channel spread (0-255) below which an image counts as colourless
+GRAYSCALE_MAX_CHROMA = 12
+EXIF_ORIENTATION = 0x0112
+# A scanned page with less than this fraction of "ink" pixels is blank
+# (scanner noise and specks stay well below it; a single line of text doesn't)
+BLANK_PAGE_MAX_INK = 0.0002
+# Pages are compared as box-averaged thumbnails. A page is a duplicate only
+# if no cell differs from an earlier page by more than a few gray levels
+# (the same scan included twice): one changed lab value keeps it
+PAGE_SIGNATURE_SIZE = (256, 256)
+DUPLICATE_MAX_CELL_DIFFERENCE = 8
+
+_pool: Optional[ProcessPoolExecutor] = None
+_image_stats = {"images": 0, "original_bytes": 0, "sent_bytes": 0}
+
+
+class DocumentTooLargeError(ValueError):
+    """Raised for uploads over MAX_DOCUMENT_BYTES"""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs threads (LLM pool, aiosqlite) isn't safe
+        _pool = ProcessPoolExecutor(
+            max_workers=DOCUMENT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def _check_size(file_path: str):
+    size = os.path.getsize(file_path)
+    if size > MAX_DOCUMENT_BYTES:
+        raise DocumentTooLargeError(
+            f"Document is {size / 1024 / 1024:.1f} MB; the limit is {MAX_DOCUMENT_BYTES / 1024 / 1024:.0f} MB"
+        )
+
+
+async def _run(func, *args):
+    """Run func(*args) in the pool; a pool whose worker died is replaced"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), func, *args)
+    except BrokenProcessPool:
+        shutdown()
+        raise
+
+
+# Worker functions (run in the pool; must be importable top-level functions)
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> Tuple[int, List[str]]:
+    """
+    Text of pages [start, stop) of a PDF
+
+    Returns:
+        (total page count, page texts)
+    """
+    import PyPDF2
+
+    with open(file_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        pages = reader.pages
+        return len(pages), [pages[i].extract_text() or "" for i in range(start, min(stop, len(pages)))]
+
+
+def _is_colourless(img) -> bool:
+    """True if a small RGB copy of img has almost no chroma (scans, photocopies)"""
+    from PIL import ImageChops
+
+    sample = img.convert("RGB")
+    sample.thumbnail((128, 128))
+    r, g, b = sample.split()
+    spread = ImageChops.subtract(ImageChops.lighter(ImageChops.lighter(r, g), b),
+                                 ImageChops.darker(ImageChops.darker(r, g), b))
+    histogram = spread.histogram()
+    mean = sum(value * count for value, count in enumerate(histogram)) / max(1, sum(histogram))
+    return mean < GRAYSCALE_MAX_CHROMA
+
+
+def _page_signature(gray) -> Tuple[float, bytes]:
+    """
+    Ink of a grayscale page: pixels clearly darker than its background
+
+    Returns:
+        (fraction of ink pixels, PAGE_SIGNATURE_SIZE thumbnail)
+    """
+    from PIL import Image
+
+    # Full resolution: downscaling first would wash out thin text strokes
+    histogram = gray.histogram()
+    total = sum(histogram)
+    # Background: the median gray level
+    running = 0
+    for background, count in enumerate(histogram):
+        running += count
+        if running * 2 >= total:
+            break
+    threshold = max(0, background - 60)
+    thumbnail = gray.resize(PAGE_SIGNATURE_SIZE, Image.BOX)
+    return sum(histogram[:threshold]) / max(1, total), thumbnail.tobytes()
+
+
+def prepare_image(data: bytes, page_signature: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Decode and shrink an image for Vision (raises if it's corrupt)
+
+    Args:
+        data: Encoded image
+        page_signature: Also report whether it's blank, and a thumbnail
+                        for duplicate detection (scanned PDF pages)
+
+    Returns:
+        (inline blob {"mime_type", "data"}, size info for the stats)
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        original_format = img.format
+        original_size = img.size
+        scale = min(1.0, (IMAGE_MAX_PIXELS / (img.width * img.height)) ** 0.5)
+        if scale < 1.0 and original_format == "JPEG":
+            # Let the JPEG decoder skip detail we'd throw away anyway
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+        img.load()
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        prepared = ImageOps.exif_transpose(img)
+
+    transposed = orientation not in (1, None)
+    if prepared.mode in ("RGBA", "LA", "P", "PA"):
+        prepared = prepared.convert("RGBA")
+        background = Image.new("RGB", prepared.size, "white")
+        background.paste(prepared, mask=prepared.getchannel("A"))
+        prepared = background
+    elif prepared.mode not in ("RGB", "L"):
+        prepared = prepared.convert("RGB")
+    grayscale = prepared.mode == "L" or (IMAGE_GRAYSCALE and _is_colourless(prepared))
+    if grayscale:
+        prepared = prepared.convert("L")
+
+    target = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+    if orientation in (5, 6, 7, 8):
+        # Rotated by 90 degrees: width and height swap
+        target = target[::-1]
+    if prepared.size != target:
+        prepared = prepared.resize(target, Image.LANCZOS)
+
+    out = io.BytesIO()
+    prepared.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    blob = {"mime_type": "image/jpeg", "data": out.getvalue()}
+    # Already small and untouched (e.g. a PNG screenshot): keep the original
+    if scale == 1.0 and not transposed and len(data) <= len(blob["data"]):
+        blob = {"mime_type": Image.MIME.get(original_format, "image/jpeg"), "data": data}
+
+    info = {
+        "original_bytes": len(data),
+        "sent_bytes": len(blob["data"]),
+        "original_size": original_size,
+        "size": prepared.size,
+        "grayscale": grayscale
+    }
+    if page_signature:
+        ink_ratio, info["thumbnail"] = _page_signature(prepared.convert("L"))
+        info["blank"] = ink_ratio < BLANK_PAGE_MAX_INK
+    return blob, info
+
+
+def prepare_image_file(file_path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    with open(file_path, "rb") as file:
+        return prepare_image(file.read())
+
+
+def extract_pdf_page_images(file_path: str, start: int, stop: int) -> Tuple[int, List[Tuple[int, Dict, Dict]]]:
+    """
+    Prepared scan images of pages [start, stop) of a PDF
+
+    A scanned page is one full-page image, so only the largest image on
+    each page is used. Pages without a readable image are left out.
+
+    Returns:
+        (total page count, [(page index, blob, info)])
+    """
+    import PyPDF2
+
+    with open(file_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        pages = reader.pages
+        results = []
+        for i in range(start, min(stop, len(pages))):
+            try:
+                images = pages[i].images
+                if not images:
+                    continue
+                largest = max(images, key=lambda image: len(image.data))
+                blob, info = prepare_image(largest.data, page_signature=True)
+            except Exception as e:
+                logger.debug("Skipping page %d: no readable image (%s: %s)", i + 1, type(e).__name__, e)
+                continue
+            results.append((i, blob, info))
+        return len(pages), results
+
+
+def preload():
+    """Import the parsing libraries in a worker"""
+    import PyPDF2
+    from PIL import Image, ImageChops, ImageOps
+
+
+# Async API
+
+async def parse_pdf_text(file_path: str) -> str:
+    """
+    Extract a PDF's text without blocking the event loop
+
+    Returns:
+        Page texts, each followed by a newline ("" if the PDF can't be read)
+
+    Raises:
+        DocumentTooLargeError: The file is over MAX_DOCUMENT_BYTES
+    """
+    _check_size(file_path)
+    try:
+        texts = await _map_pages(extract_pdf_pages, file_path)
+    except Exception as e:
+        logger.warning("Error extracting PDF text: %s", e)
+        return ""
+    return "".join(text + "\n" for text in texts)
+
+
+async def _map_pages(worker, file_path: str) -> list:
+    """
+    worker(file_path, start, stop) over the first MAX_PDF_PAGES pages
+
+    The first PAGES_PER_TASK pages are read in one task (which also
+    reports the page count); the rest run as parallel page ranges.
+    Results are concatenated in page order.
+    """
+    page_count, results = await _run(worker, file_path, 0, min(PAGES_PER_TASK, MAX_PDF_PAGES))
+    if page_count > MAX_PDF_PAGES:
+        logger.warning("PDF has %d pages - reading the first %d", page_count, MAX_PDF_PAGES)
+    last_page = min(page_count, MAX_PDF_PAGES)
+    chunks = await asyncio.gather(*[
+        _run(worker, file_path, start, min(start + PAGES_PER_TASK, last_page))
+        for start in range(PAGES_PER_TASK, last_page, PAGES_PER_TASK)
+    ])
+    for _, chunk in chunks:
+        results.extend(chunk)
+    return results
+
+
+async def parse_pdf_images(file_path: str) -> List[Dict[str, Any]]:
+    """
+    Page images of a scanned PDF, prepared for Vision, in page order
+
+    Blank pages and pages that repeat an earlier page (scanned twice)
+    are dropped.
+
+    Returns:
+        Inline blobs, one per kept page ([] if the PDF has no page images)
+
+    Raises:
+        DocumentTooLargeError: The file is over MAX_DOCUMENT_BYTES
+    """
+    import numpy as np
+
+    _check_size(file_path)
+    try:
+        pages = await _map_pages(extract_pdf_page_images, file_path)
+    except Exception as e:
+        logger.warning("Error extracting PDF images: %s", e)
+        return []
+
+    blobs = []
+    kept_thumbnails = []
+    blank = duplicate = 0
+    for _, blob, info in pages:
+        if info["blank"]:
+            blank += 1
+            continue
+        thumbnail = np.frombuffer(info["thumbnail"], dtype=np.uint8).astype(np.int16)
+        if any(np.abs(thumbnail - kept).max() <= DUPLICATE_MAX_CELL_DIFFERENCE for kept in kept_thumbnails):
+            duplicate += 1
+            continue
+        kept_thumbnails.append(thumbnail)
+        record_image(info)
+        blobs.append(blob)
+    logger.info("Scanned PDF: %d page images kept, %d blank and %d duplicate dropped", len(blobs), blank, duplicate)
+    return blobs
+
+
+async def load_image(file_path: str) -> Dict[str, Any]:
+    """
+    Decode and shrink an uploaded image in the pool (see prepare_image)
+
+    Returns:
+        {"mime_type": ..., "data": bytes}, a Gemini inline-data part
+
+    Raises:
+        DocumentTooLargeError: The file is over MAX_DOCUMENT_BYTES
+        PIL.UnidentifiedImageError / OSError: Not a readable image
+    """
+    _check_size(file_path)
+    blob, info = await _run(prepare_image_file, file_path)
+    record_image(info)
+    return blob
+
+
+def record_image(info: Dict[str, Any]):
+    """Add one prepared image to the running byte totals"""
+    _image_stats["images"] += 1
+    _image_stats["original_bytes"] += info["original_bytes"]
+    _image_stats["sent_bytes"] += info["sent_bytes"]
+    logger.debug(
+        "Image %dx%d -> %dx%d%s: %d KB -> %d KB",
+        *info["original_size"], *info["size"], " grayscale" if info["grayscale"] else "",
+        info["original_bytes"] // 1024, info["sent_bytes"] // 1024
+    )
+
+
+def get_image_stats() -> Dict[str, Any]:
+    saved = max(0, _image_stats["original_bytes"] - _image_stats["sent_bytes"])
+    return {
+        **_image_stats,
+        "saved_bytes": saved,
+        "saved_ratio": round(saved / _image_stats["original_bytes"], 3) if _image_stats["original_bytes"] else 0.0
+    }
+
+
+def warm_up():
+    """Start the worker processes (and load PyPDF2 / PIL in them) ahead of the first upload"""
+    pool = _get_pool()
+    for _ in range(DOCUMENT_WORKERS):
+        pool.submit(preload)
+
+
+def shutdown():
+    """Stop the worker processes - call on app shutdown"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -2,14 +2,16 @@
 File handling utilities for uploads
 """
 import os
-import shutil
-from typing import Optional
+import hashlib
+from typing import Optional, Tuple
 from fastapi import UploadFile
 # Upload directory
 UPLOAD_DIR = os.path.join(
     os.path.dirname(__file__),
     "../../uploads"
 )
+# Bytes read from the upload stream at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 async def save_upload_file(upload_file: UploadFile) -> str:
     """
     Save uploaded file to uploads directory
@@ -20,17 +22,35 @@ async def save_upload_file(upload_file: UploadFile) -> str:
     Returns:
         Absolute path to saved file
     """
+    file_path, _ = await save_upload_file_with_digest(upload_file)
+    return file_path
+async def save_upload_file_with_digest(upload_file: UploadFile) -> Tuple[str, str]:
+    """
+    Save uploaded file to uploads directory, hashing it as it streams in
+    
+    Args:
+        upload_file: FastAPI UploadFile object
+    
+    Returns:
+        (absolute path to saved file, SHA-256 hex digest of its contents)
+    """
     # Ensure uploads directory exists
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     
     # Create file path
     file_path = os.path.join(UPLOAD_DIR, upload_file.filename)
     
-    # Save file
+    # Save file and hash each chunk on the way through
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
     
-    return file_path
+    return file_path, digest.hexdigest()
 def delete_file(file_path: str) -> bool:
     """
     Delete a file if it exists
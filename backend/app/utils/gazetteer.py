@@ -0,0 +1,323 @@
+"""
+City gazetteer - place names to country, Indian city tier and coordinates
+
+Places (with aliases) are loaded once from app/data/gazetteer.tsv, or
+from GAZETTEER_PATH. The bundled file holds ~600 places: Indian cities
+with their tiers and major cities elsewhere. For full coverage, build a
+GeoNames extract (cities15000, ~30k places) and point the app at it:
+
+    python scripts/build_gazetteer.py --out /srv/gazetteer/cities15000.tsv
+    GAZETTEER_PATH=/srv/gazetteer/cities15000.tsv uvicorn main:app
+
+or swap it in at runtime with use_gazetteer(path). Any place missing
+from the loaded file is Tier 3.
+
+Names are matched on token n-grams: the normalized text is split into
+words and each run of up to `max_tokens` words is looked up in a dict,
+leftmost-longest first. A lookup costs O(words in the text) whatever
+the size of the gazetteer, and results are memoized per normalized text.
+"""
+import functools
+import math
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(__file__), "../data/gazetteer.tsv")
+)
+# Distinct normalized texts memoized by find_places
+GAZETTEER_CACHE_SIZE = int(os.getenv("GAZETTEER_CACHE_SIZE", "4096"))
+
+# Locations with no name in the gazetteer, and places outside India
+UNKNOWN_TIER = "Tier 3"
+# Empty location: keeps the old default
+DEFAULT_TIER = "Tier 1"
+
+# Country names recognised in location text, used to tell apart places
+# that share a name ("Hyderabad, Pakistan")
+COUNTRY_NAMES = {
+    "IN": ["india", "bharat"],
+    "US": ["united states", "united states of america", "usa", "us", "u s a", "u s"],
+    "GB": ["united kingdom", "uk", "u k", "great britain", "england", "scotland", "wales", "northern ireland"],
+    "CA": ["canada"],
+    "AU": ["australia"],
+    "NZ": ["new zealand"],
+    "IE": ["ireland"],
+    "FR": ["france"],
+    "DE": ["germany", "deutschland"],
+    "ES": ["spain", "espana"],
+    "IT": ["italy", "italia"],
+    "NL": ["netherlands", "the netherlands", "holland"],
+    "BE": ["belgium"],
+    "CH": ["switzerland"],
+    "AT": ["austria"],
+    "SE": ["sweden"],
+    "NO": ["norway"],
+    "DK": ["denmark"],
+    "FI": ["finland"],
+    "PL": ["poland"],
+    "CZ": ["czechia", "czech republic"],
+    "HU": ["hungary"],
+    "RO": ["romania"],
+    "BG": ["bulgaria"],
+    "GR": ["greece"],
+    "PT": ["portugal"],
+    "RU": ["russia", "russian federation"],
+    "UA": ["ukraine"],
+    "TR": ["turkey", "turkiye"],
+    "IL": ["israel"],
+    "AE": ["united arab emirates", "uae"],
+    "SA": ["saudi arabia"],
+    "QA": ["qatar"],
+    "KW": ["kuwait"],
+    "OM": ["oman"],
+    "IR": ["iran"],
+    "IQ": ["iraq"],
+    "JO": ["jordan"],
+    "LB": ["lebanon"],
+    "PK": ["pakistan"],
+    "BD": ["bangladesh"],
+    "NP": ["nepal"],
+    "LK": ["sri lanka"],
+    "AF": ["afghanistan"],
+    "CN": ["china"],
+    "TW": ["taiwan"],
+    "JP": ["japan"],
+    "KR": ["korea", "south korea", "republic of korea"],
+    "MY": ["malaysia"],
+    "TH": ["thailand"],
+    "ID": ["indonesia"],
+    "PH": ["philippines"],
+    "VN": ["vietnam", "viet nam"],
+    "EG": ["egypt"],
+    "NG": ["nigeria"],
+    "KE": ["kenya"],
+    "ZA": ["south africa"],
+    "GH": ["ghana"],
+    "ET": ["ethiopia"],
+    "UG": ["uganda"],
+    "TZ": ["tanzania"],
+    "MA": ["morocco"],
+    "TN": ["tunisia"],
+    "CD": ["democratic republic of the congo", "dr congo"],
+    "MX": ["mexico"],
+    "BR": ["brazil", "brasil"],
+    "AR": ["argentina"],
+    "CL": ["chile"],
+    "PE": ["peru"],
+    "CO": ["colombia"],
+    "VE": ["venezuela"],
+    "EC": ["ecuador"],
+    "UY": ["uruguay"],
+    "CU": ["cuba"],
+    "PR": ["puerto rico"]
+}
+
+# Letters NFKD doesn't decompose
+_FOLD = str.maketrans({"ł": "l", "ø": "o", "đ": "d", "ß": "ss", "æ": "ae", "œ": "oe", "ı": "i"})
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+@dataclass(frozen=True)
+class Place:
+    """One gazetteer row"""
+    name: str
+    country: str
+    tier: Optional[str]  # "Tier 1" / "Tier 2" / "Tier 3" for Indian cities
+    latitude: float
+    longitude: float
+
+
+def normalize(text: str) -> str:
+    """Lowercase ASCII words separated by single spaces ("São Paulo" -> "sao paulo")"""
+    text = unicodedata.normalize("NFKD", text.lower().translate(_FOLD))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+class Gazetteer:
+    """Token n-gram index over place names and country names"""
+
+    def __init__(self, places: List[Place], aliases: List[Tuple[str, int]]):
+        self.places = places
+        # Normalized name -> place indexes, in file order
+        self.names: Dict[str, List[int]] = {}
+        for name, index in aliases:
+            key = normalize(name)
+            if key:
+                entries = self.names.setdefault(key, [])
+                if index not in entries:
+                    entries.append(index)
+        self.countries: Dict[str, str] = {
+            normalize(name): code for code, names in COUNTRY_NAMES.items() for name in names
+        }
+        self.max_tokens = max(len(key.split()) for key in list(self.names) + list(self.countries))
+
+    def scan(self, normalized: str) -> Tuple[List[List[int]], List[str]]:
+        """
+        Place candidates and countries named in normalized text
+
+        Leftmost-longest: at each word the longest run of words that is a
+        name wins, and matching resumes after it. A place name beats a
+        country name of the same length ("Singapore").
+        """
+        tokens = normalized.split()
+        matches: List[List[int]] = []
+        countries: List[str] = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_tokens, len(tokens) - i), 0, -1):
+                key = " ".join(tokens[i:i + n])
+                if key in self.names:
+                    matches.append(self.names[key])
+                    break
+                if key in self.countries:
+                    countries.append(self.countries[key])
+                    break
+            else:
+                n = 1
+            i += n
+        return matches, countries
+
+    def find(self, normalized: str) -> Tuple[Tuple[Place, ...], Tuple[str, ...]]:
+        """
+        Places named in normalized text (in order) and the countries it names
+
+        When the text names countries, only places in them count ("Salem,
+        Oregon, United States" is not the Indian Salem); otherwise an
+        ambiguous name resolves to its earliest row.
+        """
+        matches, countries = self.scan(normalized)
+        places = []
+        for candidates in matches:
+            if countries:
+                candidates = [i for i in candidates if self.places[i].country in countries]
+                if not candidates:
+                    continue
+            if self.places[candidates[0]] not in places:
+                places.append(self.places[candidates[0]])
+        return tuple(places), tuple(countries)
+
+
+def load_gazetteer(path: str = GAZETTEER_PATH) -> Gazetteer:
+    """Read a gazetteer TSV (name, aliases, country, tier, latitude, longitude)"""
+    places: List[Place] = []
+    aliases: List[Tuple[str, int]] = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.startswith("#") or not line.strip():
+                continue
+            name, names, country, tier, latitude, longitude = line.rstrip("\n").split("\t")
+            if name == "name" and country == "country":
+                continue  # header
+            index = len(places)
+            places.append(Place(
+                name=name,
+                country=country,
+                tier=f"Tier {tier}" if tier else None,
+                latitude=float(latitude),
+                longitude=float(longitude)
+            ))
+            aliases.append((name, index))
+            aliases.extend((alias, index) for alias in names.split("|") if alias)
+    return Gazetteer(places, aliases)
+
+
+_gazetteer: Optional[Gazetteer] = None
+_load_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """The gazetteer, loaded on first use"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _load_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer()
+                print(f"🌍 Gazetteer: {len(_gazetteer.places)} places, {len(_gazetteer.names)} names")
+    return _gazetteer
+
+
+def use_gazetteer(path: str = GAZETTEER_PATH) -> Gazetteer:
+    """Load the gazetteer at path in place of the current one (and forget memoized lookups)"""
+    global _gazetteer
+    gazetteer = load_gazetteer(path)
+    with _load_lock:
+        _gazetteer = gazetteer
+        _find_normalized.cache_clear()
+    print(f"🌍 Gazetteer: {len(gazetteer.places)} places, {len(gazetteer.names)} names from {path}")
+    return gazetteer
+
+
+@functools.lru_cache(maxsize=GAZETTEER_CACHE_SIZE)
+def _find_normalized(normalized: str) -> Tuple[Tuple[Place, ...], Tuple[str, ...]]:
+    return get_gazetteer().find(normalized)
+
+
+def find_places(text: str) -> Tuple[Place, ...]:
+    """Places named in free text ("Andheri, Mumbai" -> (Mumbai,)), in order"""
+    if not text:
+        return ()
+    return _find_normalized(normalize(text))[0]
+
+
+def locate(text: str) -> Optional[Place]:
+    """The first place named in text, or None"""
+    places = find_places(text)
+    return places[0] if places else None
+
+
+def city_tier(location: str) -> str:
+    """
+    Indian city tier of a location
+
+    The best tier among the Indian cities named ("Pimpri, Pune" -> Tier 1).
+    Empty locations are Tier 1; unknown places and places outside India
+    are Tier 3.
+    """
+    if not location or not location.strip():
+        return DEFAULT_TIER
+    tiers = [place.tier for place in find_places(location) if place.tier]
+    return min(tiers) if tiers else UNKNOWN_TIER
+
+
+def is_in_india(text: str) -> bool:
+    """Whether text names India or an Indian city"""
+    if not text:
+        return False
+    places, countries = _find_normalized(normalize(text))
+    return "IN" in countries or any(place.country == "IN" for place in places)
+
+
+def distance_km(a: Place, b: Place) -> float:
+    """Great-circle (haversine) distance between two places"""
+    lat1, lat2 = math.radians(a.latitude), math.radians(b.latitude)
+    dlat = lat2 - lat1
+    dlon = math.radians(b.longitude - a.longitude)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+
+def nearest_distance_km(location: str, sites: Iterable[str]) -> Optional[float]:
+    """Distance from a location to the closest of several sites, None if any end is unknown"""
+    origin = locate(location)
+    if origin is None:
+        return None
+    distances = [distance_km(origin, place) for site in sites for place in find_places(str(site))]
+    return round(min(distances), 1) if distances else None
+
+
+def get_stats() -> Dict[str, int]:
+    """Places loaded and lookup cache hits / misses"""
+    info = _find_normalized.cache_info()
+    return {
+        "places": len(_gazetteer.places) if _gazetteer else 0,
+        "cache_hits": info.hits,
+        "cache_misses": info.misses,
+        "cache_size": info.currsize
+    }
@@ -0,0 +1,217 @@
+"""
+Pattern-based extraction for machine-generated lab reports
+
+Lab PDFs print their facts as "label: value unit" lines ("Age/Sex :
+58 Y / F", "HbA1c 7.2 %", "Fasting Glucose : 142 mg/dL"). parse_lab_report
+reads those with compiled patterns and returns the same JSON shape the
+extraction LLM returns, so Agent 1 can build the profile (and its
+confidence) the same way and skip the LLM when the report is complete.
+
+Lab labels come from criteria_compiler.LAB_ALIASES. A value is only
+taken when it is plausible for the lab and unit; anything unclear is
+left out for the LLM to read.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.criteria_compiler import LAB_ALIASES
+
+NUMBER = r"(\d{1,4}(?:\.\d+)?)"
+
+# Report key (as in EXTRACTION_PROMPT), LAB_ALIASES key, units (first is
+# the default when the report prints none), plausible range per unit.
+# Order matters: a line is read as the first lab whose label it contains
+LAB_FIELDS = [
+    ("HbA1c", "hba1c", {"%": (3, 20), "mmol/mol": (10, 200)}),
+    ("fasting_glucose", "fasting_glucose", {"mg/dL": (20, 800), "mmol/L": (1, 45)}),
+    ("eGFR", "egfr", {"mL/min": (1, 200)}),
+    ("creatinine", "creatinine", {"mg/dL": (0.1, 20), "µmol/L": (10, 2000)}),
+    ("LDL", "ldl", {"mg/dL": (10, 500), "mmol/L": (0.2, 13)}),
+    ("triglycerides", "triglycerides", {"mg/dL": (10, 3000), "mmol/L": (0.1, 35)}),
+    ("BMI", "bmi", {"kg/m2": (10, 80)}),
+    ("hemoglobin", "hemoglobin", {"g/dL": (2, 25)}),
+]
+# Report wordings the criteria aliases don't cover
+REPORT_ALIASES = {
+    "fasting_glucose": r"fasting (?:blood )?sugar|fbs|(?:plasma |blood )?glucose,?\s*\(?fasting\)?",
+}
+LAB_LABELS = [
+    (
+        key,
+        re.compile(
+            rf"(?<![a-z0-9])(?:{'|'.join(filter(None, [LAB_ALIASES[alias], REPORT_ALIASES.get(alias)]))})(?![a-z0-9])",
+            re.I
+        ),
+        units
+    )
+    for key, alias, units in LAB_FIELDS
+]
+CHOLESTEROL_LABEL = re.compile(r"(?<![a-z0-9])(?:total\s+)?cholesterol(?:,?\s*total)?(?![a-z0-9])", re.I)
+CHOLESTEROL_UNITS = {"mg/dL": (50, 600), "mmol/L": (1, 15)}
+# HDL / LDL / VLDL lines are not total cholesterol
+CHOLESTEROL_FRACTION = re.compile(r"\b(?:hdl|ldl|vldl|non-hdl)\b", re.I)
+BLOOD_PRESSURE = re.compile(
+    r"(?<![a-z0-9])(?:blood pressure|bp)(?![a-z0-9])[^\d\n]{0,20}?(\d{2,3})\s*/\s*(\d{2,3})(?:\s*mm\s*hg)?",
+    re.I
+)
+# Printed units, normalized: "mg/dl" -> "mg/dL"
+UNIT_PATTERN = re.compile(
+    r"\s*(%|mmol/mol|mg/dl|mmol/l|ml/min(?:/1\.73\s*m(?:2|²))?|µmol/l|umol/l|μmol/l|kg/m2|kg/m²|g/dl)",
+    re.I
+)
+UNIT_NAMES = {
+    "%": "%", "mmol/mol": "mmol/mol", "mg/dl": "mg/dL", "mmol/l": "mmol/L", "µmol/l": "µmol/L",
+    "umol/l": "µmol/L", "μmol/l": "µmol/L", "kg/m2": "kg/m2", "kg/m²": "kg/m2", "g/dl": "g/dL"
+}
+PARENTHESES = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+VALUE = re.compile(rf"(?<![\d./-]){NUMBER}(?![\d/-]|\.\d)")
+
+# "Age/Sex : 58 Y / F", "58 Yrs / Male"
+AGE_SEX = re.compile(
+    r"(?:\bage\s*/\s*(?:sex|gender)\b\s*[:\-]?\s*(\d{1,3})\s*(?:y(?:ea)?r?s?\.?)?"
+    r"|\b(\d{1,3})\s*y(?:ea)?r?s?\.?)\s*/\s*(male|female|m|f)\b",
+    re.I
+)
+# Not "Age: 8 Months" - an infant's age is left for the LLM
+AGE = re.compile(
+    r"\bage\b\s*[:\-]?\s*(\d{1,3})(?![\d.]|\s*(?:months?|mos?|weeks?|wks?|days?)\b)\s*(?:y(?:ea)?r?s?\b|yo\b)?"
+    r"|\b(\d{1,3})\s*(?:years?|yrs?)\s*(?:old\b|/)",
+    re.I
+)
+SEX = re.compile(r"\b(?:sex|gender)\b\s*[:\-]?\s*(male|female|m|f)\b", re.I)
+# "Diagnosis: ...", "Clinical History - ...", "K/C/O ...". Not a report's
+# "Impression:" - usually a finding ("Normal study"), left for the LLM
+CONDITIONS = re.compile(
+    r"^\s*(?:(?:provisional|final|clinical)\s+)?(?:diagnosis|clinical\s+(?:history|details|notes)"
+    r"|known case of|k/c/o)\s*[:\-]?\s*(.+)$",
+    re.I | re.M
+)
+MEDICATIONS = re.compile(r"^\s*(?:current\s+)?(?:medications?|drugs?|rx)\s*[:\-]\s*(.+)$", re.I | re.M)
+ALLERGIES = re.compile(r"^\s*(?:known\s+)?(?:drug\s+)?allerg(?:y|ies)\s*[:\-]\s*(.+)$", re.I | re.M)
+LOCATION = re.compile(r"^\s*(?:city|location|place)\s*[:\-]\s*([a-z][a-z .]{1,40}?)\s*$", re.I | re.M)
+DOSE = re.compile(r"(\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu)\b)", re.I)
+LIST_SEPARATOR = re.compile(r"\s*(?:[,;]|\band\b)\s*", re.I)
+# Empty entries, and normal / negative findings ("No evidence of malignancy")
+NOTHING = re.compile(
+    r"^(?:nil|none|no|nkda|nka|n/?a|-+|not known|no known.*|negative(?: for .*)?|unremarkable.*"
+    r"|(?:essentially |study |scan |report )?(?:is )?(?:within )?normal(?: limits| study| scan| report| findings?)?"
+    r"|wnl|no (?:evidence|signs?|significant|abnormalit|acute|active)\b.*)$",
+    re.I
+)
+GENDERS = {"m": "male", "male": "male", "f": "female", "female": "female"}
+
+
+def _split_list(text: str) -> List[str]:
+    items = [item.strip(" .") for item in LIST_SEPARATOR.split(text)]
+    return [item for item in items if item and len(item) <= 60 and not NOTHING.match(item)]
+
+
+def _read_value(rest: str, units: Dict[str, Tuple[float, float]]) -> Optional[Dict[str, Any]]:
+    """
+    The lab's value in the text after its label
+
+    Parenthesised text (reference ranges, method names) is skipped. The
+    first number followed by one of the lab's units wins; failing that,
+    the first standalone number, in the lab's default unit.
+    """
+    rest = PARENTHESES.sub(" ", rest)
+    candidates = []
+    for match in VALUE.finditer(rest):
+        unit_match = UNIT_PATTERN.match(rest, match.end())
+        unit = None
+        if unit_match:
+            printed = unit_match.group(1).lower().replace(" ", "")
+            unit = "mL/min" if printed.startswith("ml/min") else UNIT_NAMES.get(printed)
+        candidates.append((float(match.group(1)), unit))
+    ordered = [c for c in candidates if c[1] in units] or [(v, u) for v, u in candidates[:1] if u is None]
+    for value, unit in ordered:
+        unit = unit or next(iter(units))
+        low, high = units[unit]
+        if low <= value <= high:
+            return {"value": value, "unit": unit}
+    return None
+
+
+def _parse_labs(text: str) -> Dict[str, Dict[str, Any]]:
+    labs: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        pressure = BLOOD_PRESSURE.search(line)
+        if pressure and "blood_pressure" not in labs:
+            systolic, diastolic = int(pressure.group(1)), int(pressure.group(2))
+            if 60 <= systolic <= 260 and 30 <= diastolic <= 160 and diastolic < systolic:
+                labs["blood_pressure"] = {"value": f"{systolic}/{diastolic}", "unit": "mmHg"}
+            continue
+        for key, label, units in LAB_LABELS:
+            match = label.search(line)
+            if match:
+                if key not in labs:
+                    value = _read_value(line[match.end():], units)
+                    if value:
+                        labs[key] = value
+                break
+        else:
+            match = CHOLESTEROL_LABEL.search(line)
+            if match and "cholesterol" not in labs and not CHOLESTEROL_FRACTION.search(line):
+                value = _read_value(line[match.end():], CHOLESTEROL_UNITS)
+                if value:
+                    labs["cholesterol"] = value
+    return labs
+
+
+def _parse_medications(text: str) -> List[Dict[str, Optional[str]]]:
+    medications = []
+    for match in MEDICATIONS.finditer(text):
+        for item in _split_list(match.group(1)):
+            dose = DOSE.search(item)
+            name = (item[:dose.start()] if dose else item).strip(" -")
+            frequency = item[dose.end():].strip(" -") if dose else ""
+            if name:
+                medications.append({
+                    "name": name,
+                    "dose": dose.group(1) if dose else None,
+                    "frequency": frequency or None
+                })
+    return medications
+
+
+def parse_lab_report(text: str) -> Dict[str, Any]:
+    """
+    Extraction JSON (EXTRACTION_PROMPT's shape) read from a lab report's text
+
+    Fields the patterns can't read are null / empty.
+    """
+    age = gender = None
+    match = AGE_SEX.search(text)
+    if match:
+        age, gender = int(match.group(1) or match.group(2)), GENDERS[match.group(3).lower()]
+    if age is None:
+        match = AGE.search(text)
+        if match:
+            age = int(match.group(1) or match.group(2))
+    if gender is None:
+        match = SEX.search(text)
+        if match:
+            gender = GENDERS[match.group(1).lower()]
+    if age is not None and not 0 < age <= 120:
+        age = None
+
+    conditions: List[str] = []
+    for match in CONDITIONS.finditer(text):
+        for condition in _split_list(match.group(1)):
+            if condition.lower() not in {c.lower() for c in conditions}:
+                conditions.append(condition)
+
+    allergies: List[str] = []
+    for match in ALLERGIES.finditer(text):
+        allergies.extend(_split_list(match.group(1)))
+
+    location = LOCATION.search(text)
+    return {
+        "age": age,
+        "gender": gender,
+        "location": location.group(1).strip() if location else None,
+        "conditions": conditions,
+        "medications": _parse_medications(text),
+        "lab_values": _parse_labs(text),
+        "allergies": allergies
+    }
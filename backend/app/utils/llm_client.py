@@ -0,0 +1,307 @@
+"""
+Shared Gemini client for all agents
+
+Agents call `generate_content` instead of `model.generate_content`, so
+LLM calls never block the event loop: they go through the SDK's async API
+(or a dedicated thread pool), with a per-call timeout and a worker-wide
+cap on calls in flight. Cancelling the awaiting task (e.g. when the client
+disconnects) cancels the call.
+
+Each call's deadline adapts to the observed latency of its operation, a
+circuit breaker fails calls fast (CircuitError) while Gemini is unhealthy,
+and optionally a duplicate "hedge" request is sent once a call runs past
+the operation's p95.
+
+Every request first takes a token from the process-wide adaptive rate
+limiter (app.utils.rate_limiter). A 429 / quota error slows the limiter
+down and the call is retried after the provider's retry delay; it
+doesn't count against the circuit breaker.
+"""
+import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+from app.utils.llm_resilience import CircuitBreaker, CircuitError, LatencyTracker
+from app.utils.rate_limiter import AdaptiveRateLimiter, is_rate_limit_error, retry_delay
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+MODEL_NAME = "gemini-flash-latest"
+
+# Upper bound (seconds) on one LLM call; the adaptive deadline is usually lower
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+# Seconds a call may wait for a free slot before it's abandoned
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+# Send a duplicate request when a call passes its operation's p95
+HEDGE_REQUESTS = os.getenv("LLM_HEDGE_REQUESTS", "0") == "1"
+# Most hedges as a fraction of calls, so a provider slowdown isn't met
+# with double the load
+HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+# LLM calls in flight across all requests in this worker
+GLOBAL_LLM_CONCURRENCY = int(os.getenv("LLM_MAX_IN_FLIGHT", "10"))
+# Use the SDK's native async API; otherwise run the sync call in a thread pool
+USE_ASYNC_API = os.getenv("LLM_USE_ASYNC_API", "1") == "1"
+THREAD_POOL_SIZE = int(os.getenv("LLM_THREAD_POOL_SIZE", str(GLOBAL_LLM_CONCURRENCY)))
+# Retries of a request rejected with 429 / quota exceeded
+RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "2"))
+
+# google.generativeai takes ~1s to import and is only needed once an
+# agent actually calls the LLM, so it's imported and configured on first use
+_genai = None
+_genai_loaded = False
+
+
+def load_genai():
+    """Import and configure the Gemini SDK once; None if unavailable"""
+    global _genai, _genai_loaded
+    if _genai_loaded:
+        return _genai
+    _genai_loaded = True
+    if not GEMINI_API_KEY:
+        print(" GEMINI_API_KEY not configured - agents will use fallback logic")
+        return None
+    try:
+        import google.generativeai as genai
+    except ImportError as e:
+        print(f"❌ Failed to import google.generativeai: {e}")
+        print(" Gemini SDK not available - agents will use fallback logic")
+        return None
+    genai.configure(api_key=GEMINI_API_KEY)
+    print("✅ GEMINI_API_KEY loaded - LLM client configured")
+    _genai = genai
+    return _genai
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when no LLM is configured"""
+
+
+_models: Dict[str, Any] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore = asyncio.Semaphore(GLOBAL_LLM_CONCURRENCY)
+breaker = CircuitBreaker()
+limiter = AdaptiveRateLimiter()
+_latency: Dict[tuple, LatencyTracker] = {}
+_hedges = {"calls": 0, "fired": 0, "won": 0}
+
+
+def _tracker(model_name: str, operation: str) -> LatencyTracker:
+    key = (model_name, operation)
+    if key not in _latency:
+        _latency[key] = LatencyTracker()
+    return _latency[key]
+
+
+def get_model(model_name: str = MODEL_NAME):
+    """Return a cached GenerativeModel, or None if Gemini isn't configured"""
+    genai = load_genai()
+    if genai is None:
+        return None
+    if model_name not in _models:
+        try:
+            _models[model_name] = genai.GenerativeModel(model_name)
+        except Exception as e:
+            print(f" Failed to initialize Gemini model {model_name}: {type(e).__name__}: {e}")
+            return None
+    return _models[model_name]
+
+
+def is_available(model_name: str = MODEL_NAME) -> bool:
+    """True if LLM calls can be made (configured, and the breaker isn't open)"""
+    return get_model(model_name) is not None and breaker.allows_requests()
+
+
+def unavailable_reason() -> str:
+    """Why is_available() is False, for error messages"""
+    if get_model() is None:
+        return "Gemini API not configured. Please set GEMINI_API_KEY."
+    return "Gemini temporarily unavailable (circuit breaker open)."
+
+
+def warm_up() -> bool:
+    """
+    Load the SDK and build the default model ahead of the first request
+
+    Makes no API call, so it costs no quota. Returns True if configured.
+    """
+    return get_model() is not None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=THREAD_POOL_SIZE,
+            thread_name_prefix="llm"
+        )
+    return _executor
+
+
+def response_text(response) -> str:
+    """Text of the first candidate of a Gemini response"""
+    try:
+        return response.text
+    except Exception:
+        return response.candidates[0].content.parts[0].text
+
+
+async def _invoke(model, contents, generation_config):
+    if USE_ASYNC_API and hasattr(model, "generate_content_async"):
+        return await model.generate_content_async(
+            contents,
+            generation_config=generation_config
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(),
+        functools.partial(
+            model.generate_content,
+            contents,
+            generation_config=generation_config
+        )
+    )
+
+
+async def _attempt(model, contents, generation_config, deadline: float, tracker: LatencyTracker) -> str:
+    """
+    One request: waits for a rate limiter token and a slot, then for at
+    most `deadline` seconds; rate-limited requests are retried
+    """
+    for retry in range(RATE_LIMIT_RETRIES + 1):
+        await limiter.acquire()
+        async with _semaphore:
+            breaker.before_call()
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    _invoke(model, contents, generation_config),
+                    deadline
+                )
+                text = response_text(response)
+            except asyncio.CancelledError:
+                breaker.record_abandoned()
+                raise
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    breaker.record_failure()
+                    raise
+                # Quota, not health: back off instead of tripping the breaker
+                breaker.record_abandoned()
+                limiter.on_rate_limited(retry_delay(e))
+                if retry == RATE_LIMIT_RETRIES:
+                    raise
+                print(f"⏳ LLM rate limited - retry {retry + 1}/{RATE_LIMIT_RETRIES}, limiter at {limiter.rate:.2f} req/s")
+                continue
+            tracker.record(time.monotonic() - start)
+            breaker.record_success()
+            limiter.on_success()
+            return text
+
+
+async def _hedged(make_attempt, hedge_delay: float) -> str:
+    """
+    Run an attempt; if it's still going after hedge_delay, start a second
+    one and return whichever succeeds first (the other is cancelled)
+    """
+    primary = asyncio.ensure_future(make_attempt())
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done and _hedges["fired"] < HEDGE_MAX_RATIO * _hedges["calls"]:
+            _hedges["fired"] += 1
+            tasks.add(asyncio.ensure_future(make_attempt()))
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _hedges["won"] += 1
+                    return task.result()
+            if not tasks:
+                # Both failed: surface the primary's error
+                return primary.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_content(
+    contents,
+    temperature: float = 0.1,
+    max_output_tokens: int = 2048,
+    timeout: Optional[float] = None,
+    model_name: str = MODEL_NAME,
+    operation: str = "default"
+) -> str:
+    """
+    Generate content without blocking the event loop
+    
+    Args:
+        contents: Prompt string, or list of prompt parts (text, images)
+        temperature: Sampling temperature
+        max_output_tokens: Output token limit
+        timeout: Per-request deadline in seconds; None adapts it to the
+                 operation's observed latency (capped at LLM_TIMEOUT_SECONDS)
+        model_name: Gemini model to use
+        operation: Label for latency tracking ("eligibility", "extraction_text", ...)
+    
+    Returns:
+        Response text
+    
+    Raises:
+        LLMUnavailableError: Gemini is not configured
+        CircuitError: The circuit breaker is open
+        asyncio.TimeoutError: The call ran past its deadline
+        Exception: The provider's rate-limit error, if it persisted
+                   through LLM_RATE_LIMIT_RETRIES retries
+    """
+    model = get_model(model_name)
+    if model is None:
+        raise LLMUnavailableError("Gemini API not configured. Please set GEMINI_API_KEY.")
+    if not breaker.allows_requests():
+        breaker.counters["rejected"] += 1
+        raise CircuitError("LLM circuit breaker is open - provider unhealthy")
+    
+    generation_config = load_genai().GenerationConfig(
+        temperature=temperature,
+        max_output_tokens=max_output_tokens
+    )
+    tracker = _tracker(model_name, operation)
+    deadline = timeout if timeout is not None else tracker.deadline(DEFAULT_TIMEOUT)
+    
+    def make_attempt():
+        return _attempt(model, contents, generation_config, deadline, tracker)
+    
+    if HEDGE_REQUESTS and tracker.ready:
+        _hedges["calls"] += 1
+        call = _hedged(make_attempt, tracker.percentile(95))
+    else:
+        call = make_attempt()
+    return await asyncio.wait_for(call, deadline + QUEUE_TIMEOUT)
+
+
+def get_health() -> Dict[str, Any]:
+    """Breaker state, rate limiter, latency percentiles / deadlines and hedging counts"""
+    return {
+        "available": get_model() is not None,
+        "circuit_breaker": breaker.stats(),
+        "rate_limiter": limiter.stats(),
+        "latency": {
+            f"{model_name}:{operation}": tracker.stats(DEFAULT_TIMEOUT)
+            for (model_name, operation), tracker in _latency.items()
+        },
+        "hedging": {"enabled": HEDGE_REQUESTS, **_hedges}
+    }
+
+
+async def shutdown():
+    """Release the thread pool - call on app shutdown"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,147 @@
+"""
+Resilience primitives for LLM calls
+
+- LatencyTracker: rolling latencies per (model, operation); derives the
+  per-call deadline from p99 and the hedge delay from p95
+- CircuitBreaker: opens after consecutive failures so callers go
+  straight to their fallback logic instead of waiting on a sick
+  provider; one probe call is let through after a cool-down
+
+Both are used by app.utils.llm_client; their state is reported on
+/health via llm_client.get_health().
+"""
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+# Latencies kept per operation
+LATENCY_WINDOW = 200
+# Samples needed before deadlines / hedging adapt
+MIN_LATENCY_SAMPLES = 20
+# Deadline = p99 x factor, within [min, LLM_TIMEOUT_SECONDS]
+DEADLINE_FACTOR = float(os.getenv("LLM_DEADLINE_FACTOR", "2.0"))
+MIN_DEADLINE = float(os.getenv("LLM_MIN_DEADLINE_SECONDS", "5"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    @property
+    def ready(self) -> bool:
+        return len(self.samples) >= MIN_LATENCY_SAMPLES
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def deadline(self, ceiling: float) -> float:
+        """Per-call deadline: p99 x DEADLINE_FACTOR once enough samples exist"""
+        if not self.ready:
+            return ceiling
+        return min(ceiling, max(MIN_DEADLINE, self.percentile(99) * DEADLINE_FACTOR))
+
+    def stats(self, ceiling: float) -> Dict[str, Any]:
+        return {
+            "samples": len(self.samples),
+            "p50": _round(self.percentile(50)),
+            "p95": _round(self.percentile(95)),
+            "p99": _round(self.percentile(99)),
+            "deadline": round(self.deadline(ceiling), 3)
+        }
+
+
+class CircuitError(RuntimeError):
+    """Raised instead of calling the LLM while the breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures.
+    Open -> half-open after `reset_seconds`; the next call is a probe
+    and closes the breaker on success or re-opens it on failure.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.counters = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.reset_seconds
+
+    def allows_requests(self) -> bool:
+        """Would a call be let through right now (without reserving the probe)"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._cooled_down()
+        return not self.probe_in_flight
+
+    def before_call(self):
+        """Reserve a call slot, or raise CircuitError"""
+        if self.state == OPEN and self._cooled_down():
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return
+        self.counters["rejected"] += 1
+        raise CircuitError("LLM circuit breaker is open - provider unhealthy")
+
+    def record_success(self):
+        self.counters["successes"] += 1
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.counters["opened"] += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """A call that was cancelled (hedge loser, client gone) says nothing about health"""
+        self.probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state if not (self.state == OPEN and self._cooled_down()) else HALF_OPEN,
+            "consecutive_failures": self.consecutive_failures,
+            **self.counters
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
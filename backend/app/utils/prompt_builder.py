@@ -0,0 +1,210 @@
+"""
+Token-budgeted prompt building for the LLM agents
+
+- compact_patient: only the patient facts that bear on eligibility,
+  with empty fields dropped, as compact JSON
+- compact_criteria: criteria with consent / compliance boilerplate
+  removed; when over budget, the items least relevant to the patient
+  are dropped first
+- select_passages: the lines of a medical document most likely to hold
+  the fields Agent 1 extracts, within budget
+
+Token counts are estimates (~4 characters per token). Every built
+prompt records how many tokens it saved versus the uncompacted prompt;
+totals are reported by get_prompt_stats().
+"""
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from app.utils.criteria_compiler import (
+    INCLUSION,
+    LAB_PATTERNS,
+    canonical_lab_name,
+    compile_item,
+    condition_tokens,
+    split_sections
+)
+
+# Criteria items that never change an eligibility verdict
+BOILERPLATE = re.compile(
+    r"informed consent|willing(?:ness)?\s+(?:and able\s+)?to\s+(?:comply|participate|attend|sign)"
+    r"|able to (?:comply|understand|read|communicate|attend)|comply with (?:the )?(?:study|protocol)"
+    r"|in the (?:opinion|judg(?:e)?ment) of the (?:investigator|physician)"
+    r"|study (?:visits|procedures|schedule)|follow-up visits",
+    re.I
+)
+
+# Document lines likely to hold extractable patient facts
+DOCUMENT_HINTS = re.compile(
+    r"\bage\b|\byrs?\b|years?\s+old|\bsex\b|\bgender\b|\bmale\b|\bfemale\b|\bd\.?o\.?b\b|date of birth"
+    r"|diagnos|impression|assessment|history|complain|condition|problem"
+    r"|medication|\brx\b|\btab\b|\bcap\b|\bmg\b|\bmcg\b|\bunits?\b|\bod\b|\bbd\b|\btds\b|daily"
+    r"|allerg|address|city|\bresiden"
+    r"|mg/dl|mmol|mmhg|%|\bbp\b|blood pressure|cholesterol|glucose|creatinine|egfr|bmi",
+    re.I
+)
+# Lines kept regardless of score: headers usually carry name / age / sex
+DOCUMENT_HEADER_LINES = 8
+
+_stats = {"prompts": 0, "original_tokens": 0, "prompt_tokens": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def record_savings(original_tokens: int, prompt_tokens: int) -> Dict[str, int]:
+    """Add one built prompt to the running totals"""
+    _stats["prompts"] += 1
+    _stats["original_tokens"] += original_tokens
+    _stats["prompt_tokens"] += prompt_tokens
+    return {
+        "original_tokens": original_tokens,
+        "prompt_tokens": prompt_tokens,
+        "saved_tokens": max(0, original_tokens - prompt_tokens)
+    }
+
+
+def get_prompt_stats() -> Dict[str, Any]:
+    saved = max(0, _stats["original_tokens"] - _stats["prompt_tokens"])
+    return {
+        **_stats,
+        "saved_tokens": saved,
+        "saved_ratio": round(saved / _stats["original_tokens"], 3) if _stats["original_tokens"] else 0.0
+    }
+
+
+def compact_patient(patient: Dict) -> str:
+    """Minimal JSON of the patient facts used for eligibility"""
+    medications = []
+    for med in patient.get("medications") or []:
+        if isinstance(med, dict):
+            entry = {k: med[k] for k in ("name", "dose", "duration_months") if med.get(k)}
+            if entry:
+                medications.append(entry)
+        elif med:
+            medications.append({"name": str(med)})
+
+    lab_values = {}
+    for name, lab in (patient.get("lab_values") or {}).items():
+        if isinstance(lab, dict):
+            lab_values[name] = " ".join(str(lab[k]) for k in ("value", "unit") if lab.get(k) is not None)
+        elif lab is not None:
+            lab_values[name] = str(lab)
+
+    facts = {
+        "age": patient.get("age"),
+        "gender": patient.get("gender"),
+        "conditions": patient.get("conditions"),
+        "medications": medications,
+        "lab_values": lab_values,
+        "allergies": patient.get("allergies")
+    }
+    return json.dumps({k: v for k, v in facts.items() if v}, separators=(",", ":"), default=str)
+
+
+def _patient_terms(patient: Dict) -> Tuple[set, set]:
+    """Word tokens of the patient's conditions / drugs / allergies, and their lab names"""
+    tokens = set()
+    for condition in patient.get("conditions") or []:
+        tokens |= condition_tokens(condition)
+    for med in patient.get("medications") or []:
+        tokens |= condition_tokens(med.get("name", "") if isinstance(med, dict) else med)
+    for allergy in patient.get("allergies") or []:
+        tokens |= condition_tokens(allergy)
+    labs = {canonical_lab_name(name) for name in patient.get("lab_values") or {}}
+    labs.discard(None)
+    return tokens, labs
+
+
+def _item_priority(section: str, text: str, patient_tokens: set, patient_labs: set) -> int:
+    """3: mentions the patient's facts; 2: structured or inclusion; 1: other exclusions"""
+    if condition_tokens(text) & patient_tokens:
+        return 3
+    if any(LAB_PATTERNS[lab].search(text) for lab in patient_labs):
+        return 3
+    if section == INCLUSION or compile_item(section, text)["type"] != "text":
+        return 2
+    return 1
+
+
+def compact_criteria(criteria: str, patient: Dict, token_budget: int) -> Tuple[str, int]:
+    """
+    Criteria text without boilerplate, within token_budget
+
+    Items are kept in their original order. When over budget, exclusion
+    items unrelated to the patient go first, then inclusion items
+    unrelated to the patient; items mentioning the patient's conditions,
+    drugs or labs are dropped last.
+
+    Returns:
+        (compacted criteria, number of items omitted for budget)
+    """
+    items = [(section, text) for section, text in split_sections(criteria) if not BOILERPLATE.search(text)]
+    patient_tokens, patient_labs = _patient_terms(patient)
+    priorities = [_item_priority(section, text, patient_tokens, patient_labs) for section, text in items]
+    # A single item longer than the whole budget is cut down to it
+    items = [(section, text[:token_budget * 4]) for section, text in items]
+    costs = [estimate_tokens(text) + 1 for _, text in items]
+
+    keep = [True] * len(items)
+    total = sum(costs) + 10
+    # Lowest priority first; within a priority, drop from the end
+    for index in sorted(range(len(items)), key=lambda i: (priorities[i], -i)):
+        if total <= token_budget:
+            break
+        keep[index] = False
+        total -= costs[index]
+
+    lines = []
+    section = None
+    for (item_section, text), kept in zip(items, keep):
+        if not kept:
+            continue
+        if item_section != section:
+            section = item_section
+            lines.append(f"{section.capitalize()}:")
+        lines.append(f"- {text}")
+    omitted = keep.count(False)
+    if omitted:
+        lines.append(f"({omitted} less relevant criteria omitted)")
+    return "\n".join(lines), omitted
+
+
+def select_passages(text: str, token_budget: int) -> str:
+    """
+    The lines of a document most likely to hold patient facts, in order
+
+    Header lines are always kept; other lines are ranked by how many
+    DOCUMENT_HINTS they contain (and whether they carry numbers), and a
+    hit also keeps the following line, which often holds the value.
+    """
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if estimate_tokens("\n".join(lines)) <= token_budget:
+        return "\n".join(lines)
+
+    scores = []
+    for i, line in enumerate(lines):
+        hits = len(DOCUMENT_HINTS.findall(line))
+        score = hits * 2 + (1 if hits and re.search(r"\d", line) else 0)
+        if i < DOCUMENT_HEADER_LINES:
+            score += 100
+        scores.append(score)
+    # Labels on one line, values on the next
+    for i in range(len(lines) - 1):
+        if scores[i] >= 2 and scores[i + 1] == 0:
+            scores[i + 1] = 1
+
+    keep = set()
+    used = 0
+    for i in sorted(range(len(lines)), key=lambda i: (-scores[i], i)):
+        if scores[i] <= 0:
+            break
+        cost = estimate_tokens(lines[i]) + 1
+        if used + cost > token_budget:
+            continue
+        keep.add(i)
+        used += cost
+    return "\n".join(lines[i] for i in sorted(keep))
@@ -0,0 +1,179 @@
+"""
+Process-wide adaptive rate limiter for LLM calls
+
+A token bucket whose rate adapts AIMD-style: every rate-limit (429 /
+quota) error halves the rate and pauses the bucket (for the provider's
+retry delay when it gives one); every success adds a little back, up to
+the configured maximum.
+
+Waiting calls are served from two lanes. Interactive calls (a user is
+waiting on the response) always get the next token before batch calls.
+The lane comes from the `llm_priority` context variable, so a route
+sets it once and every LLM call made on its behalf inherits it:
+
+    with llm_priority_lane(INTERACTIVE):
+        ...
+"""
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Requests per second: starting point, bounds, and burst size
+INITIAL_RATE = float(os.getenv("LLM_RATE_PER_SECOND", "5"))
+MIN_RATE = float(os.getenv("LLM_MIN_RATE_PER_SECOND", "0.2"))
+MAX_RATE = float(os.getenv("LLM_MAX_RATE_PER_SECOND", "20"))
+BURST = float(os.getenv("LLM_RATE_BURST", "5"))
+# AIMD: rate x DECREASE on a 429, + INCREASE per success
+DECREASE_FACTOR = 0.5
+INCREASE_PER_SUCCESS = float(os.getenv("LLM_RATE_INCREASE", "0.05"))
+
+llm_priority: ContextVar[str] = ContextVar("llm_priority", default=BATCH)
+
+
+@contextmanager
+def llm_priority_lane(lane: str):
+    """Run the enclosed LLM calls (and tasks started inside) in `lane`"""
+    token = llm_priority.set(lane)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+RATE_LIMIT_PATTERN = re.compile(r"\b429\b|quota|rate.?limit|resource.?exhausted|too many requests", re.I)
+RETRY_DELAY_PATTERNS = [
+    re.compile(r"retry in ([\d.]+)\s*s", re.I),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.I),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.I),
+]
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """429 / quota errors, whatever exception type the SDK wraps them in"""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return bool(RATE_LIMIT_PATTERN.search(str(error)))
+
+
+def retry_delay(error: BaseException) -> Optional[float]:
+    """The provider's suggested retry delay, if the error carries one"""
+    text = str(error)
+    for pattern in RETRY_DELAY_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with AIMD rate adaptation and two priority lanes"""
+
+    def __init__(
+        self,
+        rate: float = INITIAL_RATE,
+        burst: float = BURST,
+        min_rate: float = MIN_RATE,
+        max_rate: float = MAX_RATE,
+        increase: float = INCREASE_PER_SUCCESS,
+        decrease: float = DECREASE_FACTOR
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {INTERACTIVE: deque(), BATCH: deque()}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.counters = {"granted": 0, "rate_limited": 0, INTERACTIVE: 0, BATCH: 0}
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for lane in (INTERACTIVE, BATCH):
+            waiters = self._waiters[lane]
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    self.counters[lane] += 1
+                    return future
+        return None
+
+    def _has_waiters(self) -> bool:
+        return any(not f.done() for lane in self._waiters.values() for f in lane)
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        if now >= self.paused_until:
+            while self.tokens >= 1:
+                future = self._next_waiter()
+                if future is None:
+                    break
+                self.tokens -= 1
+                self.counters["granted"] += 1
+                future.set_result(None)
+        if self._has_waiters():
+            wait = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.001)
+            self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+
+    async def acquire(self, lane: Optional[str] = None):
+        """Wait for a token; interactive waiters are served first"""
+        lane = lane or llm_priority.get()
+        loop = asyncio.get_running_loop()
+        if self._timer_loop is not loop:
+            # Left over from a loop that has since closed (tests, scripts)
+            self._timer = None
+            for waiters in self._waiters.values():
+                waiters.clear()
+            self._timer_loop = loop
+        future = loop.create_future()
+        self._waiters[lane if lane in self._waiters else BATCH].append(future)
+        if self._timer is None:
+            self._dispatch()
+        await future
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, delay: Optional[float] = None):
+        """
+        Back off: cut the rate, empty the bucket, pause for `delay` (or one
+        interval). 429s for requests sent before the pause began are the
+        same overload, so the rate is cut once per pause, not per error.
+        """
+        self.counters["rate_limited"] += 1
+        now = time.monotonic()
+        if now >= self.paused_until:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.tokens = 0.0
+        self.updated = now
+        self.paused_until = max(self.paused_until, now + (delay if delay is not None else 1 / self.rate))
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._has_waiters():
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "waiting": {lane: sum(not f.done() for f in w) for lane, w in self._waiters.items()},
+            **self.counters
+        }
@@ -0,0 +1,291 @@
+"""
+Columnar trial block for vectorized eligibility screening
+
+Holds the fields fallback_eligibility_check looks at for many trials as
+NumPy arrays, so one patient can be screened against thousands of
+trials in a single pass:
+
+- min_age / max_age     float arrays in months, NaN where the trial sets no bound
+- age_unreadable        bool array, True where a bound isn't in a form parse_age_limit reads
+- sex                   int codes (SEX_ALL / SEX_MALE / SEX_FEMALE / SEX_OTHER)
+- conditions            CSR layout: trial -> condition rows -> token ids
+
+Conditions sharing no words with the patient's may be synonyms ("T2DM",
+"Diabetes Mellitus, Type 2"): they are unknown, never a FAIL.
+
+screen() reproduces the per-trial rules exactly (age limits read by
+database.parse_age_limit, so "6 Months" is 6 months, not 6 years); only
+the result dicts are built per trial, and only for the trials asked for.
+"""
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.utils.criteria_compiler import condition_tokens
+from app.utils.database import parse_age_limit
+
+SEX_ALL = 0
+SEX_MALE = 1
+SEX_FEMALE = 2
+# Any other value: never matches a patient's gender
+SEX_OTHER = 3
+SEX_CODES = {"ALL": SEX_ALL, "MALE": SEX_MALE, "FEMALE": SEX_FEMALE}
+
+# Per-check outcome codes
+CHECK_NONE = 0
+CHECK_PASS = 1
+CHECK_FAIL = 2
+CHECK_MISSING = 3
+# Age FAIL / MISSING detail
+AGE_BELOW = 1
+AGE_ABOVE = 2
+AGE_UNREADABLE = 3
+
+
+def _age_months(value: Any) -> float:
+    """parse_age_limit's months as a float: NaN where there is no readable limit"""
+    months, _ = parse_age_limit(value)
+    return np.nan if months is None else float(months)
+
+
+@dataclass
+class ScreenResult:
+    """Vectorized outcome of screening one patient against a TrialBlock"""
+    age: np.ndarray
+    age_detail: np.ndarray
+    sex: np.ndarray
+    condition: np.ndarray
+    # Conditions sharing no words with the patient's: CHECK_NONE, left to the LLM
+    condition_unknown: np.ndarray
+    status: np.ndarray
+    confidence: np.ndarray
+
+    @property
+    def demographics_failed(self) -> np.ndarray:
+        """Definite age / sex failures (condition names can be synonyms)"""
+        return (self.age == CHECK_FAIL) | (self.sex == CHECK_FAIL)
+
+
+class TrialBlock:
+    """Column arrays for a fixed list of trials (built once, screened many times)"""
+
+    def __init__(self, trials: List[Dict]):
+        self.trials = trials
+        n = len(trials)
+        self.min_age_labels = [t.get("minimum_age") for t in trials]
+        self.max_age_labels = [t.get("maximum_age") for t in trials]
+        self.min_age = np.array([_age_months(label) for label in self.min_age_labels], dtype=np.float64)
+        self.max_age = np.array([_age_months(label) for label in self.max_age_labels], dtype=np.float64)
+        self.age_unreadable = np.array([
+            not (parse_age_limit(low)[1] and parse_age_limit(high)[1])
+            for low, high in zip(self.min_age_labels, self.max_age_labels)
+        ], dtype=bool)
+        self.gender_labels = [str(t.get("gender", "ALL")).upper() for t in trials]
+        self.sex = np.array([SEX_CODES.get(g, SEX_OTHER) for g in self.gender_labels], dtype=np.int8)
+
+        # CSR: condition rows per trial, token ids per condition row
+        vocabulary: Dict[str, int] = {}
+        row_trial = []
+        token_ids = []
+        token_row = []
+        for i, trial in enumerate(trials):
+            for condition in trial.get("conditions") or []:
+                row = len(row_trial)
+                row_trial.append(i)
+                for token in condition_tokens(condition):
+                    token_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                    token_row.append(row)
+        self.vocabulary = vocabulary
+        self.row_trial = np.array(row_trial, dtype=np.int64)
+        self.token_ids = np.array(token_ids, dtype=np.int64)
+        self.token_row = np.array(token_row, dtype=np.int64)
+        self.condition_count = np.bincount(self.row_trial, minlength=n) if n else np.zeros(0, dtype=np.int64)
+        is_number = np.zeros(len(vocabulary), dtype=bool)
+        for token, token_id in vocabulary.items():
+            is_number[token_id] = token.isdigit()
+        self.token_is_number = is_number
+        self.row_has_number = np.bincount(
+            self.token_row, weights=is_number[self.token_ids], minlength=len(row_trial)
+        ) > 0 if len(row_trial) else np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.trials)
+
+    def _condition_match(self, patient_conditions: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per trial: (does any patient condition share words with any trial
+        condition without conflicting numbers (term_relation != "none"),
+        does any share words at all)
+        """
+        n_rows = len(self.row_trial)
+        row_match = np.zeros(n_rows, dtype=bool)
+        row_related = np.zeros(n_rows, dtype=bool)
+        for condition in patient_conditions:
+            tokens = condition_tokens(condition)
+            ids = np.array([self.vocabulary[t] for t in tokens if t in self.vocabulary], dtype=np.int64)
+            if not len(ids):
+                continue
+            hit = np.isin(self.token_ids, ids)
+            overlap = np.bincount(self.token_row, weights=hit, minlength=n_rows) > 0
+            row_related |= overlap
+            if any(t.isdigit() for t in tokens):
+                number_hit = hit & self.token_is_number[self.token_ids]
+                shared_number = np.bincount(self.token_row, weights=number_hit, minlength=n_rows) > 0
+                overlap &= ~self.row_has_number | shared_number
+            row_match |= overlap
+        return (
+            np.bincount(self.row_trial, weights=row_match, minlength=len(self)) > 0,
+            np.bincount(self.row_trial, weights=row_related, minlength=len(self)) > 0
+        )
+
+    def screen(self, patient: Dict) -> ScreenResult:
+        """Apply the fallback age / gender / condition rules to every trial at once"""
+        n = len(self)
+        has_min = ~np.isnan(self.min_age)
+        has_max = ~np.isnan(self.max_age)
+        has_age_rule = has_min | has_max | self.age_unreadable
+
+        age = np.full(n, CHECK_NONE, dtype=np.int8)
+        age_detail = np.zeros(n, dtype=np.int8)
+        patient_age = patient.get("age")
+        if patient_age is None:
+            age[has_age_rule] = CHECK_MISSING
+        else:
+            patient_months = patient_age * 12
+            with np.errstate(invalid="ignore"):
+                below = has_min & (patient_months < self.min_age)
+                above = has_max & (patient_months > self.max_age) & ~below
+            unreadable = self.age_unreadable & ~(below | above)
+            age[has_age_rule] = CHECK_PASS
+            age[below | above] = CHECK_FAIL
+            age[unreadable] = CHECK_MISSING
+            age_detail[below] = AGE_BELOW
+            age_detail[above] = AGE_ABOVE
+            age_detail[unreadable] = AGE_UNREADABLE
+
+        sex = np.full(n, CHECK_NONE, dtype=np.int8)
+        has_sex_rule = self.sex != SEX_ALL
+        patient_gender = str(patient.get("gender", "")).lower()
+        if not patient_gender:
+            sex[has_sex_rule] = CHECK_MISSING
+        else:
+            code = {"male": SEX_MALE, "female": SEX_FEMALE}.get(patient_gender, -1)
+            sex[has_sex_rule] = np.where(self.sex[has_sex_rule] == code, CHECK_PASS, CHECK_FAIL)
+
+        condition = np.full(n, CHECK_NONE, dtype=np.int8)
+        condition_unknown = np.zeros(n, dtype=bool)
+        has_conditions = self.condition_count > 0
+        patient_conditions = patient.get("conditions", [])
+        if not patient_conditions:
+            condition[has_conditions] = CHECK_MISSING
+        else:
+            match, related = self._condition_match(patient_conditions)
+            condition[has_conditions & match] = CHECK_PASS
+            condition[has_conditions & related & ~match] = CHECK_FAIL
+            condition_unknown = has_conditions & ~related
+
+        checks = np.stack([age, sex, condition])
+        failed = (checks == CHECK_FAIL).any(axis=0)
+        missing = (checks == CHECK_MISSING).any(axis=0) | condition_unknown
+        evaluated = ((checks == CHECK_PASS) | (checks == CHECK_FAIL)).any(axis=0)
+
+        status = np.select(
+            [failed, missing, evaluated],
+            ["NOT_ELIGIBLE", "POSSIBLY_ELIGIBLE", "ELIGIBLE"],
+            default="POSSIBLY_ELIGIBLE"
+        )
+        confidence = np.select([failed, missing, evaluated], [0.85, 0.6, 0.75], default=0.5)
+        return ScreenResult(age, age_detail, sex, condition, condition_unknown, status, confidence)
+
+    def result_dict(self, patient: Dict, screen: ScreenResult, i: int) -> Dict[str, Any]:
+        """The fallback_eligibility_check dict for trial i"""
+        trial = self.trials[i]
+        inclusion_results = []
+        missing_data = []
+
+        min_label, max_label = self.min_age_labels[i], self.max_age_labels[i]
+        patient_age = patient.get("age")
+        if screen.age[i] == CHECK_FAIL and screen.age_detail[i] == AGE_BELOW:
+            inclusion_results.append({
+                "criterion": f"Minimum age {min_label}",
+                "patient_value": str(patient_age),
+                "status": "FAIL",
+                "reasoning": "Below minimum age"
+            })
+        elif screen.age[i] == CHECK_FAIL:
+            inclusion_results.append({
+                "criterion": f"Maximum age {max_label}",
+                "patient_value": str(patient_age),
+                "status": "FAIL",
+                "reasoning": "Above maximum age"
+            })
+        elif screen.age[i] == CHECK_PASS:
+            inclusion_results.append({
+                "criterion": f"Age {min_label if not np.isnan(self.min_age[i]) else 0} - {max_label if not np.isnan(self.max_age[i]) else 'N/A'}",
+                "patient_value": str(patient_age),
+                "status": "PASS",
+                "reasoning": "Age within allowed range"
+            })
+        elif screen.age[i] == CHECK_MISSING and screen.age_detail[i] == AGE_UNREADABLE:
+            missing_data.append({
+                "field": "age",
+                "reason": f"Age limit not understood: {min_label if not parse_age_limit(min_label)[1] else max_label}",
+                "impact": "CRITICAL"
+            })
+        elif screen.age[i] == CHECK_MISSING:
+            missing_data.append({
+                "field": "age",
+                "reason": "Age required for eligibility",
+                "impact": "CRITICAL"
+            })
+
+        if screen.sex[i] in (CHECK_PASS, CHECK_FAIL):
+            inclusion_results.append({
+                "criterion": f"Gender: {self.gender_labels[i]}",
+                "patient_value": str(patient.get("gender", "")).lower(),
+                "status": "PASS" if screen.sex[i] == CHECK_PASS else "FAIL",
+                "reasoning": "Gender eligibility check"
+            })
+        elif screen.sex[i] == CHECK_MISSING:
+            missing_data.append({
+                "field": "gender",
+                "reason": "Gender required for eligibility",
+                "impact": "CRITICAL"
+            })
+
+        trial_conditions = trial.get("conditions", [])
+        if screen.condition[i] in (CHECK_PASS, CHECK_FAIL):
+            inclusion_results.append({
+                "criterion": f"Condition: {', '.join(trial_conditions)}",
+                "patient_value": ", ".join(patient.get("conditions", [])),
+                "status": "PASS" if screen.condition[i] == CHECK_PASS else "FAIL",
+                "reasoning": "Condition match check"
+            })
+        elif screen.condition[i] == CHECK_MISSING:
+            missing_data.append({
+                "field": "conditions",
+                "reason": "Medical conditions missing",
+                "impact": "CRITICAL"
+            })
+        elif screen.condition_unknown[i]:
+            missing_data.append({
+                "field": "conditions",
+                "reason": f"No shared words with trial conditions: {', '.join(trial_conditions)}",
+                "impact": "CRITICAL"
+            })
+
+        return {
+            "status": str(screen.status[i]),
+            "confidence": float(screen.confidence[i]),
+            "inclusion_criteria": inclusion_results,
+            "exclusion_criteria": [],
+            "missing_data": missing_data,
+            "Final outcome": "Eligibility determined using fallback rule-based logic.",
+            "decided_by": "fallback"
+        }
+
+    def result_dicts(self, patient: Dict, screen: Optional[ScreenResult] = None, indexes=None) -> List[Dict[str, Any]]:
+        screen = screen if screen is not None else self.screen(patient)
+        indexes = range(len(self)) if indexes is None else indexes
+        return [self.result_dict(patient, screen, i) for i in indexes]
@@ -0,0 +1,78 @@
+"""
+Shared test helpers
+
+The test_*.py files run as scripts (python test_rate_limiter.py) or
+under pytest, and import these directly. FakeModel stands in for a
+Gemini model, so no test needs an API key or the network;
+temp_database() gives database tests a throwaway SQLite file.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import types
+from app.utils import database, llm_client
+class FakeModel:
+    """
+    A Gemini GenerativeModel that answers every request with `reply`
+
+    reply is a dict (sent as JSON), a string, or a function of the
+    request's contents returning either. Subclasses override
+    generate_content_async for scheduled / per-request behaviour.
+    """
+    def __init__(self, reply=None):
+        self.reply = reply if reply is not None else {}
+        self.calls = 0
+    async def generate_content_async(self, contents, generation_config=None):
+        self.calls += 1
+        reply = self.reply(contents) if callable(self.reply) else self.reply
+        return types.SimpleNamespace(text=reply if isinstance(reply, str) else json.dumps(reply))
+@contextlib.contextmanager
+def patched(target, **values):
+    """Set attributes of a module / object for the duration of the block"""
+    saved = {name: getattr(target, name) for name in values}
+    for name, value in values.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(target, name, value)
+def fake_gemini(model):
+    """llm_client talks to model instead of Gemini for the duration of the block"""
+    return patched(
+        llm_client,
+        load_genai=lambda: types.SimpleNamespace(GenerationConfig=lambda **kwargs: kwargs),
+        get_model=lambda *args: model
+    )
+def make_trial(nct_id, conditions, **fields):
+    """A recruiting trial dict as the downloader stores it"""
+    trial = {
+        "nct_id": nct_id,
+        "title": f"Study {nct_id}",
+        "brief_summary": "",
+        "status": "RECRUITING",
+        "conditions": conditions,
+        "minimum_age": "18 Years",
+        "maximum_age": "N/A",
+        "gender": "ALL",
+        "locations": []
+    }
+    trial.update(fields)
+    return trial
+@contextlib.contextmanager
+def temp_database(trials=()):
+    """database.DATABASE_PATH pointed at a new, initialized SQLite file holding trials"""
+    path = os.path.join(tempfile.mkdtemp(), "trials.db")
+    with patched(database, DATABASE_PATH=path):
+        asyncio.run(database.init_db())
+        if trials:
+            asyncio.run(database.insert_trials_many(trials, defer_indexes=False))
+        yield path
+def run_tests(namespace, done):
+    """Script runner: call a test module's test_* functions in order"""
+    for name, test in list(namespace.items()):
+        if name.startswith("test_") and getattr(test, "__module__", None) == namespace["__name__"]:
+            test()
+    print(f"✅ {done}")
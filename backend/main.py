@@ -2,6 +2,7 @@
 Three-Musketeers Backend API
 Agents 1 & 2: Patient Profile Extraction and Trial Matching
 """
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import (
@@ -11,7 +12,13 @@ from app.routes import (
     upload_and_match_router,
     complete_workflow_router
 )
-from app.utils.database import init_db
+from app.utils.database import init_db, init_pool, close_pool
+from app.utils import llm_client, document_parser, gazetteer
+from app.utils.cache import close_cache_db, get_cache_stats
+from app.utils.prompt_builder import get_prompt_stats
+# Load agents, document parsers and the Gemini model during startup
+# instead of on the first request. Never calls the LLM.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "0") == "1"
 # Create FastAPI app
 app = FastAPI(
     title="Three-Musketeers Clinical Trials API",
@@ -35,9 +42,21 @@ app.include_router(complete_workflow_router)  # NEW LINE
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup"""
+    """Initialize database and connection pool on startup"""
     await init_db()
+    await init_pool()
+    if WARMUP_ON_STARTUP:
+        from app.agents import warm_up
+        llm_ready = warm_up()
+        print(f"✅ Agents warmed up (LLM {'available' if llm_ready else 'unavailable'})")
     print("✅ Server started - Database initialized")
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled database connections, the LLM thread pool and the document workers"""
+    await close_pool()
+    await close_cache_db()
+    await llm_client.shutdown()
+    document_parser.shutdown()
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -59,7 +78,12 @@ async def health_check():
     return {
         "status": "healthy",
         "database": "connected",
-        "trials_in_database": trial_count
+        "trials_in_database": trial_count,
+        "llm": llm_client.get_health(),
+        "caches": get_cache_stats(),
+        "prompt_tokens": get_prompt_stats(),
+        "image_bytes": document_parser.get_image_stats(),
+        "gazetteer": gazetteer.get_stats()
     }
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,118 @@
+"""
+Build the city gazetteer from a GeoNames cities dump
+The bundled app/data/gazetteer.tsv only covers Indian cities and major
+cities elsewhere; this rebuilds it with every GeoNames city above a
+population threshold (cities15000: ~30k places, ~1k Indian):
+    python scripts/build_gazetteer.py [--source cities15000.zip] [--out app/data/gazetteer.tsv]
+
+Indian city tiers are not in GeoNames: they are carried over from the
+current gazetteer for the same name within TIER_MATCH_KM (so the two
+Aurangabads keep their own tiers), and every other Indian city is Tier 3.
+Point GAZETTEER_PATH at the output to use it without replacing the
+bundled file.
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import zipfile
+from typing import Dict, Iterator, List, Tuple
+# Paths
+SCRIPT_DIR = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, ".."))
+from app.utils.gazetteer import GAZETTEER_PATH, Place, distance_km, load_gazetteer, normalize
+GEONAMES_URL = "https://download.geonames.org/export/dump/cities15000.zip"
+# A GeoNames city takes the tier of a known city of the same name this close
+TIER_MATCH_KM = 30
+# Alternate names kept per place (GeoNames lists dozens of languages)
+MAX_ALIASES = 8
+# Alternate names worth matching: Latin script words, not codes ("BOM")
+LATIN_NAME = re.compile(r"^[A-Za-zÀ-ɏ][A-Za-zÀ-ɏ' .\-]{2,}$")
+HEADER = """# City gazetteer: name, aliases (|-separated), ISO country code, Indian city tier, latitude, longitude
+# Built from GeoNames ({source}, CC BY 4.0) by scripts/build_gazetteer.py.
+# Indian tiers carried over from the previous gazetteer; other Indian cities are Tier 3.
+# Order matters: when a name is ambiguous, the earlier row wins unless the text names
+# the other row's country.
+name\taliases\tcountry\ttier\tlatitude\tlongitude
+"""
+def read_source(source: str) -> Iterator[List[str]]:
+    """Rows of a GeoNames dump: a local .zip / .txt, or a URL"""
+    if source.startswith(("http://", "https://")):
+        import requests
+        print(f"Downloading {source}...")
+        response = requests.get(source, timeout=120)
+        response.raise_for_status()
+        data = response.content
+    else:
+        with open(source, "rb") as file:
+            data = file.read()
+    if source.endswith(".zip"):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            data = archive.read(archive.namelist()[0])
+    for line in io.StringIO(data.decode("utf-8")):
+        if line.strip():
+            yield line.rstrip("\n").split("\t")
+def current_tiers(path: str) -> Dict[str, List[Place]]:
+    """Normalized name / alias -> tiered Indian places, from an existing gazetteer"""
+    gazetteer = load_gazetteer(path)
+    tiers: Dict[str, List[Place]] = {}
+    for name, indexes in gazetteer.names.items():
+        for index in indexes:
+            place = gazetteer.places[index]
+            if place.country == "IN" and place.tier:
+                tiers.setdefault(name, []).append(place)
+    return tiers
+def tier_for(names: List[str], latitude: float, longitude: float, tiers: Dict[str, List[Place]]) -> str:
+    """Tier number of the nearby known city sharing one of these names, else 3"""
+    here = Place("", "IN", None, latitude, longitude)
+    for name in names:
+        for place in tiers.get(normalize(name), []):
+            if distance_km(here, place) <= TIER_MATCH_KM:
+                return place.tier.split()[-1]
+    return "3"
+def aliases_for(row: List[str]) -> List[str]:
+    name = row[1]
+    seen = {normalize(name)}
+    aliases = []
+    for alias in [row[2]] + row[3].split(","):
+        key = normalize(alias)
+        if key and key not in seen and LATIN_NAME.match(alias) and not alias.isupper():
+            seen.add(key)
+            aliases.append(alias)
+            if len(aliases) == MAX_ALIASES:
+                break
+    return aliases
+def build(source: str, out: str, min_population: int):
+    tiers = current_tiers(GAZETTEER_PATH)
+    indian: List[Tuple[int, Tuple[str, ...]]] = []
+    others: List[Tuple[int, Tuple[str, ...]]] = []
+    for row in read_source(source):
+        # geonameid, name, asciiname, alternatenames, lat, lon, class, code, country, ..., population (14)
+        population = int(row[14] or 0)
+        if row[6] != "P" or population < min_population:
+            continue
+        name, country = row[1], row[8]
+        aliases = aliases_for(row)
+        latitude, longitude = float(row[4]), float(row[5])
+        tier = tier_for([name] + aliases, latitude, longitude, tiers) if country == "IN" else ""
+        entry = (name, "|".join(aliases), country, tier, f"{latitude:.4f}", f"{longitude:.4f}")
+        (indian if country == "IN" else others).append((population, entry))
+    # India first (this app's patients), then by population: the earlier row wins ambiguous names
+    indian.sort(key=lambda item: -item[0])
+    others.sort(key=lambda item: -item[0])
+    with open(out, "w", encoding="utf-8") as file:
+        file.write(HEADER.format(source=os.path.basename(source)))
+        for _, entry in indian + others:
+            file.write("\t".join(entry) + "\n")
+    tiered = sum(1 for _, entry in indian if entry[3] != "3")
+    print(f"\n SUCCESS! {len(indian) + len(others)} places ({len(indian)} Indian, {tiered} Tier 1/2) -> {out}")
+    if not tiered:
+        print(" Warning: no Tier 1/2 city matched - check the source covers India")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the city gazetteer from GeoNames")
+    parser.add_argument("--source", default=GEONAMES_URL, help="GeoNames citiesN .zip/.txt path or URL")
+    parser.add_argument("--out", default=GAZETTEER_PATH)
+    parser.add_argument("--min-population", type=int, default=15000)
+    args = parser.parse_args()
+    build(args.source, args.out, args.min_population)
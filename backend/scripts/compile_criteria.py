@@ -0,0 +1,72 @@
+"""
+Compile trial eligibility criteria into structured rules
+Run after convert_json_to_db.py (and after each --sync)
+
+Only trials that were never compiled, whose criteria text changed, or
+that were compiled by an older compiler version are recompiled:
+    python scripts/compile_criteria.py [--force]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+# Paths
+SCRIPT_DIR = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, ".."))
+from app.utils.database import init_db, get_trials_for_compilation, save_trial_rules
+from app.utils.criteria_compiler import COMPILER_VERSION, compile_criteria, criteria_hash
+BATCH_SIZE = 1000
+async def main(force: bool = False, batch_size: int = BATCH_SIZE):
+    start = time.time()
+    await init_db()
+    trials = await get_trials_for_compilation()
+    print(f"Compiling eligibility criteria (compiler v{COMPILER_VERSION})...")
+    print(f"Trials in database: {len(trials)}")
+
+    compiled = 0
+    rule_count = 0
+    unparsed_count = 0
+    fully_parsed = 0
+    batch = []
+    for trial in trials:
+        criteria = trial["eligibility_criteria"] or ""
+        digest = criteria_hash(criteria)
+        if (
+            not force
+            and trial["criteria_hash"] == digest
+            and trial["compiler_version"] == COMPILER_VERSION
+        ):
+            continue
+
+        rules = compile_criteria(criteria)
+        unparsed = sum(1 for rule in rules if rule["type"] == "text")
+        batch.append((
+            trial["nct_id"], digest, COMPILER_VERSION,
+            json.dumps(rules, separators=(",", ":")),
+            len(rules), unparsed
+        ))
+        compiled += 1
+        rule_count += len(rules)
+        unparsed_count += unparsed
+        if rules and not unparsed:
+            fully_parsed += 1
+
+        if len(batch) >= batch_size:
+            await save_trial_rules(batch)
+            batch = []
+    if batch:
+        await save_trial_rules(batch)
+
+    print(f"\n SUCCESS! Compiled {compiled} trials in {time.time() - start:.1f}s "
+          f"({len(trials) - compiled} already up to date)")
+    if rule_count:
+        print(f" Rules: {rule_count} ({(rule_count - unparsed_count) / rule_count:.0%} structured), "
+              f"{fully_parsed} trials fully structured")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile eligibility criteria into structured rules")
+    parser.add_argument("--force", action="store_true", help="Recompile every trial")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(main(args.force, args.batch_size))
@@ -1,50 +1,112 @@
 """
 Convert trials_10k.json to SQLite database
 Run this ONCE to populate the database
+
+Accepts a JSON array or NDJSON (.ndjson/.jsonl), optionally .gz/.zst
+compressed, and parses it incrementally so memory stays flat:
+    python scripts/convert_json_to_db.py [path/to/trials.ndjson.gz]
+
+For refreshes of an existing database, --sync writes only new/changed
+trials, flags trials missing from the snapshot as stale and can dump
+the change log:
+    python scripts/convert_json_to_db.py trials.ndjson.gz --sync --changes-out changes.ndjson
 """
+import argparse
+import asyncio
+import gzip
+import io
 import json
-import sqlite3
 import os
+import sys
+from typing import Dict, Iterator, Optional, TextIO
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 # Paths
 SCRIPT_DIR = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, ".."))
+from app.utils.database import DATABASE_PATH, init_db, insert_trials_many, sync_trials
 JSON_FILE = os.path.join(SCRIPT_DIR, "../../data/trials_10k.json")
-DB_FILE = os.path.join(SCRIPT_DIR, "../../data/trials.db")
-print(f"Converting trials from JSON to SQLite...")
-print(f"JSON file: {JSON_FILE}")
-print(f"Database: {DB_FILE}")
-# Load JSON data
-print("\n[1/3] Loading JSON file...")
-with open(JSON_FILE, "r", encoding="utf-8") as f:
-    trials = json.load(f)
-print(f"✅ Loaded {len(trials)} trials")
-# Create database
-print("\n[2/3] Creating database and table...")
-conn = sqlite3.connect(DB_FILE)
-cursor = conn.cursor()
-# Create table
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS trials (
-        nct_id TEXT PRIMARY KEY,
-        title TEXT NOT NULL,
-        brief_summary TEXT,
-        status TEXT,
-        phase TEXT,
-        conditions TEXT,
-        eligibility_criteria TEXT,
-        minimum_age TEXT,
-        maximum_age TEXT,
-        gender TEXT,
-        locations TEXT,
-        sponsor TEXT
-    )
-""")
-print("✅ Table created")
-# Insert trials
-print("\n[3/3] Inserting trials into database...")
-count = 0
-for trial in trials:
+DB_FILE = DATABASE_PATH
+# Trials per transaction
+BATCH_SIZE = 1000
+# Bytes read per chunk when streaming a JSON array
+READ_CHUNK_SIZE = 1 << 16
+def open_input(path: str) -> TextIO:
+    """Open a text stream, decompressing by file extension (.gz, .zst)"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Reading .zst files requires the 'zstandard' package")
+        raw = open(path, "rb")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+def iter_ndjson(f: TextIO) -> Iterator[Dict]:
+    """Yield one study per non-empty line"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+def iter_json_array(f: TextIO) -> Iterator[Dict]:
+    """
+    Yield the elements of a top-level JSON array without loading it whole
+    Holds at most one element plus one read chunk in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if buffer:
+                if buffer[0] != "[":
+                    raise ValueError("Expected a JSON array of studies")
+                buffer = buffer[1:]
+                started = True
+                continue
+        elif buffer[:1] == ",":
+            buffer = buffer[1:]
+            continue
+        elif buffer[:1] == "]":
+            return
+        elif buffer:
+            try:
+                study, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Element spans the chunk boundary - read more
+                if eof:
+                    raise
+            else:
+                yield study
+                buffer = buffer[end:]
+                continue
+        if eof:
+            if not started or buffer.strip():
+                raise ValueError("Unexpected end of JSON array")
+            return
+        chunk = f.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer += chunk
+def iter_studies(path: str) -> Iterator[Dict]:
+    """Stream studies from a JSON array or NDJSON file (plain, .gz or .zst)"""
+    name = path[:-3] if path.endswith(".gz") else path
+    name = name[:-4] if name.endswith(".zst") else name
+    with open_input(path) as f:
+        if name.endswith(".ndjson") or name.endswith(".jsonl"):
+            yield from iter_ndjson(f)
+        else:
+            yield from iter_json_array(f)
+def study_to_trial(study: Dict) -> Optional[Dict]:
+    """
+    Flatten a ClinicalTrials.gov v2 study into a trial dictionary
+    Returns None if the study is missing its NCT ID or title
+    """
     # Extract from nested structure
-    protocol = trial.get("protocolSection", {})
+    protocol = study.get("protocolSection", {})
     identification = protocol.get("identificationModule", {})
     status_module = protocol.get("statusModule", {})
     description = protocol.get("descriptionModule", {})
@@ -60,66 +122,86 @@ for trial in trials:
     
     # Skip if missing required fields
     if not nct_id or not title:
-        continue
-    
-    # Extract other fields
-    brief_summary = description.get("briefSummary", "")
-    status = status_module.get("overallStatus", "")
+        return None
     
     # Phase
     phases = design_module.get("phases", [])
-    phase = phases[0] if phases else None
-    
-    # Conditions
-    conditions = conditions_module.get("conditions", [])
-    
-    # Eligibility
-    eligibility_criteria = eligibility.get("eligibilityCriteria", "")
-    min_age = eligibility.get("minimumAge", "")
-    max_age = eligibility.get("maximumAge", "")
-    sex = eligibility.get("sex", "ALL")
     
     # Locations
-    locations_list = contacts.get("locations", [])
     location_names = []
-    for loc in locations_list:
+    for loc in contacts.get("locations", []):
         city = loc.get("city", "")
         country = loc.get("country", "")
         if city and country:
             location_names.append(f"{city}, {country}")
     
-    # Sponsor
-    lead_sponsor = sponsor_module.get("leadSponsor", {})
-    sponsor = lead_sponsor.get("name", "")
+    return {
+        "nct_id": nct_id,
+        "title": title,
+        "brief_summary": description.get("briefSummary", ""),
+        "status": status_module.get("overallStatus", ""),
+        "phase": phases[0] if phases else None,
+        "conditions": conditions_module.get("conditions", []),
+        "eligibility_criteria": eligibility.get("eligibilityCriteria", ""),
+        "minimum_age": eligibility.get("minimumAge", ""),
+        "maximum_age": eligibility.get("maximumAge", ""),
+        "gender": eligibility.get("sex", "ALL"),
+        "locations": location_names,
+        "sponsor": sponsor_module.get("leadSponsor", {}).get("name", ""),
+        "last_update_date": status_module.get("lastUpdatePostDateStruct", {}).get("date")
+    }
+async def main(
+    json_file: str = JSON_FILE,
+    batch_size: int = BATCH_SIZE,
+    sync: bool = False,
+    changes_out: Optional[str] = None
+):
+    print(f"Converting trials from JSON to SQLite...")
+    print(f"JSON file: {json_file}")
+    print(f"Database: {DB_FILE}")
     
-    # Insert into database
-    cursor.execute("""
-        INSERT OR REPLACE INTO trials 
-        (nct_id, title, brief_summary, status, phase, conditions,
-         eligibility_criteria, minimum_age, maximum_age, gender,
-         locations, sponsor)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        nct_id,
-        title,
-        brief_summary,
-        status,
-        phase,
-        json.dumps(conditions),
-        eligibility_criteria,
-        min_age,
-        max_age,
-        sex,
-        json.dumps(location_names),
-        sponsor
-    ))
+    # Create database
+    print("\n[1/2] Creating database, table and search index...")
+    await init_db()
+    print("✅ Table and search index created")
     
-    count += 1
-    if count % 1000 == 0:
-        print(f"  Inserted {count} trials...")
-# Save changes
-conn.commit()
-conn.close()
-print(f"\n SUCCESS! Inserted {count} trials into database")
-print(f" Database created at: {DB_FILE}")
-print(f" Database size: {os.path.getsize(DB_FILE) / (1024*1024):.1f} MB")
\ No newline at end of file
+    # Stream studies from disk straight into batched transactions
+    trials = (
+        trial for trial in map(study_to_trial, iter_studies(json_file))
+        if trial is not None
+    )
+    
+    if sync:
+        print("\n[2/2] Syncing changed trials into database...")
+        summary = await sync_trials(trials, batch_size=batch_size)
+        print(f"\n SUCCESS! Sync {summary['sync_id']} in {summary['seconds']}s: "
+              f"{summary['added']} added, {summary['updated']} updated, "
+              f"{summary['stale']} stale, {summary['unchanged']} unchanged")
+        if changes_out:
+            with open(changes_out, "w", encoding="utf-8") as f:
+                for change in summary["changes"]:
+                    f.write(json.dumps(change) + "\n")
+            print(f" Change log written to: {changes_out}")
+    else:
+        print("\n[2/2] Inserting trials into database...")
+        stats = await insert_trials_many(trials, batch_size=batch_size)
+        print(f"\n SUCCESS! Inserted {stats['inserted']} trials into database")
+        print(f" Load time: {stats['seconds']}s ({stats['trials_per_second']} trials/s)")
+    
+    print(f" Database created at: {DB_FILE}")
+    print(" Next: python scripts/compile_criteria.py to (re)compile eligibility rules")
+    print(f" Database size: {os.path.getsize(DB_FILE) / (1024*1024):.1f} MB")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load ClinicalTrials.gov studies into SQLite")
+    parser.add_argument(
+        "input", nargs="?", default=JSON_FILE,
+        help="JSON array or NDJSON file, optionally .gz/.zst compressed"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--sync", action="store_true",
+        help="Only write new/changed trials and mark missing ones stale"
+    )
+    parser.add_argument("--changes-out", help="With --sync, write the change log as NDJSON")
+    args = parser.parse_args()
+    asyncio.run(main(args.input, args.batch_size, args.sync, args.changes_out))
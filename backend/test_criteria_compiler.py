@@ -0,0 +1,85 @@
+"""
+Criteria compiler and compiled-rule evaluation
+
+Compiles eligibility criteria text into rules and applies them to
+patients. Pure functions: no database, API key or network needed.
+
+    python test_criteria_compiler.py
+"""
+from app.agents.eligibility_matcher import evaluate_compiled_rules
+from app.utils.criteria_compiler import compile_criteria, parse_age_rule, parse_lab_rule, split_sections
+from conftest import run_tests
+CRITERIA = """Inclusion Criteria:
+* Diagnosis of type 2 diabetes
+* HbA1c between 7.0% and 10.5%
+* Age 18 to 75 years
+Exclusion Criteria:
+* Type 1 diabetes
+* Pregnant or breastfeeding women
+"""
+PATIENT = {
+    "age": 52,
+    "gender": "male",
+    "conditions": ["Type 2 Diabetes Mellitus"],
+    "lab_values": {"hba1c": {"value": 8.1, "unit": "%"}}
+}
+def test_split_sections():
+    sections = split_sections(CRITERIA)
+    assert sections[0] == ("inclusion", "Diagnosis of type 2 diabetes")
+    assert sections[-1] == ("exclusion", "Pregnant or breastfeeding women")
+    assert [section for section, _ in sections].count("exclusion") == 2
+def test_age_rules():
+    cases = {
+        "Age 18 to 75 years": (18, 75),
+        "Aged between 18 and 65": (18, 65),
+        "Age: 40-70": (40, 70),
+        "Adults aged 18 years or older": (18, None),
+        "Age >= 18": (18, None),
+        "Must be at least 18 years old": (18, None),
+        "Patients over 50 years of age": (51, None),
+        "Participants older than 60": (61, None),
+        "Age under 18": (None, 17),
+    }
+    for text, (low, high) in cases.items():
+        rule = parse_age_rule(text)
+        assert rule and (rule["min"], rule["max"]) == (low, high), (text, rule)
+def test_non_age_numbers_ignored():
+    # Weights, months and durations next to an age word are not age bounds
+    for text in [
+        "Adults weighing over 50 kg",
+        "Children aged 6 months or older",
+        "Adult patients with BMI above 30",
+        "Diabetes for at least 2 years in adults",
+    ]:
+        assert parse_age_rule(text) is None, text
+def test_lab_rule():
+    rule = parse_lab_rule("HbA1c between 7.0% and 10.5%")
+    assert rule["lab"] == "hba1c"
+    assert (rule["min"], rule["max"]) == (7.0, 10.5)
+def test_compile_criteria():
+    rules = compile_criteria(CRITERIA)
+    assert [rule["type"] for rule in rules] == ["condition", "lab", "age", "condition", "pregnancy"]
+    assert rules[0]["terms"] == ["type 2 diabetes"]
+    assert rules[3]["section"] == "exclusion"
+def test_matching_patient_is_eligible():
+    result, decisive = evaluate_compiled_rules(PATIENT, compile_criteria(CRITERIA))
+    assert decisive and result["status"] == "ELIGIBLE"
+def test_unrelated_condition_name_defers():
+    # "T2DM" shares no words with "type 2 diabetes" but may be the same condition
+    patient = dict(PATIENT, conditions=["T2DM"])
+    result, decisive = evaluate_compiled_rules(patient, compile_criteria(CRITERIA))
+    assert not decisive and result["status"] == "POSSIBLY_ELIGIBLE"
+    assert result["inclusion_criteria"][0]["status"] == "MISSING"
+def test_conflicting_condition_fails():
+    # Type 1 vs type 2 is a real mismatch
+    patient = dict(PATIENT, conditions=["Type 1 Diabetes"])
+    result, decisive = evaluate_compiled_rules(patient, compile_criteria(CRITERIA))
+    assert decisive and result["status"] == "NOT_ELIGIBLE"
+    assert result["inclusion_criteria"][0]["status"] == "FAIL"
+def test_out_of_range_lab_fails():
+    patient = dict(PATIENT, lab_values={"hba1c": {"value": 11.2, "unit": "%"}})
+    result, decisive = evaluate_compiled_rules(patient, compile_criteria(CRITERIA))
+    assert decisive and result["status"] == "NOT_ELIGIBLE"
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Criteria compiler checks passed")
@@ -0,0 +1,174 @@
+"""
+Trial database search
+
+Builds throwaway SQLite databases and checks the full-text index: that
+the triggers keep trials_fts in step with inserts, updates and deletes,
+the MATCH expressions build_fts_query produces, and that ranked search
+orders trials by BM25 (a hit in the conditions column first). Then the
+exact lookup on trial_conditions: equality or a whole-word prefix, never
+a partial word, a word in the middle or another word order. Last, the
+age / sex pre-filter at its boundaries. No API key or network needed.
+
+    python test_database.py
+"""
+import asyncio
+import sqlite3
+from app.utils import database
+from app.utils.database import (
+    build_condition_lookup,
+    build_demographic_filter,
+    build_fts_query,
+    insert_trial,
+    search_trials_by_condition
+)
+from conftest import make_trial, run_tests, temp_database
+def fts_hits(path, match_expr):
+    """nct_ids of the trials_fts rows matching match_expr"""
+    with sqlite3.connect(path) as db:
+        rows = db.execute("""
+            SELECT trials.nct_id FROM trials_fts
+            JOIN trials ON trials.rowid = trials_fts.rowid
+            WHERE trials_fts MATCH ?
+            ORDER BY trials.nct_id
+        """, (match_expr,)).fetchall()
+    return [row[0] for row in rows]
+def search(conditions, **kwargs):
+    trials = asyncio.run(search_trials_by_condition(conditions, **kwargs))
+    return [t["nct_id"] for t in trials]
+def test_fts_follows_insert_update_delete():
+    with temp_database() as path:
+        asyncio.run(insert_trial(make_trial("NCT-A", ["Asthma"])))
+        asyncio.run(insert_trial(make_trial("NCT-B", ["Asthma", "COPD"])))
+        assert fts_hits(path, "conditions : asthma") == ["NCT-A", "NCT-B"]
+        # Re-inserting with new conditions replaces the indexed text
+        asyncio.run(insert_trial(make_trial("NCT-A", ["Hypertension"])))
+        assert fts_hits(path, "conditions : asthma") == ["NCT-B"]
+        assert fts_hits(path, "conditions : hypertension") == ["NCT-A"]
+        with sqlite3.connect(path) as db:
+            db.execute("UPDATE trials SET title = 'Inhaler study' WHERE nct_id = 'NCT-B'")
+            db.execute("DELETE FROM trials WHERE nct_id = 'NCT-A'")
+        assert fts_hits(path, "title : inhaler") == ["NCT-B"]
+        assert fts_hits(path, "hypertension") == []
+        # The external-content index agrees with its content table
+        with sqlite3.connect(path) as db:
+            db.execute("INSERT INTO trials_fts(trials_fts) VALUES ('integrity-check')")
+def test_bulk_load_rebuilds_fts():
+    trials = [make_trial(f"NCT-{i}", ["Asthma"]) for i in range(5)]
+    with temp_database() as path:
+        asyncio.run(database.insert_trials_many(trials, batch_size=2))
+        assert len(fts_hits(path, "conditions : asthma")) == 5
+        # The sync triggers are back after the deferred load
+        with sqlite3.connect(path) as db:
+            triggers = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        assert set(database.FTS_TRIGGERS) <= triggers
+def test_build_fts_query():
+    assert build_fts_query(["Type 2 Diabetes", "COPD"]) == 'conditions : "type 2 diabetes" OR conditions : "copd"'
+    assert build_fts_query(["Type 2 Diabetes"], columns=None, any_order=True) == '("type" "2" "diabetes")'
+    # FTS syntax in user input stays quoted
+    assert build_fts_query(['asthma" OR title:*']) == 'conditions : "asthma or title"'
+    assert build_fts_query(["", "--"]) is None
+def test_phrase_vs_any_order():
+    trials = [make_trial("NCT-T2DM", ["Diabetes Mellitus, Type 2"]), make_trial("NCT-HTN", ["Hypertension"])]
+    with temp_database(trials):
+        # A phrase needs the words in order; ranked search takes any order
+        assert search(["Type 2 Diabetes"]) == []
+        assert search(["Type 2 Diabetes"], ranked=True) == ["NCT-T2DM"]
+def test_ranked_orders_by_bm25():
+    trials = [
+        make_trial("NCT-SUMMARY", ["Lung Function"], brief_summary="Adults with asthma and other lung disease"),
+        make_trial("NCT-TITLE", ["Airway Disease"], title="Asthma Inhaler Trial"),
+        make_trial("NCT-CONDITION", ["Asthma"]),
+        make_trial("NCT-OTHER", ["Hypertension"]),
+    ]
+    with temp_database(trials):
+        assert search(["Asthma"], ranked=True) == ["NCT-CONDITION", "NCT-TITLE", "NCT-SUMMARY"]
+        assert search(["Asthma"], ranked=True, limit=1) == ["NCT-CONDITION"]
+        # Unranked search only looks at the conditions column
+        assert search(["Asthma"]) == ["NCT-CONDITION"]
+def test_build_condition_lookup():
+    sql, params = build_condition_lookup(["Type 2 Diabetes, Mellitus", "!!", "COPD"])
+    clause = "(condition_norm = ? OR (condition_norm >= ? AND condition_norm < ?))"
+    assert sql == f"{clause} OR {clause}"
+    assert params == [
+        "type 2 diabetes mellitus", "type 2 diabetes mellitus ", "type 2 diabetes mellitus!",
+        "copd", "copd ", "copd!"
+    ]
+    assert build_condition_lookup(["", "--"]) == (None, [])
+def test_exact_lookup():
+    trials = [
+        make_trial("NCT-T2DM", ["Type 2 Diabetes"]),
+        make_trial("NCT-T2DM-MELLITUS", ["Type 2 Diabetes Mellitus"]),
+        make_trial("NCT-REORDERED", ["Diabetes Mellitus, Type 2"]),
+        make_trial("NCT-PREDIABETES", ["Pre Diabetes"]),
+        make_trial("NCT-DIABETESX", ["Type 2 Diabetesx"]),
+        make_trial("NCT-BOTH", ["Type 2 Diabetes", "Hypertension"]),
+    ]
+    with temp_database(trials) as path:
+        with sqlite3.connect(path) as db:
+            rows = db.execute("SELECT condition_norm FROM trial_conditions WHERE nct_id = 'NCT-REORDERED'").fetchall()
+        assert rows == [("diabetes mellitus type 2",)]
+        # Equality and whole-word prefix, case and punctuation ignored
+        assert sorted(search(["type 2 DIABETES"], exact=True)) == ["NCT-BOTH", "NCT-T2DM", "NCT-T2DM-MELLITUS"]
+        assert search(["Type-2 Diabetes Mellitus"], exact=True) == ["NCT-T2DM-MELLITUS"]
+        # A leading word only: "diabetes" is not "pre diabetes" or "type 2 diabetes"
+        assert search(["Diabetes"], exact=True) == ["NCT-REORDERED"]
+        # Not a partial word or another word order
+        assert search(["Type 2 Diabetes Mel"], exact=True) == []
+        assert search(["Diabetes Type 2"], exact=True) == []
+        assert search(["Diabetes Mellitus Type 2"], exact=True) == ["NCT-REORDERED"]
+        # Ranked: trials matching more of the patient's conditions first
+        assert search(["Hypertension", "Type 2 Diabetes"], exact=True, ranked=True)[0] == "NCT-BOTH"
+        # Re-inserting a trial replaces its condition rows
+        asyncio.run(insert_trial(make_trial("NCT-T2DM", ["Asthma"])))
+        assert "NCT-T2DM" not in search(["Type 2 Diabetes"], exact=True)
+        assert search(["Asthma"], exact=True) == ["NCT-T2DM"]
+def test_build_demographic_filter():
+    assert build_demographic_filter(None, None) == ("", [])
+    sql, params = build_demographic_filter(40, "Female")
+    assert sql == (
+        "AND trials.gender_norm IN ('ALL', ?)\n"
+        "AND trials.min_age_months <= ? AND trials.max_age_months >= ?"
+    )
+    assert params == ["FEMALE", 480, 480]
+    # Any other gender can only match trials open to all
+    assert build_demographic_filter(None, "other")[1] == ["ALL"]
+    assert build_demographic_filter(0, None)[1] == [0, 0]
+def test_demographic_filter_search():
+    trials = [
+        make_trial("NCT-ADULT", ["Asthma"], minimum_age="18 Years", maximum_age="65 Years"),
+        make_trial("NCT-ANY-AGE", ["Asthma"], minimum_age="N/A", maximum_age=None),
+        make_trial("NCT-INFANT", ["Asthma"], minimum_age="6 Months", maximum_age="2 Years"),
+        make_trial("NCT-MEN", ["Asthma"], minimum_age=None, gender="Male"),
+        make_trial("NCT-WOMEN", ["Asthma"], minimum_age=None, gender="FEMALE"),
+        make_trial("NCT-UNKNOWN-SEX", ["Asthma"], minimum_age=None, gender=""),
+    ]
+    def found(age=None, gender=None):
+        return sorted(search(["Asthma"], age=age, gender=gender, exact=True))
+    with temp_database(trials) as path:
+        with sqlite3.connect(path) as db:
+            rows = dict((row[0], row[1:]) for row in db.execute(
+                "SELECT nct_id, min_age_months, max_age_months, gender_norm FROM trials"
+            ))
+        assert rows["NCT-ADULT"] == (216, 780, "ALL")
+        assert rows["NCT-ANY-AGE"] == (0, database.NO_MAX_AGE_MONTHS, "ALL")
+        assert rows["NCT-UNKNOWN-SEX"][2] == "ALL"
+        everyone = ["NCT-ANY-AGE", "NCT-MEN", "NCT-UNKNOWN-SEX", "NCT-WOMEN"]
+        # Both age limits are inclusive
+        assert found(age=17) == everyone
+        assert found(age=18) == sorted(everyone + ["NCT-ADULT"])
+        assert found(age=65) == sorted(everyone + ["NCT-ADULT"])
+        assert found(age=66) == everyone
+        assert found(age=2) == sorted(everyone + ["NCT-INFANT"])
+        assert found(age=0) == everyone
+        assert found(age=120) == everyone
+        # Trials open to all sexes match every patient
+        assert found(gender="male") == ["NCT-ADULT", "NCT-ANY-AGE", "NCT-INFANT", "NCT-MEN", "NCT-UNKNOWN-SEX"]
+        assert found(gender="FEMALE") == ["NCT-ADULT", "NCT-ANY-AGE", "NCT-INFANT", "NCT-UNKNOWN-SEX", "NCT-WOMEN"]
+        assert found(gender="other") == ["NCT-ADULT", "NCT-ANY-AGE", "NCT-INFANT", "NCT-UNKNOWN-SEX"]
+        assert found(age=30, gender="female") == ["NCT-ADULT", "NCT-ANY-AGE", "NCT-UNKNOWN-SEX", "NCT-WOMEN"]
+        # The filter runs before LIMIT, so excluded trials don't use up the limit
+        limited = search(["Asthma"], age=1, gender="female", limit=3, exact=True)
+        assert len(limited) == 3 and set(limited) <= {"NCT-ANY-AGE", "NCT-INFANT", "NCT-UNKNOWN-SEX", "NCT-WOMEN"}
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Database search checks passed")
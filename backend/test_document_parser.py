@@ -0,0 +1,134 @@
+"""
+Document parsing pool
+
+Builds small PDFs / images on disk and checks that the pooled parser
+returns the same text as a straight PyPDF2 pass, in page order, within
+the page and size limits (a truncated PDF logged as a warning, nothing
+printed), and that images are oriented and shrunk before they're sent
+to Vision.
+
+    python test_document_parser.py
+"""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import tempfile
+from app.utils import document_parser
+from conftest import run_tests
+def make_pdf(pages):
+    """Minimal PDF with one line of Helvetica text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+def write_temp(data, suffix):
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(handle, "wb") as file:
+        file.write(data)
+    return path
+def test_pages_in_order():
+    pages = [f"Page {i} HbA1c {6 + i / 10:.1f} percent" for i in range(20)]
+    path = write_temp(make_pdf(pages), ".pdf")
+    try:
+        text = asyncio.run(document_parser.parse_pdf_text(path))
+        _, expected = document_parser.extract_pdf_pages(path, 0, len(pages))
+    finally:
+        os.remove(path)
+        document_parser.shutdown()
+    assert text == "".join(page + "\n" for page in expected)
+    assert [line for line in text.splitlines() if line] == pages
+def test_page_limit():
+    saved = document_parser.MAX_PDF_PAGES
+    document_parser.MAX_PDF_PAGES = 10
+    path = write_temp(make_pdf([f"Page {i}" for i in range(25)]), ".pdf")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    document_parser.logger.addHandler(handler)
+    stdout = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stdout):
+            text = asyncio.run(document_parser.parse_pdf_text(path))
+    finally:
+        document_parser.logger.removeHandler(handler)
+        document_parser.MAX_PDF_PAGES = saved
+        os.remove(path)
+        document_parser.shutdown()
+    assert text.splitlines() == [f"Page {i}" for i in range(10)]
+    assert [(r.levelno, r.getMessage()) for r in records] == [(logging.WARNING, "PDF has 25 pages - reading the first 10")]
+    assert stdout.getvalue() == ""
+def test_size_limit():
+    saved = document_parser.MAX_DOCUMENT_BYTES
+    document_parser.MAX_DOCUMENT_BYTES = 100
+    path = write_temp(make_pdf(["Page"]), ".pdf")
+    try:
+        asyncio.run(document_parser.parse_pdf_text(path))
+        raise AssertionError("oversized document was parsed")
+    except document_parser.DocumentTooLargeError:
+        pass
+    finally:
+        document_parser.MAX_DOCUMENT_BYTES = saved
+        os.remove(path)
+def test_image_blob():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 32), "white").save(buffer, format="PNG")
+    path = write_temp(buffer.getvalue(), ".png")
+    try:
+        blob = asyncio.run(document_parser.load_image(path))
+    finally:
+        os.remove(path)
+        document_parser.shutdown()
+    assert blob["mime_type"] in ("image/png", "image/jpeg")
+    assert len(blob["data"]) <= len(buffer.getvalue())
+    assert Image.open(io.BytesIO(blob["data"])).size == (64, 32)
+def test_photo_is_shrunk():
+    from PIL import Image, ImageDraw
+    # A phone photo of a lab report: 12 MP, colourless, shot sideways (EXIF orientation 6)
+    photo = Image.new("RGB", (4000, 3000), (236, 234, 230))
+    draw = ImageDraw.Draw(photo)
+    for y in range(100, 2900, 40):
+        draw.text((100, y), "HbA1c 7.2 %   Fasting glucose 142 mg/dL   eGFR 74 mL/min " * 4, fill=(25, 25, 25))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=95, exif=exif)
+    blob, info = document_parser.prepare_image(buffer.getvalue())
+    prepared = Image.open(io.BytesIO(blob["data"]))
+    print(f"  {info['original_size']} {info['original_bytes'] // 1024} KB -> {prepared.size} {info['sent_bytes'] // 1024} KB")
+    assert prepared.mode == "L"
+    # Upright (portrait) and within the pixel budget
+    assert prepared.height > prepared.width
+    assert prepared.width * prepared.height <= document_parser.IMAGE_MAX_PIXELS
+    assert info["sent_bytes"] < info["original_bytes"] / 2
+def test_colour_is_kept():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), (200, 30, 30)).save(buffer, format="JPEG")
+    blob, info = document_parser.prepare_image(buffer.getvalue())
+    assert not info["grayscale"]
+    assert Image.open(io.BytesIO(blob["data"])).mode == "RGB"
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Document parser checks passed")
@@ -0,0 +1,124 @@
+"""
+Eligibility cascade
+
+Runs check_eligibility through each tier in turn - prescreen, compiled
+rules, cache, LLM, fallback - with a fake Gemini model and stored rules,
+checking which tier decided ("decided_by"). Condition names that share no
+words with the trial's ("T2DM", "High blood pressure") must reach the LLM
+rather than be rejected by the rules.
+
+    python test_eligibility_cascade.py
+"""
+import asyncio
+import os
+import tempfile
+from app.agents import eligibility_matcher
+from app.agents.eligibility_matcher import check_eligibility, eligibility_cache
+from app.utils import cache, llm_client
+from app.utils.criteria_compiler import COMPILER_VERSION, compile_criteria, criteria_hash
+from app.utils.llm_resilience import CircuitBreaker
+from conftest import FakeModel, fake_gemini, patched, run_tests
+CRITERIA = """Inclusion Criteria:
+* Diagnosis of type 2 diabetes
+* HbA1c between 7.0% and 10.5%
+Exclusion Criteria:
+* Type 1 diabetes
+"""
+TRIAL = {
+    "nct_id": "NCT00000001",
+    "minimum_age": "18 Years",
+    "maximum_age": "75 Years",
+    "gender": "ALL",
+    "conditions": ["Diabetes Mellitus, Type 2"],
+    "eligibility_criteria": CRITERIA
+}
+PATIENT = {
+    "age": 52,
+    "gender": "male",
+    "conditions": ["Type 2 Diabetes"],
+    "lab_values": {"hba1c": {"value": 8.1, "unit": "%"}}
+}
+# Nothing the compiler can structure: the rule tiers only see the condition fields
+FREE_TEXT_CRITERIA = """Inclusion Criteria:
+* Willing to attend monthly clinic visits
+"""
+LLM_VERDICT = {"status": "ELIGIBLE", "confidence": 0.8, "Final outcome": "Meets the criteria."}
+class FailingModel(FakeModel):
+    async def generate_content_async(self, contents, generation_config=None):
+        self.calls += 1
+        raise RuntimeError("500 Internal error")
+def decide(patient, trial=TRIAL, model=None):
+    """(result, LLM calls) of check_eligibility, with the trial's rules compiled as if stored"""
+    criteria = trial["eligibility_criteria"]
+    async def stored_rules(nct_ids):
+        return {trial["nct_id"]: {
+            "compiler_version": COMPILER_VERSION,
+            "criteria_hash": criteria_hash(criteria),
+            "rules": compile_criteria(criteria)
+        }}
+    model = model or FakeModel(LLM_VERDICT)
+    with fake_gemini(model), patched(eligibility_matcher, get_trial_rules=stored_rules):
+        return asyncio.run(check_eligibility(patient, trial)), model.calls
+def with_fresh_cache(test):
+    def run():
+        eligibility_cache._entries.clear()
+        with patched(cache, CACHE_DB_PATH=os.path.join(tempfile.mkdtemp(), "cache.db")):
+            try:
+                test()
+            finally:
+                asyncio.run(cache.close_cache_db())
+                eligibility_cache._entries.clear()
+    run.__name__, run.__module__ = test.__name__, test.__module__
+    return run
+@with_fresh_cache
+def test_prescreen_rejects_age():
+    result, calls = decide(dict(PATIENT, age=80))
+    assert result["decided_by"] == "prescreen" and result["status"] == "NOT_ELIGIBLE"
+    assert calls == 0
+@with_fresh_cache
+def test_prescreen_rejects_number_conflict():
+    # Shares words with the trial's condition, but type 1 is not type 2
+    result, calls = decide(dict(PATIENT, conditions=["Type 1 Diabetes"]))
+    assert result["decided_by"] == "prescreen" and result["status"] == "NOT_ELIGIBLE"
+    assert calls == 0
+@with_fresh_cache
+def test_compiled_rules_decide():
+    result, calls = decide(PATIENT)
+    assert result["decided_by"] == "compiled_rules" and result["status"] == "ELIGIBLE"
+    result, calls = decide(dict(PATIENT, lab_values={"hba1c": {"value": 11.5, "unit": "%"}}))
+    assert result["decided_by"] == "compiled_rules" and result["status"] == "NOT_ELIGIBLE"
+    assert calls == 0
+@with_fresh_cache
+def test_unmatched_compiled_condition_reaches_llm():
+    # The compiled "type 2 diabetes" rule can't tell whether T2DM is it
+    result, calls = decide(dict(PATIENT, conditions=["T2DM"]))
+    assert result["decided_by"] == "llm" and calls == 1
+@with_fresh_cache
+def test_synonyms_reach_llm_then_cache():
+    # No shared words with the trial's conditions: the prescreen may not reject
+    cases = [
+        ("T2DM", ["Diabetes Mellitus, Type 2"]),
+        ("High blood pressure", ["Hypertension"]),
+        ("Type 2 Diabetes", ["Diabetic Nephropathy"]),
+    ]
+    for condition, trial_conditions in cases:
+        patient = dict(PATIENT, conditions=[condition])
+        trial = dict(TRIAL, conditions=trial_conditions, eligibility_criteria=FREE_TEXT_CRITERIA)
+        result, calls = decide(patient, trial)
+        assert result["decided_by"] == "llm" and result["status"] == "ELIGIBLE", condition
+        assert calls == 1
+        # The same facts again: the earlier verdict, no LLM call
+        result, calls = decide(patient, trial)
+        assert result["decided_by"] == "cache" and calls == 0, condition
+@with_fresh_cache
+def test_llm_failure_falls_back():
+    patient = dict(PATIENT, conditions=["T2DM"])
+    with patched(llm_client, breaker=CircuitBreaker()):
+        result, calls = decide(patient, model=FailingModel())
+    assert calls >= 1
+    assert result["decided_by"] == "fallback"
+    assert result["status"] == "POSSIBLY_ELIGIBLE"
+    assert result["missing_data"][0]["field"] == "llm_status"
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Eligibility cascade checks passed")
@@ -0,0 +1,69 @@
+"""
+Prescreen age limits
+
+Checks fallback_eligibility_check reads ClinicalTrials.gov age limits
+in their own units ("28 Days", "6 Weeks", "6 Months") rather than as
+years, that a limit it can't read is left open instead of failing, and
+that the vectorized batch screen gives the same results, age limits and
+condition names alike. No database, API key or network needed.
+
+    python test_eligibility_prescreen.py
+"""
+from app.agents.eligibility_matcher import fallback_eligibility_check, fallback_eligibility_check_batch
+from conftest import run_tests
+PATIENT = {"age": 25, "gender": "female", "conditions": ["Asthma"]}
+def check(age, minimum_age=None, maximum_age=None):
+    trial = {"minimum_age": minimum_age, "maximum_age": maximum_age, "gender": "ALL", "conditions": ["Asthma"]}
+    return fallback_eligibility_check(dict(PATIENT, age=age), trial)
+def age_status(result):
+    return next(i["status"] for i in result["inclusion_criteria"] if "age" in i["criterion"].lower())
+def test_days_limit():
+    assert age_status(check(25, "28 Days", "65 Years")) == "PASS"
+    result = check(25, None, "28 Days")
+    assert result["status"] == "NOT_ELIGIBLE"
+    assert result["inclusion_criteria"][0]["criterion"] == "Maximum age 28 Days"
+def test_weeks_limit():
+    assert age_status(check(1, "6 Weeks")) == "PASS"
+    assert age_status(check(0, "6 Weeks")) == "FAIL"
+    assert age_status(check(2, None, "12 Weeks")) == "FAIL"
+def test_months_limit():
+    assert age_status(check(3, "6 Months", "17 Years")) == "PASS"
+    assert age_status(check(0, "6 Months")) == "FAIL"
+    assert age_status(check(1, None, "18 Months")) == "PASS"
+def test_years_limit():
+    assert age_status(check(17, "18 Years")) == "FAIL"
+    assert age_status(check(66, "18 Years", "65 Years")) == "FAIL"
+    assert age_status(check(40, "18", "N/A")) == "PASS"
+def test_unreadable_limit_is_unknown():
+    result = check(25, "Eighteen Years")
+    assert result["status"] == "POSSIBLY_ELIGIBLE"
+    assert not any(i["status"] == "FAIL" for i in result["inclusion_criteria"])
+    assert result["missing_data"][0]["field"] == "age"
+    # A readable limit still fails on its own
+    assert check(10, "18 Years", "Sixty Years")["status"] == "NOT_ELIGIBLE"
+def test_batch_matches_per_trial():
+    limits = [None, "N/A", "28 Days", "6 Weeks", "6 Months", "18 Months", "2 Years", "18 Years", "65 Years", "18", "Eighteen Years"]
+    trials = [
+        {"minimum_age": low, "maximum_age": high, "gender": "ALL", "conditions": ["Asthma"]}
+        for low in limits for high in limits
+    ]
+    for age in [None, 0, 1, 3, 17, 25, 70]:
+        patient = dict(PATIENT, age=age)
+        expected = [fallback_eligibility_check(patient, trial) for trial in trials]
+        assert fallback_eligibility_check_batch(patient, trials) == expected, age
+    # Matching, conflicting (type 1 vs 2) and unrelated condition names
+    condition_sets = [["Asthma"], ["Type 1 Diabetes"], ["Diabetes Mellitus, Type 2"], ["Hypertension", "Asthma"], []]
+    trials = [
+        {"minimum_age": "18 Years", "maximum_age": None, "gender": "ALL", "conditions": conditions}
+        for conditions in condition_sets
+    ]
+    for conditions in [["Asthma"], ["T2DM"], ["Type 2 Diabetes"], ["High blood pressure"], []]:
+        patient = dict(PATIENT, conditions=conditions)
+        expected = [fallback_eligibility_check(patient, trial) for trial in trials]
+        assert fallback_eligibility_check_batch(patient, trials) == expected, conditions
+    # A 3-year-old meets a "6 Months" minimum in the batch screen too
+    infant_trial = {"minimum_age": "6 Months", "maximum_age": "N/A", "gender": "ALL", "conditions": ["Asthma"]}
+    assert fallback_eligibility_check_batch(dict(PATIENT, age=3), [infant_trial])[0]["status"] == "ELIGIBLE"
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Prescreen age checks passed")
@@ -0,0 +1,52 @@
+"""
+Extraction cache
+
+Uploads the same document repeatedly through /api/upload with a fake
+Gemini model, and checks that repeats are served from the fingerprint
+cache without an LLM call, and that DELETE /api/upload/cache/{digest}
+evicts the document.
+
+    python test_extraction_cache.py
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from fastapi.testclient import TestClient
+from app.utils import cache
+from conftest import FakeModel, fake_gemini, patched, run_tests
+from test_document_parser import make_pdf
+import main
+def test_repeat_upload_is_cached():
+    model = FakeModel({"age": 58, "gender": "female", "location": "Pune", "conditions": ["Type 2 Diabetes"]})
+    with fake_gemini(model), patched(cache, CACHE_DB_PATH=os.path.join(tempfile.mkdtemp(), "cache.db")):
+        document = make_pdf(["Patient: 58 year old female, Pune", "Diagnosis: Type 2 Diabetes"])
+        digest = hashlib.sha256(document).hexdigest()
+        try:
+            # No startup event: the trials database isn't needed
+            client = TestClient(main.app)
+            def upload():
+                response = client.post("/api/upload", files={"file": ("record.pdf", document, "application/pdf")})
+                assert response.status_code == 200
+                return response.json()
+            first = upload()
+            second = upload()
+            print(f"  first: {first['extraction_time_seconds']}s, repeat: {second['extraction_time_seconds']}s, LLM calls: {model.calls}")
+            assert first["success"] and first["document_digest"] == digest
+            assert model.calls == 1
+            assert second["profile"] == first["profile"]
+            assert second["document_digest"] == digest
+            # A restart keeps the disk tier
+            main_cache = cache._caches["extraction"]
+            main_cache._entries.clear()
+            assert upload()["profile"] == first["profile"] and model.calls == 1
+            response = client.delete(f"/api/upload/cache/{digest}")
+            assert response.json() == {"digest": digest, "deleted": 1}
+            assert client.delete("/api/upload/cache/not-a-digest").status_code == 400
+            upload()
+            assert model.calls == 2
+        finally:
+            asyncio.run(cache.close_cache_db())
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Extraction cache checks passed")
@@ -0,0 +1,112 @@
+"""
+City gazetteer
+
+Checks that location tiers agree with the old city lists, that names
+match on word boundaries ("Agartala" is not Agra, "Indiana" is not
+India), that shared names resolve by the country in the text, that the
+diversity agent uses it for trial sites and distances, and that a
+fuller gazetteer built from a GeoNames dump can be swapped in, places
+missing from it falling back to Tier 3.
+
+    python test_gazetteer.py
+"""
+import importlib.util
+import os
+import tempfile
+from app.agents.diversity import calculate_diversity_score
+from app.agents.profile_extractor import create_profile_from_form, determine_location_tier
+from app.utils import gazetteer
+from conftest import run_tests
+# The lists determine_location_tier used to scan
+OLD_TIER_1 = ["mumbai", "delhi", "bangalore", "bengaluru", "chennai", "kolkata", "hyderabad", "pune", "ahmedabad"]
+OLD_TIER_2 = [
+    "jaipur", "lucknow", "kanpur", "nagpur", "indore", "thane", "bhopal", "visakhapatnam", "pimpri", "patna",
+    "vadodara", "ghaziabad", "ludhiana", "agra", "nashik", "faridabad", "meerut", "rajkot", "varanasi",
+    "srinagar", "aurangabad", "dhanbad", "amritsar", "allahabad", "ranchi", "howrah", "coimbatore",
+    "jabalpur", "gwalior", "vijayawada", "jodhpur", "madurai", "raipur", "kota", "chandigarh", "guwahati", "solapur"
+]
+def test_tiers_match_old_lists():
+    for city in OLD_TIER_1:
+        assert determine_location_tier(city.title()) == "Tier 1", city
+    for city in OLD_TIER_2:
+        assert determine_location_tier(f"{city.upper()}, India") == "Tier 2", city
+    assert determine_location_tier("") == "Tier 1"
+    assert determine_location_tier(None) == "Tier 1"
+    assert determine_location_tier("Some village, Bihar") == "Tier 3"
+    assert create_profile_from_form({"location": "Andheri East, Mumbai 400069"}).location_tier == "Tier 1"
+def test_word_boundaries():
+    assert determine_location_tier("Agartala") == "Tier 3"
+    assert determine_location_tier("Navi Mumbai") == "Tier 1"
+    assert determine_location_tier("Pimpri, Pune") == "Tier 1"
+    assert not gazetteer.is_in_india("Indianapolis, Indiana, United States")
+    assert gazetteer.is_in_india("AIIMS, New Delhi")
+def test_shared_names():
+    assert gazetteer.locate("Hyderabad").country == "IN"
+    assert gazetteer.locate("Hyderabad, Pakistan").country == "PK"
+    assert determine_location_tier("Hyderabad, Pakistan") == "Tier 3"
+    assert gazetteer.locate("Cambridge, Massachusetts, United States").country == "US"
+    assert gazetteer.locate("São Paulo, Brazil") == gazetteer.locate("sao paulo")
+def test_named_country_wins():
+    # Indian city names abroad: the named country rules the Indian row out
+    for site in ["Salem, Oregon, United States", "Delhi, New York, United States", "Kota, Japan"]:
+        assert all(place.country != "IN" for place in gazetteer.find_places(site)), site
+        assert not gazetteer.is_in_india(site), site
+        assert determine_location_tier(site) == "Tier 3", site
+    assert gazetteer.locate("Salem, Tamil Nadu, India").country == "IN"
+def test_lookups_are_cached():
+    gazetteer.find_places("Kochi, Kerala")
+    before = gazetteer.get_stats()
+    gazetteer.find_places("  KOCHI,  kerala ")
+    after = gazetteer.get_stats()
+    assert after["cache_hits"] == before["cache_hits"] + 1
+    assert after["places"] > 500
+def test_diversity_uses_sites():
+    patient = {"location": "Nashik", "gender": "male", "conditions": []}
+    india = calculate_diversity_score(patient, {"locations": ["Tata Memorial Hospital, Mumbai"]}, 85)
+    indiana = calculate_diversity_score(patient, {"locations": ["Indianapolis, Indiana, United States"]}, 85)
+    assert india["diversity_boost"] == 20
+    assert 120 < india["nearest_site_km"] < 160
+    assert indiana["diversity_boost"] == 0
+    assert indiana["nearest_site_km"] > 10000
+    assert calculate_diversity_score({}, {"locations": []}, 85)["nearest_site_km"] is None
+def geonames_row(name, alternate_names, country, latitude, longitude, population):
+    """A line of a GeoNames cities dump (19 tab-separated columns)"""
+    row = ["0", name, name, alternate_names, str(latitude), str(longitude), "P", "PPL", country]
+    row += [""] * 5 + [str(population), "", "0", "UTC", "2024-01-01"]
+    return "\t".join(row) + "\n"
+def test_unknown_places_are_tier_3():
+    gazetteer.use_gazetteer()
+    for location in ["Karad, Maharashtra", "Tromsø, Norway", "Xyzzyville"]:
+        assert gazetteer.locate(location) is None, location
+        assert determine_location_tier(location) == "Tier 3", location
+    assert gazetteer.nearest_distance_km("Xyzzyville", ["Mumbai"]) is None
+def test_geonames_gazetteer():
+    spec = importlib.util.spec_from_file_location("build_gazetteer", os.path.join("scripts", "build_gazetteer.py"))
+    build_gazetteer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(build_gazetteer)
+    folder = tempfile.mkdtemp()
+    source, out = os.path.join(folder, "cities.txt"), os.path.join(folder, "gazetteer.tsv")
+    with open(source, "w", encoding="utf-8") as file:
+        file.write(geonames_row("Mumbai", "Bombay,BOM", "IN", 19.07, 72.88, 12691836))
+        file.write(geonames_row("Karad", "", "IN", 17.29, 74.18, 55663))
+        file.write(geonames_row("Tromsø", "Tromso", "NO", 69.65, 18.96, 64448))
+        file.write(geonames_row("Tiny Hamlet", "", "IN", 20.0, 75.0, 200))
+    build_gazetteer.build(source, out, min_population=15000)
+    try:
+        gazetteer.use_gazetteer(out)
+        assert gazetteer.get_stats()["places"] == 3
+        # Tiers carried over from the bundled file; new Indian cities are Tier 3
+        assert determine_location_tier("Bombay") == "Tier 1"
+        assert determine_location_tier("Karad, Maharashtra") == "Tier 3"
+        assert gazetteer.is_in_india("Karad")
+        assert gazetteer.locate("Tromso, Norway").country == "NO"
+        # Places not in the loaded file: unknown, Tier 3
+        assert determine_location_tier("Pune") == "Tier 3"
+        assert determine_location_tier("Tiny Hamlet") == "Tier 3" and gazetteer.locate("Tiny Hamlet") is None
+        assert 200 < gazetteer.nearest_distance_km("Karad", ["Mumbai"]) < 280
+    finally:
+        gazetteer.use_gazetteer()
+    assert determine_location_tier("Pune") == "Tier 1"
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Gazetteer checks passed")
@@ -0,0 +1,88 @@
+"""
+Lab report fast path
+
+Reads a typical machine-generated lab report with the pattern parser
+and checks the values, then runs Agent 1 on it with a fake Gemini model
+to check that a complete report skips the LLM and an incomplete one
+still goes to it.
+
+    python test_lab_report_parser.py
+"""
+import asyncio
+from app.agents import profile_extractor
+from app.utils.lab_report_parser import parse_lab_report
+from conftest import FakeModel, fake_gemini, run_tests
+REPORT = """SUNRISE DIAGNOSTICS PVT LTD
+Patient Name : Mrs. Sunita Rao          Lab No : 240311-0042
+Age/Sex : 58 Y / F                      Ref. By : Dr. A. Mehta
+City : Pune
+Clinical History : Type 2 Diabetes Mellitus, Hypertension
+Test                          Result     Unit        Reference Range
+Glycated Haemoglobin (HbA1c)  8.1        %           4.0 - 5.6
+Fasting Blood Sugar (FBS)     142        mg/dL       70 - 100
+Serum Creatinine              1.1        mg/dL       0.6 - 1.2
+eGFR (CKD-EPI)                74         mL/min/1.73m2   > 90
+Cholesterol, Total            212        mg/dL       < 200
+HDL Cholesterol               41         mg/dL       > 40
+LDL Cholesterol               138        mg/dL       < 100
+Blood Pressure : 136/84 mmHg
+Current Medications : Metformin 500 mg BD, Amlodipine 5 mg OD
+Drug Allergy : Nil
+"""
+def extract_with_fake(text):
+    model = FakeModel({"age": 40, "gender": "male", "conditions": ["Asthma"]})
+    with fake_gemini(model):
+        return asyncio.run(profile_extractor.extract_from_text(text)), model.calls
+def test_report_values():
+    data = parse_lab_report(REPORT)
+    assert (data["age"], data["gender"], data["location"]) == (58, "female", "Pune")
+    assert data["conditions"] == ["Type 2 Diabetes Mellitus", "Hypertension"]
+    assert data["medications"] == [
+        {"name": "Metformin", "dose": "500 mg", "frequency": "BD"},
+        {"name": "Amlodipine", "dose": "5 mg", "frequency": "OD"}
+    ]
+    assert data["allergies"] == []
+    labs = {key: (lab["value"], lab["unit"]) for key, lab in data["lab_values"].items()}
+    assert labs == {
+        "HbA1c": (8.1, "%"),
+        "fasting_glucose": (142, "mg/dL"),
+        "creatinine": (1.1, "mg/dL"),
+        "eGFR": (74, "mL/min"),
+        "cholesterol": (212, "mg/dL"),
+        "LDL": (138, "mg/dL"),
+        "blood_pressure": ("136/84", "mmHg")
+    }
+def test_implausible_values_left_out():
+    data = parse_lab_report("HbA1c : 72 %\nFasting glucose (70-100 mg/dL) : 6.1 mmol/L\nAge: 250")
+    assert "HbA1c" not in data["lab_values"]
+    assert data["lab_values"]["fasting_glucose"] == {"value": 6.1, "unit": "mmol/L"}
+    assert data["age"] is None
+def test_infant_age_left_out():
+    # Months / weeks / days are not years
+    for line in ["Age: 8 Months", "Age : 6 weeks", "Age: 20 days"]:
+        assert parse_lab_report(line)["age"] is None, line
+    assert parse_lab_report("Age: 45 M")["age"] == 45
+def test_normal_findings_not_conditions():
+    data = parse_lab_report("Diagnosis: No evidence of malignancy\nClinical History: Within normal limits\nDiagnosis: Negative")
+    assert data["conditions"] == []
+    assert parse_lab_report("Impression: Normal study")["conditions"] == []
+def test_complete_report_skips_llm():
+    result, calls = extract_with_fake(REPORT)
+    assert calls == 0
+    assert result.success and not result.missing_fields
+    assert result.profile.lab_values["HbA1c"].value == 8.1
+    assert result.confidence >= profile_extractor.EXTRACTION_FAST_PATH_MIN_CONFIDENCE
+def test_incomplete_report_uses_llm():
+    # No age / gender: the patterns can't fill the required fields
+    result, calls = extract_with_fake("Diagnosis: Asthma\nHbA1c 5.4 %")
+    assert calls == 1
+    assert result.profile.age == 40
+def test_impression_only_report_uses_llm():
+    # An impression is a finding, not a diagnosis the patterns can trust
+    report = REPORT.replace("Clinical History : Type 2 Diabetes Mellitus, Hypertension", "Impression : Normal study")
+    result, calls = extract_with_fake(report)
+    assert calls == 1
+    assert result.profile.conditions == ["Asthma"]
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Lab report parser checks passed")
@@ -0,0 +1,107 @@
+"""
+Scanned PDF pipeline
+
+Builds an image-only PDF (a blank page and a page scanned twice
+included) and runs Agent 1 on it with a fake Gemini model that answers
+each page group with part of the profile. Checks that blank / duplicate
+pages are dropped, that page groups are sent concurrently, and that the
+partial profiles are merged.
+
+    python test_scanned_pdf.py
+"""
+import asyncio
+import os
+import tempfile
+from PIL import Image, ImageDraw
+from app.agents import profile_extractor
+from app.utils import document_parser
+from conftest import FakeModel, fake_gemini, patched, run_tests
+def scanned_page(lines):
+    page = Image.new("L", (1240, 1754), 242)
+    draw = ImageDraw.Draw(page)
+    for i, line in enumerate(lines):
+        draw.text((100, 120 + i * 60), line, fill=20)
+    return page
+PAGES = [
+    scanned_page(["City Hospital, Pune", "Patient: female, 58 years", "Diagnosis: Type 2 Diabetes"]),
+    scanned_page([]),
+    scanned_page(["City Hospital, Pune", "Patient: female, 58 years", "Diagnosis: Type 2 Diabetes"]),
+    scanned_page(["Medications", "Metformin 500 mg twice daily"]),
+    scanned_page(["Lab report", "HbA1c 8.1 %", "eGFR 74 mL/min"]),
+    scanned_page(["Follow-up", "Hypertension noted", "Allergy: penicillin"]),
+    scanned_page(["Medications (cont.)", "Metformin", "Amlodipine 5 mg"])
+]
+# What the fake model reads off each kept page
+PAGE_FACTS = [
+    {"age": 58, "gender": "female", "location": "Pune", "conditions": ["Type 2 Diabetes"]},
+    {"medications": [{"name": "Metformin", "dose": "500 mg", "frequency": None}]},
+    {"lab_values": {"HbA1c": {"value": 8.1, "unit": "%"}, "eGFR": {"value": 74, "unit": "mL/min"}}},
+    {"conditions": ["Hypertension", "type 2 diabetes"], "allergies": ["Penicillin"], "age": 59},
+    {"medications": [{"name": "metformin", "frequency": "twice daily"}, {"name": "Amlodipine", "dose": "5 mg"}]}
+]
+class PageFakeModel(FakeModel):
+    """Answers with the facts of the pages in each request"""
+    def __init__(self):
+        super().__init__(self.page_facts)
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+    def page_facts(self, contents):
+        images = [part for part in contents if isinstance(part, dict)]
+        first = sum(len(r) for r in self.requests)
+        self.requests.append(images)
+        merged = {}
+        for facts in PAGE_FACTS[first:first + len(images)]:
+            for key, value in facts.items():
+                merged.setdefault(key, value)
+        return merged
+    async def generate_content_async(self, contents, generation_config=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        response = await super().generate_content_async(contents, generation_config)
+        await asyncio.sleep(0.05)
+        self.in_flight -= 1
+        return response
+def make_scanned_pdf():
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(handle)
+    PAGES[0].save(path, format="PDF", save_all=True, append_images=PAGES[1:], resolution=150)
+    return path
+def test_scanned_pdf_pages():
+    path = make_scanned_pdf()
+    try:
+        pages = asyncio.run(document_parser.parse_pdf_images(path))
+    finally:
+        os.remove(path)
+        document_parser.shutdown()
+    # Blank page 2 and repeat page 3 dropped
+    assert len(pages) == 5
+    assert all(page["mime_type"] == "image/jpeg" for page in pages)
+def test_scanned_pdf_extraction():
+    model = PageFakeModel()
+    path = make_scanned_pdf()
+    try:
+        with fake_gemini(model), patched(profile_extractor, SCANNED_PAGES_PER_REQUEST=1):
+            result = asyncio.run(profile_extractor.extract_patient_profile(path, ".pdf"))
+    finally:
+        os.remove(path)
+        document_parser.shutdown()
+    profile = result.profile
+    print(f"  {len(model.requests)} requests, {model.max_in_flight} at once; confidence {result.confidence:.2f}")
+    print(f"  warnings: {result.warnings}")
+    assert result.success
+    assert len(model.requests) == 5
+    assert model.max_in_flight == profile_extractor.SCANNED_REQUEST_CONCURRENCY
+    assert (profile.age, profile.gender, profile.location) == (58, "female", "Pune")
+    assert profile.conditions == ["Type 2 Diabetes", "Hypertension"]
+    assert profile.allergies == ["Penicillin"]
+    assert [(m.name, m.dose, m.frequency) for m in profile.medications] == [
+        ("Metformin", "500 mg", "twice daily"),
+        ("Amlodipine", "5 mg", None)
+    ]
+    assert profile.lab_values["HbA1c"].value == 8.1
+    assert result.confidence == 1.0
+    assert any("age" in warning for warning in result.warnings)
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Scanned PDF checks passed")
@@ -0,0 +1,63 @@
+"""
+Startup import budget
+
+Imports the app in a fresh interpreter and checks that it stays within
+the time budget, loads none of the heavy/LLM libraries, and that the
+optional warm-up never calls the Gemini API.
+
+    python test_startup.py
+    STARTUP_IMPORT_BUDGET_SECONDS=1.5 python test_startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+from conftest import run_tests
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_SECONDS = float(os.getenv("STARTUP_IMPORT_BUDGET_SECONDS", "2.5"))
+# Only loaded on first use (or by warm_up)
+DEFERRED_MODULES = ["google.generativeai", "PIL.Image", "PyPDF2", "numpy"]
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "loaded": [m for m in %r if m in sys.modules]
+}))
+""" % (DEFERRED_MODULES,)
+WARMUP_SCRIPT = """
+import json
+import google.generativeai as genai
+calls = []
+def no_api(self, *args, **kwargs):
+    calls.append(1)
+    raise AssertionError("warm-up called the Gemini API")
+genai.GenerativeModel.generate_content = no_api
+genai.GenerativeModel.generate_content_async = no_api
+from app.agents import warm_up
+ready = warm_up()
+print(json.dumps({"ready": ready, "api_calls": len(calls)}))
+"""
+def run_python(script: str) -> dict:
+    # A dummy key: any import-time LLM call would try (and fail) to use it
+    env = dict(os.environ, GEMINI_API_KEY="startup-test-key", PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+def test_import_budget():
+    report = run_python(IMPORT_SCRIPT)
+    print(f"  import main: {report['seconds']:.2f}s (budget {IMPORT_BUDGET_SECONDS}s)")
+    assert not report["loaded"], f"Loaded at import time: {report['loaded']}"
+    assert report["seconds"] < IMPORT_BUDGET_SECONDS
+def test_warm_up_makes_no_api_calls():
+    report = run_python(WARMUP_SCRIPT)
+    print(f"  warm_up: LLM ready={report['ready']}, API calls={report['api_calls']}")
+    assert report["api_calls"] == 0
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Startup checks passed")
@@ -0,0 +1,52 @@
+"""
+Agent 2 candidate ranking
+
+Runs search_trials_for_patient over a fixed candidate pool (the database
+search stubbed out) and checks which trials survive the cut to
+max_results: only age / sex failures drop behind the rest, never a trial
+whose condition is a synonym or abbreviation of the patient's. Then
+searches a temporary database, checking that a condition with no exact
+hit still reaches BM25 when the patient's other conditions have one.
+
+    python test_trial_searcher.py
+"""
+import asyncio
+from app.agents import trial_searcher
+from app.models import PatientProfile
+from conftest import make_trial, patched, run_tests, temp_database
+PATIENT = PatientProfile(age=52, gender="male", location="Pune", conditions=["T2DM"])
+def search(pool, max_results):
+    async def fake_search(**kwargs):
+        return list(pool)
+    with patched(trial_searcher, search_trials_by_condition=fake_search):
+        trials = asyncio.run(trial_searcher.search_trials_for_patient(PATIENT, max_results=max_results))
+    return [t.nct_id for t in trials]
+def test_synonym_condition_not_dropped():
+    pool = [
+        make_trial("TOO-OLD", ["T2DM"], minimum_age="65 Years"),
+        make_trial("WOMEN-ONLY", ["T2DM"], gender="FEMALE"),
+        make_trial("SYNONYM", ["Diabetes Mellitus, Type 2"]),
+        make_trial("SAME-NAME", ["T2DM"]),
+    ]
+    assert search(pool, max_results=2) == ["SYNONYM", "SAME-NAME"]
+def test_order_kept_without_failures():
+    pool = [make_trial("A", ["Hypertension"]), make_trial("B", ["T2DM"]), make_trial("C", ["Obesity"])]
+    assert search(pool, max_results=2) == ["A", "B"]
+def test_unmatched_condition_reaches_bm25():
+    trials = [
+        make_trial("NCT-HTN", ["Hypertension"]),
+        make_trial("NCT-T2DM", ["Diabetes Mellitus Type 2"]),
+        make_trial("NCT-ASTHMA", ["Asthma"]),
+    ]
+    # "Hypertension" matches exactly; "Type 2 Diabetes" only in another word order
+    patient = PatientProfile(age=52, gender="male", location="Pune", conditions=["Hypertension", "Type 2 Diabetes"])
+    with temp_database(trials):
+        found = asyncio.run(trial_searcher.search_trials_for_patient(patient, max_results=10))
+    assert sorted(t.nct_id for t in found) == ["NCT-HTN", "NCT-T2DM"]
+def test_interleave():
+    first = [{"nct_id": "A"}, {"nct_id": "B"}, {"nct_id": "C"}]
+    second = [{"nct_id": "B"}, {"nct_id": "D"}]
+    assert [t["nct_id"] for t in trial_searcher.interleave(first, second)] == ["A", "B", "D", "C"]
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Trial searcher checks passed")
@@ -0,0 +1,84 @@
+"""
+Incremental trial sync
+
+Runs sync_trials over successive snapshots in a temporary database and
+checks the content-hash delta: unchanged trials are skipped, changed and
+new ones written, trials missing from the snapshot flagged is_stale (and
+dropped from search), and every write logged in trial_changes. No API
+key or network needed.
+
+    python test_trial_sync.py
+"""
+import asyncio
+import sqlite3
+from app.utils.database import (
+    CHANGE_ADDED,
+    CHANGE_STALE,
+    CHANGE_UPDATED,
+    get_trial_changes,
+    search_trials_by_condition,
+    sync_trials
+)
+from conftest import make_trial, run_tests, temp_database
+def snapshot():
+    return [
+        make_trial("NCT-A", ["Asthma"]),
+        make_trial("NCT-B", ["Asthma"], maximum_age="65 Years"),
+        make_trial("NCT-C", ["Asthma"])
+    ]
+def sync(trials, **kwargs):
+    return asyncio.run(sync_trials(trials, **kwargs))
+def changes(summary):
+    return sorted((c["nct_id"], c["change_type"]) for c in summary["changes"])
+def stored(path, column):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute(f"SELECT nct_id, {column} FROM trials ORDER BY nct_id"))
+def test_first_sync_adds_everything():
+    with temp_database():
+        summary = sync(snapshot())
+        assert (summary["added"], summary["updated"], summary["unchanged"], summary["stale"]) == (3, 0, 0, 0)
+        assert changes(summary) == [("NCT-A", CHANGE_ADDED), ("NCT-B", CHANGE_ADDED), ("NCT-C", CHANGE_ADDED)]
+def test_delta_sync():
+    with temp_database() as path:
+        sync(snapshot())
+        hashes = stored(path, "content_hash")
+        # Same snapshot, keys in another order: nothing written
+        reordered = [dict(reversed(list(trial.items()))) for trial in snapshot()]
+        summary = sync(reordered, batch_size=2)
+        assert (summary["added"], summary["updated"], summary["unchanged"], summary["stale"]) == (0, 0, 3, 0)
+        assert summary["changes"] == [] and asyncio.run(get_trial_changes(summary["sync_id"])) == []
+        # B changed, C removed, D new
+        trials = snapshot()[:2] + [make_trial("NCT-D", ["Asthma"])]
+        trials[1]["maximum_age"] = "70 Years"
+        summary = sync(trials, batch_size=2)
+        assert (summary["added"], summary["updated"], summary["unchanged"], summary["stale"]) == (1, 1, 1, 1)
+        assert changes(summary) == [("NCT-B", CHANGE_UPDATED), ("NCT-C", CHANGE_STALE), ("NCT-D", CHANGE_ADDED)]
+        new_hashes = stored(path, "content_hash")
+        assert new_hashes["NCT-A"] == hashes["NCT-A"] and new_hashes["NCT-B"] != hashes["NCT-B"]
+        assert stored(path, "max_age_months")["NCT-B"] == 840
+        # The stale trial is kept but no longer found
+        assert stored(path, "is_stale") == {"NCT-A": 0, "NCT-B": 0, "NCT-C": 1, "NCT-D": 0}
+        found = asyncio.run(search_trials_by_condition(["Asthma"], exact=True))
+        assert sorted(t["nct_id"] for t in found) == ["NCT-A", "NCT-B", "NCT-D"]
+        # One change log row per write, under the sync's id
+        logged = asyncio.run(get_trial_changes(summary["sync_id"]))
+        assert sorted((c["nct_id"], c["change_type"]) for c in logged) == changes(summary)
+        assert all(c["changed_at"] for c in logged)
+def test_stale_trial_comes_back():
+    with temp_database() as path:
+        sync(snapshot())
+        sync(snapshot()[:2])
+        # Unchanged content, but no longer stale: an update
+        summary = sync(snapshot())
+        assert (summary["added"], summary["updated"], summary["unchanged"], summary["stale"]) == (0, 1, 2, 0)
+        assert changes(summary) == [("NCT-C", CHANGE_UPDATED)]
+        assert stored(path, "is_stale")["NCT-C"] == 0
+def test_partial_snapshot_without_mark_stale():
+    with temp_database() as path:
+        sync(snapshot())
+        summary = sync(snapshot()[:1], mark_stale=False)
+        assert (summary["unchanged"], summary["stale"]) == (1, 0)
+        assert set(stored(path, "is_stale").values()) == {0}
+# Run test
+if __name__ == "__main__":
+    run_tests(globals(), "Trial sync checks passed")
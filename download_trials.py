@@ -1,8 +1,23 @@
 import requests
+import argparse
+import asyncio
+import gzip
+import io
+import itertools
 import json
 import time
 import os
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 # 1. Define the target conditions based on your Plan [cite: 94-99]
 CONDITIONS = [
     "Type 2 Diabetes",
@@ -14,67 +29,425 @@ CONDITIONS = [
 
 TARGET_PER_CONDITION = 2000  # Goal: 10,000 total 
 BASE_URL = "https://clinicaltrials.gov/api/v2/studies"
+DEFAULT_OUTPUT = "data/trials_10k.json"
+DEFAULT_ASYNC_OUTPUT = "data/trials_10k.ndjson.gz"
+
+# Async mode defaults
+CONCURRENCY = 4  # max requests in flight
+REQUESTS_PER_SECOND = 5.0  # across all conditions
+MAX_RETRIES = 3
+REQUEST_TIMEOUT = 30.0
+
+
+def open_output(path, append=False):
+    """
+    Open a text stream for writing, compressed by file extension
+    (.gz -> gzip, .zst -> zstandard, anything else -> plain text)
+
+    Appending to compressed files adds a new gzip member / zstd frame,
+    which readers decode as one continuous stream.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "at" if append else "wt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Writing .zst files requires the 'zstandard' package")
+        raw = open(path, "ab" if append else "wb")
+        stream = zstandard.ZstdCompressor().stream_writer(raw)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "a" if append else "w", encoding="utf-8")
+
+
+def open_input(path):
+    """Open a text stream for reading, decompressing by file extension"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Reading .zst files requires the 'zstandard' package")
+        raw = open(path, "rb")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def is_ndjson_path(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    name = name[:-4] if name.endswith(".zst") else name
+    return name.endswith(".ndjson") or name.endswith(".jsonl")
+
+
+# What reading a file cut off mid-write raises (gzip: no end-of-stream marker)
+TRUNCATION_ERRORS = (EOFError,) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def scan_ndjson(path):
+    """
+    nctIds of the intact records of an NDJSON file
+
+    A run killed mid-write leaves a half-written last line and, for
+    compressed output, no end-of-stream marker. Reading stops there;
+    damage anywhere before the tail raises ValueError.
+
+    Returns:
+        (nct_ids, intact_lines, truncated)
+    """
+    nct_ids = set()
+    intact_lines = 0
+    truncated = False
+    try:
+        with open_input(path) as f:
+            for line in f:
+                if truncated:
+                    if line.strip():
+                        raise ValueError(f"{path}: unreadable record at line {intact_lines + 1}")
+                    continue
+                if line.strip():
+                    try:
+                        study = json.loads(line)
+                    except json.JSONDecodeError:
+                        study = None
+                    # A line without its newline was cut off, even if it parses
+                    if study is None or not line.endswith("\n"):
+                        truncated = True
+                        continue
+                    nct_ids.add(study_nct_id(study))
+                intact_lines += 1
+    except TRUNCATION_ERRORS:
+        truncated = True
+    return nct_ids, intact_lines, truncated
+
+
+def keep_first_lines(path, count):
+    """Rewrite a (possibly truncated) NDJSON file with only its first `count` lines"""
+    directory, name = os.path.split(path)
+    # Same extension, so the copy is compressed the same way
+    tmp_path = os.path.join(directory, ".partial-" + name)
+    with open_input(path) as source, open_output(tmp_path) as target:
+        # islice stops before reading into the cut-off tail
+        for line in itertools.islice(source, count):
+            target.write(line)
+    os.replace(tmp_path, path)
+
+
+def study_nct_id(study):
+    return (
+        study.get("protocolSection", {})
+        .get("identificationModule", {})
+        .get("nctId")
+    )
+
+
+class TrialWriter:
+    """
+    Writes studies to disk as they arrive, so memory stays flat
+
+    - *.ndjson / *.jsonl (optionally .gz/.zst): one study per line
+    - anything else: a JSON array, written element by element
+
+    Studies whose nctId was already written are skipped, so trials that
+    show up under several conditions are stored once.
+    """
+
+    def __init__(self, path, append=False):
+        self.ndjson = is_ndjson_path(path)
+        if append and not self.ndjson:
+            raise ValueError("Only NDJSON output can be appended to")
+        self.path = path
+        self.count = 0
+        self.duplicates = 0
+        self.seen_ids = set()
+        if append and os.path.exists(path):
+            # Resuming - remember what is already on disk
+            self.seen_ids, intact_lines, truncated = scan_ndjson(path)
+            if truncated:
+                # Appending after a cut-off line / gzip member would leave
+                # the file unreadable; that page is refetched anyway
+                print(f"⚠️ {path} was cut off mid-write - dropping its incomplete last record")
+                keep_first_lines(path, intact_lines)
+            self.count = len(self.seen_ids)
+        self._file = open_output(path, append=append)
+        if not self.ndjson:
+            self._file.write("[\n")
+
+    def write_many(self, studies):
+        """Write new studies, returns how many were not duplicates"""
+        written = 0
+        for study in studies:
+            nct_id = study_nct_id(study)
+            if nct_id:
+                if nct_id in self.seen_ids:
+                    self.duplicates += 1
+                    continue
+                self.seen_ids.add(nct_id)
+            if self.ndjson:
+                self._file.write(json.dumps(study) + "\n")
+            else:
+                if self.count:
+                    self._file.write(",\n")
+                self._file.write(json.dumps(study))
+            self.count += 1
+            written += 1
+        self._file.flush()
+        return written
+
+    def close(self):
+        if not self.ndjson:
+            self._file.write("\n]\n")
+        self._file.close()
+
+
+class Checkpoint:
+    """
+    Per-condition download progress (next page token, count, done),
+    saved after every page so an interrupted run can resume
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conditions = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.conditions = json.load(f).get("conditions", {})
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get(self, condition):
+        return self.conditions.get(condition, {})
+
+    def update(self, condition, next_page_token, count, done):
+        self.conditions[condition] = {
+            "next_page_token": next_page_token,
+            "count": count,
+            "done": done
+        }
+        # Write-then-rename so a crash never leaves a half-written checkpoint
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"conditions": self.conditions}, f)
+        os.replace(tmp_path, self.path)
 
-def download_trials():
-    all_trials = []
-    
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RateLimiter:
+    """Spaces requests at least 1/rate seconds apart across all tasks"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def download_trials(output_file=DEFAULT_OUTPUT):
     # Ensure data directory exists
-    if not os.path.exists('data'):
-        os.makedirs('data')
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
     print(f"🚀 Starting download. Target: {len(CONDITIONS) * TARGET_PER_CONDITION} trials.")
 
-    for condition in CONDITIONS:
-        print(f"\n📥 Fetching trials for: {condition}...")
-        count = 0
-        next_page_token = None
-        
-        while count < TARGET_PER_CONDITION:
-            # 2. Construct Query Parameters [cite: 556]
-            params = {
-                "query.cond": condition,
-                "filter.overallStatus": "RECRUITING", # Only active trials [cite: 108]
-                "pageSize": 100, # Max allowed per page
-                "format": "json"
-            }
+    writer = TrialWriter(output_file)
+    session = requests.Session()  # keep-alive across pages
+    try:
+        for condition in CONDITIONS:
+            print(f"\n📥 Fetching trials for: {condition}...")
+            count = 0
+            next_page_token = None
             
-            # Handle Pagination (ClinicalTrials.gov v2 API uses page tokens)
-            if next_page_token:
-                params["pageToken"] = next_page_token
-
-            try:
-                response = requests.get(BASE_URL, params=params)
-                response.raise_for_status()
-                data = response.json()
-                
-                studies = data.get('studies', [])
-                if not studies:
-                    print(f"   ⚠️ No more studies found for {condition}.")
-                    break
+            while count < TARGET_PER_CONDITION:
+                # 2. Construct Query Parameters [cite: 556]
+                params = {
+                    "query.cond": condition,
+                    "filter.overallStatus": "RECRUITING", # Only active trials [cite: 108]
+                    "pageSize": 100, # Max allowed per page
+                    "format": "json"
+                }
                 
-                # Add to master list
-                all_trials.extend(studies)
-                count += len(studies)
-                print(f"   ✅ Collected {count}/{TARGET_PER_CONDITION}...")
-                
-                # Check for next page
-                next_page_token = data.get('nextPageToken')
-                if not next_page_token:
+                # Handle Pagination (ClinicalTrials.gov v2 API uses page tokens)
+                if next_page_token:
+                    params["pageToken"] = next_page_token
+
+                try:
+                    response = session.get(BASE_URL, params=params)
+                    response.raise_for_status()
+                    data = response.json()
+                    
+                    studies = data.get('studies', [])
+                    if not studies:
+                        print(f"   ⚠️ No more studies found for {condition}.")
+                        break
+                    
+                    # 3. Write the page straight to disk [cite: 558]
+                    writer.write_many(studies)
+                    count += len(studies)
+                    print(f"   ✅ Collected {count}/{TARGET_PER_CONDITION}...")
+                    
+                    # Check for next page
+                    next_page_token = data.get('nextPageToken')
+                    if not next_page_token:
+                        break
+                    
+                    # Be nice to the API
+                    time.sleep(0.5)
+                    
+                except Exception as e:
+                    print(f"   ❌ Error: {e}")
                     break
-                
-                # Be nice to the API
-                time.sleep(0.5)
-                
-            except Exception as e:
-                print(f"   ❌ Error: {e}")
-                break
-                
-    # 3. Save to JSON [cite: 558]
-    output_file = "data/trials_10k.json"
-    with open(output_file, "w") as f:
-        json.dump(all_trials, f, indent=2)
+    finally:
+        writer.close()
+        session.close()
         
-    print(f"\n🎉 Success! Downloaded {len(all_trials)} trials to {output_file}")
+    print(f"\n🎉 Success! Downloaded {writer.count} trials to {output_file}")
+
+
+async def fetch_page(client, limiter, semaphore, base_url, params, max_retries=MAX_RETRIES):
+    """GET one page of studies, retrying with exponential backoff"""
+    for attempt in range(max_retries + 1):
+        await limiter.wait()
+        try:
+            async with semaphore:
+                response = await client.get(base_url, params=params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            # A client error won't change on retry (429 Too Many Requests will)
+            if attempt == max_retries or (status and 400 <= status < 500 and status != 429):
+                raise
+            wait_time = 2 ** attempt
+            print(f"   ⏳ {params.get('query.cond')}: {e} - retrying in {wait_time}s")
+            await asyncio.sleep(wait_time)
+
+
+async def download_condition(client, condition, writer, checkpoint, limiter, semaphore,
+                             base_url, target_per_condition, max_retries):
+    """Page through one condition from its checkpoint, returns True when finished"""
+    state = checkpoint.get(condition)
+    if state.get("done"):
+        print(f"   ⏭️  {condition}: already complete")
+        return True
+
+    count = state.get("count", 0)
+    next_page_token = state.get("next_page_token")
+    print(f"\n📥 Fetching trials for: {condition}" + (f" (resuming at {count})" if count else "..."))
+
+    while count < target_per_condition:
+        params = {
+            "query.cond": condition,
+            "filter.overallStatus": "RECRUITING",
+            "pageSize": 100,
+            "format": "json"
+        }
+        if next_page_token:
+            params["pageToken"] = next_page_token
+
+        try:
+            data = await fetch_page(client, limiter, semaphore, base_url, params, max_retries)
+        except Exception as e:
+            print(f"   ❌ {condition}: {e} - progress saved, rerun to resume")
+            return False
+
+        studies = data.get("studies", [])
+        written = writer.write_many(studies)
+        count += len(studies)
+        next_page_token = data.get("nextPageToken")
+        done = not studies or not next_page_token or count >= target_per_condition
+        checkpoint.update(condition, next_page_token, count, done)
+        print(f"   ✅ {condition}: {count}/{target_per_condition} ({written} new)")
+        if done:
+            break
+
+    return True
+
+
+async def download_trials_async(output_file=DEFAULT_ASYNC_OUTPUT, conditions=None,
+                                target_per_condition=TARGET_PER_CONDITION, base_url=BASE_URL,
+                                concurrency=CONCURRENCY, requests_per_second=REQUESTS_PER_SECOND,
+                                checkpoint_file=None, max_retries=MAX_RETRIES):
+    """
+    Download all conditions concurrently over one pooled keep-alive client
+
+    Pages are streamed to NDJSON output and de-duplicated by nctId. The
+    next page token of every condition is checkpointed, so rerunning after
+    an interruption continues where it stopped; the checkpoint is removed
+    once every condition is complete.
+
+    Returns:
+        True if every condition finished
+    """
+    if httpx is None:
+        raise RuntimeError("Async mode requires the 'httpx' package")
+    if not is_ndjson_path(output_file):
+        raise ValueError("Async mode writes NDJSON - use a .ndjson/.jsonl output (optionally .gz/.zst)")
+
+    conditions = conditions or CONDITIONS
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    checkpoint = Checkpoint(checkpoint_file or output_file + ".checkpoint.json")
+    resuming = checkpoint.exists
+    writer = TrialWriter(output_file, append=resuming)
+    limiter = RateLimiter(requests_per_second)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    print(f"🚀 Starting async download{' (resuming)' if resuming else ''}. "
+          f"Target: {len(conditions) * target_per_condition} trials.")
+
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT) as client:
+            results = await asyncio.gather(*[
+                download_condition(client, condition, writer, checkpoint, limiter, semaphore,
+                                   base_url, target_per_condition, max_retries)
+                for condition in conditions
+            ])
+    finally:
+        writer.close()
+
+    complete = all(results)
+    if complete:
+        checkpoint.remove()
+        print(f"\n🎉 Success! {writer.count} unique trials in {output_file} "
+              f"({writer.duplicates} duplicates skipped)")
+    else:
+        print(f"\n⚠️ Incomplete: {writer.count} unique trials so far. "
+              f"Rerun to resume from {checkpoint.path}")
+    return complete
 
 if __name__ == "__main__":
-    download_trials()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download recruiting trials from ClinicalTrials.gov")
+    parser.add_argument(
+        "--output",
+        help="Output file: .json (array) or .ndjson/.jsonl, optionally .gz/.zst compressed"
+    )
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Fetch conditions concurrently with resumable checkpoints")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="Max requests per second (async mode)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.json)")
+    args = parser.parse_args()
+
+    if args.use_async:
+        complete = asyncio.run(download_trials_async(
+            output_file=args.output or DEFAULT_ASYNC_OUTPUT,
+            concurrency=args.concurrency,
+            requests_per_second=args.rate,
+            checkpoint_file=args.checkpoint
+        ))
+        raise SystemExit(0 if complete else 1)
+    download_trials(args.output or DEFAULT_OUTPUT)
@@ -0,0 +1,192 @@
+"""
+Test the async downloader against a local stub of the v2 /studies API
+Run: python test_download_trials.py
+"""
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from download_trials import download_trials_async, open_input, study_nct_id
+
+PAGE_SIZE = 3
+# Condition -> nctIds; NCT0002/NCT0003 appear under both conditions
+STUB_STUDIES = {
+    "Diabetes": [f"NCT000{i}" for i in range(1, 8)],
+    "Hypertension": ["NCT0002", "NCT0003", "NCT0101", "NCT0102"],
+}
+
+
+class StubStudiesHandler(BaseHTTPRequestHandler):
+    """Serves /studies pages using an offset as the page token"""
+    requests_seen = []
+    fail_tokens = set()  # page tokens that return 500 (one-shot)
+    missing_tokens = set()  # page tokens that always return 404
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        condition = query["query.cond"][0]
+        token = query.get("pageToken", [None])[0]
+        type(self).requests_seen.append((condition, token))
+
+        if token in type(self).missing_tokens:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if token in type(self).fail_tokens:
+            type(self).fail_tokens.discard(token)
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        offset = int(token.split(":")[1]) if token else 0
+        ids = STUB_STUDIES[condition]
+        page = ids[offset:offset + PAGE_SIZE]
+        body = {"studies": [
+            {"protocolSection": {"identificationModule": {"nctId": nct_id, "briefTitle": nct_id}}}
+            for nct_id in page
+        ]}
+        if offset + PAGE_SIZE < len(ids):
+            body["nextPageToken"] = f"{condition}:{offset + PAGE_SIZE}"
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStudiesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/studies"
+
+
+def read_ids(path):
+    with open_input(path) as f:
+        return [study_nct_id(json.loads(line)) for line in f if line.strip()]
+
+
+def run_download(output, base_url, max_retries=0):
+    return asyncio.run(download_trials_async(
+        output_file=output,
+        conditions=list(STUB_STUDIES),
+        target_per_condition=100,
+        base_url=base_url,
+        concurrency=2,
+        requests_per_second=0,
+        max_retries=max_retries
+    ))
+
+
+def simulate_hard_kill(output):
+    """
+    Rewrite output as a killed run leaves it: records flushed but the file
+    never closed, and a half-written record at the end
+    """
+    with open_input(output) as f:
+        lines = f.readlines()
+    partial = '{"protocolSection": {"identificationModule": {"nctId": "NCT09'
+    if output.endswith(".gz"):
+        raw = io.BytesIO()
+        stream = gzip.GzipFile(fileobj=raw, mode="wb")
+        stream.write("".join(lines).encode())
+        stream.write(partial.encode())
+        stream.flush()
+        with open(output, "wb") as f:
+            f.write(raw.getvalue())  # no end-of-stream marker
+    else:
+        with open(output, "a") as f:
+            f.write(partial)
+
+
+def test_download_dedupes_across_conditions():
+    server, base_url = start_stub_server()
+    StubStudiesHandler.requests_seen = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "trials.ndjson.gz")
+            assert run_download(output, base_url)
+
+            ids = read_ids(output)
+            expected = set(STUB_STUDIES["Diabetes"]) | set(STUB_STUDIES["Hypertension"])
+            assert sorted(ids) == sorted(expected)
+            assert not os.path.exists(output + ".checkpoint.json")
+    finally:
+        server.shutdown()
+
+
+def test_interrupted_download_resumes_from_checkpoint():
+    server, base_url = start_stub_server()
+    StubStudiesHandler.requests_seen = []
+    StubStudiesHandler.fail_tokens = {"Diabetes:3"}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "trials.ndjson")
+
+            # First run fails on Diabetes page 2 and leaves a checkpoint
+            assert not run_download(output, base_url)
+            checkpoint = output + ".checkpoint.json"
+            with open(checkpoint) as f:
+                state = json.load(f)["conditions"]
+            assert state["Diabetes"] == {"next_page_token": "Diabetes:3", "count": 3, "done": False}
+            assert state["Hypertension"]["done"]
+
+            # Second run only fetches what is missing
+            StubStudiesHandler.requests_seen = []
+            assert run_download(output, base_url)
+            assert StubStudiesHandler.requests_seen == [("Diabetes", "Diabetes:3"), ("Diabetes", "Diabetes:6")]
+
+            ids = read_ids(output)
+            assert len(ids) == len(set(ids)) == 9
+            assert not os.path.exists(checkpoint)
+    finally:
+        server.shutdown()
+
+
+def test_resume_after_hard_kill():
+    for name in ("trials.ndjson.gz", "trials.ndjson"):
+        server, base_url = start_stub_server()
+        StubStudiesHandler.fail_tokens = {"Diabetes:3"}
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                output = os.path.join(tmp, name)
+                assert not run_download(output, base_url)
+                simulate_hard_kill(output)
+
+                assert run_download(output, base_url)
+                ids = read_ids(output)
+                assert len(ids) == len(set(ids)) == 9, name
+        finally:
+            server.shutdown()
+
+
+def test_client_errors_are_not_retried():
+    server, base_url = start_stub_server()
+    StubStudiesHandler.requests_seen = []
+    StubStudiesHandler.missing_tokens = {"Diabetes:3"}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            assert not run_download(os.path.join(tmp, "trials.ndjson"), base_url, max_retries=3)
+            assert StubStudiesHandler.requests_seen.count(("Diabetes", "Diabetes:3")) == 1
+    finally:
+        StubStudiesHandler.missing_tokens = set()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_download_dedupes_across_conditions()
+    test_interrupted_download_resumes_from_checkpoint()
+    test_resume_after_hard_kill()
+    test_client_errors_are_not_retried()
+    print("✅ Downloader tests passed!")